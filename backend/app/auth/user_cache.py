@@ -0,0 +1,116 @@
+import logging
+import time
+from collections import OrderedDict
+from bson.objectid import ObjectId
+from fastapi import HTTPException, status
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import PyMongoError
+from app.auth.jwt_handler import JWTHandler
+from app.config import (
+    AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL_SECONDS, AUTH_USER_FRESH_SECONDS, AUTH_TOKEN_CACHE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class VerifiedUserCache:
+    """Users recently loaded for a valid token, keyed by user id.
+
+    Entries younger than AUTH_USER_FRESH_SECONDS answer requests without a
+    database read. Older ones are only consulted while the database is
+    unavailable, so requests that need nothing else from it (grammar,
+    paraphrase, translate, OCR) keep working in degraded mode. Entries expire
+    after ``ttl_seconds`` (the token lifetime by default); the least recently
+    used ones go first when the cache is full.
+    """
+
+    def __init__(self, max_entries: int = AUTH_USER_CACHE_SIZE, ttl_seconds: int = AUTH_USER_CACHE_TTL_SECONDS):
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def remember(self, user: dict):
+        if self.max_entries <= 0:
+            return
+        key = str(user['_id'])
+        self._entries[key] = (time.monotonic(), user)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, user_id: str, max_age: float | None = None) -> dict | None:
+        """Cached user, if loaded less than ``max_age`` (default the TTL) seconds ago."""
+        entry = self._entries.get(str(user_id))
+        if entry is None:
+            return None
+        loaded_at, user = entry
+        age = time.monotonic() - loaded_at
+        if age >= self.ttl_seconds:
+            del self._entries[str(user_id)]
+            return None
+        if max_age is not None and age >= max_age:
+            return None
+        self._entries.move_to_end(str(user_id))
+        return user
+
+    def forget(self, user_id):
+        self._entries.pop(str(user_id), None)
+
+
+class VerifiedTokenCache:
+    """Decoded payloads of tokens that passed verification, until their ``exp``.
+
+    Saves decoding and checking the signature of the same bearer token on
+    every request of a session.
+    """
+
+    def __init__(self, max_entries: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_entries = max(0, max_entries)
+        self._entries = OrderedDict()
+
+    def verify(self, token: str) -> dict | None:
+        """Payload of a valid token, None otherwise (like JWTHandler.verify_token)."""
+        payload = self._entries.get(token)
+        if payload is not None:
+            if payload['exp'] > time.time():
+                self._entries.move_to_end(token)
+                return payload
+            del self._entries[token]
+
+        payload = JWTHandler.verify_token(token)
+        if payload and self.max_entries > 0 and isinstance(payload.get('exp'), (int, float)):
+            self._entries[token] = payload
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+
+verified_users = VerifiedUserCache()
+verified_tokens = VerifiedTokenCache()
+
+
+async def load_user(db: AsyncDatabase | None, user_id: str) -> dict | None:
+    """User for a verified token: freshly cached, else from the database (cached while it is down)."""
+    user = verified_users.get(user_id, max_age=AUTH_USER_FRESH_SECONDS)
+    if user is not None:
+        return user
+
+    if db is not None:
+        try:
+            user = await db.users.find_one({'_id': ObjectId(user_id)})
+        except PyMongoError as e:
+            logger.warning(f"Auth DB error while fetching current user, using cache: {e}")
+        else:
+            if user is None:
+                verified_users.forget(user_id)
+            else:
+                verified_users.remember(user)
+            return user
+
+    user = verified_users.get(user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service temporarily unavailable"
+        )
+    return user
@@ -27,6 +27,13 @@ def _first_env(*keys: str, default: str = "") -> str:
                 return cleaned
     return default
 
+
+def _int_env(key: str, default: int, minimum: int = 0) -> int:
+    try:
+        return max(minimum, int(os.getenv(key, str(default))))
+    except ValueError:
+        return default
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 ENV_PATH = BASE_DIR / ".env"
 load_dotenv(dotenv_path=ENV_PATH, override=True)
@@ -45,11 +52,35 @@ DATABASE_NAME = _first_env(
     "MONGO_DB_NAME",
     default="text_analyzer",
 )
+# Connection pool of each client (the sync and async clients have one each);
+# 0 idle time keeps idle connections open.
+MONGO_MAX_POOL_SIZE = _int_env("MONGO_MAX_POOL_SIZE", 100, minimum=1)
+MONGO_MIN_POOL_SIZE = _int_env("MONGO_MIN_POOL_SIZE", 0)
+MONGO_MAX_IDLE_TIME_MS = _int_env("MONGO_MAX_IDLE_TIME_MS", 0)
+# Server heartbeats drive the connection health flag; the client is rebuilt
+# (trying every URI candidate again) once all servers have been down this long.
+MONGO_HEARTBEAT_FREQUENCY_MS = _int_env("MONGO_HEARTBEAT_FREQUENCY_MS", 10000, minimum=500)
+MONGO_RECONNECT_AFTER_SECONDS = _int_env("MONGO_RECONNECT_AFTER_SECONDS", 60, minimum=1)
+# Stats and search may be served by a secondary lagging at most this much
+# (the driver requires 90s or more, and heartbeat frequency plus 10s).
+MONGO_STALE_READ_MAX_STALENESS_SECONDS = _int_env("MONGO_STALE_READ_MAX_STALENESS_SECONDS", 90, minimum=90)
+# Latency percentiles of each consistency profile cover this many recent operations.
+MONGO_PROFILE_LATENCY_WINDOW = _int_env("MONGO_PROFILE_LATENCY_WINDOW", 500, minimum=10)
 
 # JWT Configuration
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-this-in-production")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
+# Users whose token was verified against the database, kept so authentication
+# keeps working while it is unreachable (degraded mode).
+AUTH_USER_CACHE_SIZE = _int_env("AUTH_USER_CACHE_SIZE", 10000)
+AUTH_USER_CACHE_TTL_SECONDS = _int_env("AUTH_USER_CACHE_TTL_SECONDS", JWT_EXPIRATION_HOURS * 3600)
+# While the database is up, a cached user is reused for this long before it
+# is read again (0 reads it on every request). Writes through the auth routes
+# refresh it at once; other workers may serve the old copy until it ages out.
+AUTH_USER_FRESH_SECONDS = _int_env("AUTH_USER_FRESH_SECONDS", 60)
+# Decoded payloads of verified tokens, kept until the token expires.
+AUTH_TOKEN_CACHE_SIZE = _int_env("AUTH_TOKEN_CACHE_SIZE", 10000)
 
 # Application Configuration
 APP_NAME = "TextAnalyzer API"
@@ -82,6 +113,7 @@ ALLOWED_ORIGIN_REGEX = os.getenv(
 
 # File Upload Configuration
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_IMAGE_PIXELS = 10_000_000  # 10MP
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "application/pdf"}
 
 # API Rate Limiting
@@ -91,6 +123,62 @@ RATE_LIMIT_PERIOD = timedelta(hours=1)
 # Batch Processing
 MAX_BATCH_SIZE = 5
 BATCH_TIMEOUT = 300  # 5 minutes
+# Items of one batch run concurrently up to this cap; each item gets its own timeout.
+BATCH_CONCURRENCY = _int_env("BATCH_CONCURRENCY", 4, minimum=1)
+BATCH_ITEM_TIMEOUT = _int_env("BATCH_ITEM_TIMEOUT", 60, minimum=1)
+# Threads shared by all synchronous batch requests. An item that timed out keeps
+# its thread until it really returns, so this bounds the runaway work too.
+BATCH_WORKER_THREADS = _int_env("BATCH_WORKER_THREADS", 16, minimum=1)
+# /api/batch/process/stream sends results as they finish, so it can take more items.
+MAX_STREAM_BATCH_SIZE = _int_env("MAX_STREAM_BATCH_SIZE", 500, minimum=1)
+# Files per multipart upload to /api/batch/ocr (each still capped at MAX_FILE_SIZE).
+MAX_OCR_BATCH_FILES = _int_env("MAX_OCR_BATCH_FILES", 20, minimum=1)
+
+# Write-behind buffer for processing_history inserts: documents are flushed
+# with one insert_many per HISTORY_WRITE_BATCH_SIZE items or HISTORY_WRITE_FLUSH_MS.
+HISTORY_WRITE_QUEUE_SIZE = _int_env("HISTORY_WRITE_QUEUE_SIZE", 10000, minimum=1)
+HISTORY_WRITE_BATCH_SIZE = _int_env("HISTORY_WRITE_BATCH_SIZE", 500, minimum=1)
+HISTORY_WRITE_FLUSH_MS = _int_env("HISTORY_WRITE_FLUSH_MS", 500, minimum=10)
+# Local spool for history writes while MongoDB is unreachable, replayed in order
+# once it is back. When full, "drop_oldest" or "drop_newest" decides what goes.
+HISTORY_SPOOL_PATH = os.getenv("HISTORY_SPOOL_PATH", str(BASE_DIR / "history_spool.sqlite3"))
+HISTORY_SPOOL_MAX_ITEMS = _int_env("HISTORY_SPOOL_MAX_ITEMS", 50000)
+HISTORY_SPOOL_OVERFLOW = os.getenv("HISTORY_SPOOL_OVERFLOW", "drop_oldest").strip().lower()
+# Characters of input/output text stored as list previews on each history item.
+HISTORY_PREVIEW_CHARS = _int_env("HISTORY_PREVIEW_CHARS", 200, minimum=1)
+# Texts stored compressed or in text_blobs keep their first this many characters
+# as plain search_text, so history search still covers them.
+HISTORY_SEARCH_TEXT_CHARS = _int_env("HISTORY_SEARCH_TEXT_CHARS", 8192, minimum=1)
+# input_text/output_text of at least this many UTF-8 bytes are stored zlib-compressed.
+HISTORY_COMPRESS_MIN_BYTES = _int_env("HISTORY_COMPRESS_MIN_BYTES", 4096, minimum=1)
+HISTORY_COMPRESS_LEVEL = min(9, _int_env("HISTORY_COMPRESS_LEVEL", 6, minimum=1))
+# Texts of at least this many UTF-8 bytes are stored once per content in
+# text_blobs (compressed there too) and referenced from history (0 disables);
+# smaller ones from HISTORY_COMPRESS_MIN_BYTES up are compressed inline. Never
+# below the compression threshold. Blobs untouched for the grace period are
+# recounted by the retention sweeper.
+HISTORY_BLOB_MIN_BYTES = _int_env("HISTORY_BLOB_MIN_BYTES", 16384)
+if HISTORY_BLOB_MIN_BYTES > 0:
+    HISTORY_BLOB_MIN_BYTES = max(HISTORY_BLOB_MIN_BYTES, HISTORY_COMPRESS_MIN_BYTES)
+TEXT_BLOB_GC_GRACE_SECONDS = _int_env("TEXT_BLOB_GC_GRACE_SECONDS", 3600, minimum=60)
+TEXT_BLOB_GC_BATCH_SIZE = _int_env("TEXT_BLOB_GC_BATCH_SIZE", 200, minimum=1)
+# History is stored in monthly processing_history_YYYY_MM collections; the list
+# of existing partitions is re-read at most this often.
+HISTORY_PARTITION_REFRESH_SECONDS = _int_env("HISTORY_PARTITION_REFRESH_SECONDS", 60, minimum=1)
+# Months older than this are compressed into the archive and dropped by the
+# retention sweeper (0 keeps every month online). With HISTORY_ARCHIVE_DIR set
+# the archive is written as gzipped BSON files there instead of history_archive.
+HISTORY_ARCHIVE_AFTER_MONTHS = _int_env("HISTORY_ARCHIVE_AFTER_MONTHS", 0)
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "").strip()
+HISTORY_ARCHIVE_CHUNK_ITEMS = _int_env("HISTORY_ARCHIVE_CHUNK_ITEMS", 500, minimum=1)
+
+# Durable batch jobs (POST /api/batch/jobs): items are leased by background
+# workers on every API instance and retried independently.
+MAX_BATCH_JOB_SIZE = _int_env("MAX_BATCH_JOB_SIZE", 5000, minimum=1)
+BATCH_JOB_WORKERS = _int_env("BATCH_JOB_WORKERS", 4, minimum=1)
+BATCH_JOB_LEASE_SECONDS = _int_env("BATCH_JOB_LEASE_SECONDS", 120, minimum=10)
+BATCH_JOB_MAX_ATTEMPTS = _int_env("BATCH_JOB_MAX_ATTEMPTS", 3, minimum=1)
+BATCH_JOB_RETENTION_HOURS = _int_env("BATCH_JOB_RETENTION_HOURS", 168, minimum=1)
 
 # Single free-provider strategy (recommended for production simplicity)
 # Allowed: auto | tesseract | ocr_space
@@ -100,6 +188,41 @@ TESSERACT_LANG = os.getenv("TESSERACT_LANG", "eng")
 OCR_SPACE_API_KEY = os.getenv("OCR_SPACE_API_KEY", "helloworld")
 OCR_SPACE_LANGUAGE = os.getenv("OCR_SPACE_LANGUAGE", "eng")
 
+# Local Tesseract worker pool. Defaults to one worker per CPU core.
+# Images taller than OCR_TILE_HEIGHT are split into overlapping strips
+# that are recognized in parallel and stitched back together.
+OCR_WORKER_COUNT = _int_env("OCR_WORKER_COUNT", os.cpu_count() or 1, minimum=1)
+OCR_TILE_HEIGHT = _int_env("OCR_TILE_HEIGHT", 2000, minimum=200)
+OCR_TILE_OVERLAP = _int_env("OCR_TILE_OVERLAP", 160)
+
+# Auto mode races OCR.Space against local Tesseract and keeps the first result
+# with at least OCR_AUTO_MIN_TEXT_CHARS characters. OCR.Space reports no
+# confidence, so only Tesseract results are also held to OCR_AUTO_MIN_CONFIDENCE.
+try:
+    OCR_AUTO_MIN_CONFIDENCE = min(1.0, max(0.0, float(os.getenv("OCR_AUTO_MIN_CONFIDENCE", "0.6"))))
+except ValueError:
+    OCR_AUTO_MIN_CONFIDENCE = 0.6
+OCR_AUTO_MIN_TEXT_CHARS = _int_env("OCR_AUTO_MIN_TEXT_CHARS", 3, minimum=1)
+# Threads running race providers. An abandoned OCR.Space call keeps its thread
+# until OCR_SPACE_TIMEOUT_SECONDS, so those calls may hold at most half of them.
+OCR_PROVIDER_THREADS = _int_env("OCR_PROVIDER_THREADS", 16, minimum=2)
+OCR_SPACE_TIMEOUT_SECONDS = _int_env("OCR_SPACE_TIMEOUT_SECONDS", 40, minimum=1)
+
+# Number of image URLs whose OCR result and ETag/Last-Modified validators are
+# kept for conditional re-fetches. Set 0 to disable.
+OCR_URL_CACHE_SIZE = _int_env("OCR_URL_CACHE_SIZE", 256)
+# Total time allowed for downloading an image URL. The requests timeout only
+# bounds each socket read, so a server trickling bytes could hold a thread forever.
+OCR_URL_FETCH_TIMEOUT_SECONDS = _int_env("OCR_URL_FETCH_TIMEOUT_SECONDS", 30, minimum=1)
+
+# Asynchronous OCR jobs (POST /api/ocr/jobs). Jobs live in the ocr_jobs
+# collection; workers lease them so several instances can share the queue.
+OCR_JOB_WORKERS = _int_env("OCR_JOB_WORKERS", 2, minimum=1)
+OCR_JOB_LEASE_SECONDS = _int_env("OCR_JOB_LEASE_SECONDS", 120, minimum=10)
+OCR_JOB_MAX_ATTEMPTS = _int_env("OCR_JOB_MAX_ATTEMPTS", 3, minimum=1)
+OCR_JOB_POLL_SECONDS = _int_env("OCR_JOB_POLL_SECONDS", 2, minimum=1)
+OCR_JOB_RETENTION_HOURS = _int_env("OCR_JOB_RETENTION_HOURS", 24, minimum=1)
+
 # Text provider strategy
 # - free_single: deep-translator as primary for translation/paraphrase, LanguageTool public for grammar.
 # - local_only: local heuristic/rule-based pipeline only.
@@ -110,3 +233,10 @@ try:
     OCR_HISTORY_RETENTION_DAYS = max(0, int(os.getenv("OCR_HISTORY_RETENTION_DAYS", "30")))
 except ValueError:
     OCR_HISTORY_RETENTION_DAYS = 30
+
+# Retention sweeper: hands OCR history written without ocr_expires_at over to
+# the TTL index in small batches, roughly every RETENTION_SWEEP_INTERVAL_SECONDS.
+RETENTION_SWEEP_INTERVAL_SECONDS = _int_env("RETENTION_SWEEP_INTERVAL_SECONDS", 3600, minimum=60)
+RETENTION_SWEEP_BATCH_SIZE = _int_env("RETENTION_SWEEP_BATCH_SIZE", 500, minimum=1)
+RETENTION_SWEEP_MAX_BATCHES = _int_env("RETENTION_SWEEP_MAX_BATCHES", 20, minimum=1)
+RETENTION_SWEEP_PAUSE_MS = _int_env("RETENTION_SWEEP_PAUSE_MS", 200)
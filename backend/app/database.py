@@ -1,22 +1,233 @@
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient, monitoring
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Database
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo.write_concern import WriteConcern
 from pymongo.errors import ServerSelectionTimeoutError
 from bson.objectid import ObjectId
-from contextlib import asynccontextmanager
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import HTTPException, status
-from app.config import MONGODB_URL, DATABASE_NAME, OCR_HISTORY_RETENTION_DAYS, DEBUG
+from fastapi.concurrency import run_in_threadpool
+from app.config import (
+    MONGODB_URL, DATABASE_NAME, DEBUG,
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS,
+    MONGO_HEARTBEAT_FREQUENCY_MS, MONGO_RECONNECT_AFTER_SECONDS,
+    MONGO_STALE_READ_MAX_STALENESS_SECONDS, MONGO_PROFILE_LATENCY_WINDOW,
+)
+from app.services.history_partitions import HistoryPartitions, create_index
 from dotenv import load_dotenv
 import os
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from urllib.parse import urlsplit, parse_qsl, urlencode, urlunsplit
 import certifi
 
 logger = logging.getLogger(__name__)
 
+
+class ConnectionHealthMonitor(monitoring.ServerHeartbeatListener, monitoring.ServerListener):
+    """Connection health from the driver's own server heartbeats.
+
+    The driver's monitor threads already check every server each
+    ``heartbeatFrequencyMS``; this listener records the outcome per server so
+    request handlers can read the health flag instead of pinging. The
+    connection is healthy while at least one server answers.
+    """
+
+    def __init__(self, active: bool = True):
+        # Probe clients get an inactive monitor until they win the race.
+        self.active = active
+        self._lock = threading.Lock()
+        self._servers = {}
+        self._unhealthy_since: float | None = None
+        self._stats = {
+            'heartbeats': 0,
+            'failed_heartbeats': 0,
+            'last_heartbeat_ms': None,
+            'last_error': None,
+            'last_change_at': None,
+        }
+
+    @property
+    def healthy(self) -> bool:
+        return self._unhealthy_since is None
+
+    def unhealthy_for(self) -> float:
+        """Seconds since every server stopped answering (0 when healthy)."""
+        since = self._unhealthy_since
+        return 0.0 if since is None else time.monotonic() - since
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'healthy': self.healthy,
+                'unhealthy_for_seconds': round(self.unhealthy_for(), 1),
+                'servers': {f"{host}:{port}": up for (host, port), up in self._servers.items()},
+                **self._stats,
+            }
+
+    def _record(self, address, up: bool):
+        with self._lock:
+            self._servers[address] = up
+            was_healthy = self._unhealthy_since is None
+            now_healthy = any(self._servers.values())
+            if was_healthy == now_healthy:
+                return
+            self._unhealthy_since = None if now_healthy else time.monotonic()
+            self._stats['last_change_at'] = datetime.utcnow().isoformat()
+        if not self.active:
+            return
+        if now_healthy:
+            logger.info("MongoDB connection is healthy again")
+        else:
+            logger.warning(f"MongoDB connection is unhealthy: {self._stats['last_error']}")
+
+    # ---- heartbeat events (driver monitor threads) ----
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._stats['heartbeats'] += 1
+        self._stats['last_heartbeat_ms'] = round(event.duration * 1000, 2)
+        self._record(event.connection_id, True)
+
+    def failed(self, event):
+        self._stats['failed_heartbeats'] += 1
+        self._stats['last_error'] = f"{type(event.reply).__name__}: {event.reply}"
+        self._record(event.connection_id, False)
+
+    # ---- server events ----
+
+    def opened(self, event):
+        pass
+
+    def description_changed(self, event):
+        pass
+
+    def closed(self, event):
+        # Servers removed from the topology (e.g. SRV changes) no longer count.
+        with self._lock:
+            self._servers.pop(event.server_address, None)
+
+
+# Consistency profiles, picked per operation with MongoDB.consistency().
+PROFILE_DEFAULT = "default"
+PROFILE_FAST_WRITE = "fast_write"
+PROFILE_DURABLE = "durable"
+PROFILE_STALE_READ = "stale_read"
+
+
+class ConsistencyProfile:
+    """A named combination of write concern, read concern and read preference.
+
+    Options left as None keep the client's (URI) defaults. Every operation run
+    under the profile is timed, so the cost of each consistency level shows up
+    on ``/health/db``.
+    """
+
+    def __init__(self, name: str, purpose: str, write_concern: WriteConcern | None = None,
+                 read_concern: ReadConcern | None = None, read_preference=None):
+        self.name = name
+        self.purpose = purpose
+        self.options = {
+            key: value for key, value in (
+                ('write_concern', write_concern),
+                ('read_concern', read_concern),
+                ('read_preference', read_preference),
+            ) if value is not None
+        }
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=MONGO_PROFILE_LATENCY_WINDOW)
+        self._stats = {'operations': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+
+    def apply(self, db):
+        """``db`` (sync or async) with this profile's options."""
+        return db.with_options(**self.options) if self.options else db
+
+    def record(self, elapsed_ms: float, failed: bool = False):
+        with self._lock:
+            self._stats['operations'] += 1
+            self._stats['errors'] += int(failed)
+            self._stats['total_ms'] += elapsed_ms
+            self._stats['max_ms'] = max(self._stats['max_ms'], elapsed_ms)
+            self._latencies.append(elapsed_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = dict(self._stats)
+
+        def percentile(p: float):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2) if latencies else None
+
+        return {
+            'purpose': self.purpose,
+            'write_concern': self.options['write_concern'].document if 'write_concern' in self.options else None,
+            'read_concern': self.options['read_concern'].level if 'read_concern' in self.options else None,
+            'read_preference': self.options['read_preference'].document if 'read_preference' in self.options else None,
+            'operations': stats['operations'],
+            'errors': stats['errors'],
+            'avg_ms': round(stats['total_ms'] / stats['operations'], 2) if stats['operations'] else None,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+            'max_ms': round(stats['max_ms'], 2),
+        }
+
+
+CONSISTENCY_PROFILES = {
+    profile.name: profile for profile in (
+        ConsistencyProfile(PROFILE_DEFAULT, "client defaults (listings, lookups)"),
+        # Losing the last few history items in a failover is acceptable;
+        # majority commit latency on every save is not.
+        ConsistencyProfile(
+            PROFILE_FAST_WRITE, "history inserts and export flags",
+            write_concern=WriteConcern(w=1)
+        ),
+        # A password change or deletion must not roll back after a failover,
+        # and reads right after it must see it.
+        ConsistencyProfile(
+            PROFILE_DURABLE, "user and auth writes",
+            write_concern=WriteConcern(w="majority"), read_concern=ReadConcern("majority")
+        ),
+        ConsistencyProfile(
+            PROFILE_STALE_READ, "history stats and search",
+            read_preference=SecondaryPreferred(max_staleness=max(
+                MONGO_STALE_READ_MAX_STALENESS_SECONDS, MONGO_HEARTBEAT_FREQUENCY_MS // 1000 + 10
+            ))
+        ),
+    )
+}
+
+
 class MongoDB:
+    """Process-wide MongoDB handles.
+
+    ``db`` is the synchronous handle used by background threads, services run
+    in the thread pool, and scripts. Route handlers get ``async_db`` (PyMongo's
+    native async API) so their queries do not block the event loop; it is
+    created on the event loop for each successful ``connect_db`` and reuses the
+    URI and options that connected.
+    """
     client: MongoClient = None
     db: Database = None
+    async_client: AsyncMongoClient = None
+    async_db: AsyncDatabase = None
+    # Replaced with the winning client's own monitor on every connect.
+    health = ConnectionHealthMonitor()
+    _connect_lock = threading.Lock()
+    _reconnect_lock = threading.Lock()
+    _reconnect_thread: threading.Thread | None = None
+    # Bumped by every successful connect_db; the async client follows it.
+    _generation: int = 0
+    _async_generation: int = 0
+    _client_uri: str | None = None
+    _client_options: dict = {}
     _last_failure_at: float | None = None
     _last_failure_reason: str | None = None
 
@@ -151,15 +362,113 @@ class MongoDB:
             "mongo_max_uri_candidates": max_candidates,
             "estimated_uri_candidates": min(inferred_candidate_count, max_candidates),
             "last_failure_reason": cls._last_failure_reason,
+            "connected_host": cls._uri_host(cls._client_uri) if cls.client is not None else None,
+            "reconnecting": cls._reconnect_thread is not None and cls._reconnect_thread.is_alive(),
+            "pool": {
+                "max_pool_size": MONGO_MAX_POOL_SIZE,
+                "min_pool_size": min(MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE),
+                "max_idle_time_ms": MONGO_MAX_IDLE_TIME_MS or None,
+            },
+            "monitor": cls.health.snapshot(),
+            "consistency_profiles": cls.consistency_snapshot(),
         }
 
+    @classmethod
+    def _candidate_ranks(cls, candidates: list, preferred: str | None) -> list:
+        """Priority of each candidate (lower wins); variants of one host share a rank.
+
+        The generated SRV variants point at the same cluster as the configured
+        URI, so whichever answers first is fine. An explicit fallback (or the
+        local one) only wins once everything ranked before it has failed. The
+        candidate that connected last time ranks first, with its variants.
+        """
+        def host(uri: str) -> str:
+            return urlsplit(uri).netloc
+
+        order = []
+        if preferred in candidates:
+            order.append(host(preferred))
+        for uri in candidates:
+            if host(uri) not in order:
+                order.append(host(uri))
+        return [order.index(host(uri)) for uri in candidates]
+
+    @classmethod
+    def _probe(cls, uri: str, options: dict) -> tuple:
+        """Open a client on ``uri`` and ping it; returns (client, health monitor)."""
+        monitor = ConnectionHealthMonitor(active=False)
+        client = MongoClient(uri, event_listeners=[monitor], **options)
+        try:
+            # Test connection using admin database on client
+            client.admin.command('ping')
+        except Exception:
+            client.close()
+            raise
+        return client, monitor
+
+    @staticmethod
+    def _close_probe(future):
+        """Close the client of a probe that lost the race, once it finishes."""
+        if not future.cancelled() and future.exception() is None:
+            try:
+                future.result()[0].close()
+            except Exception:
+                pass
+
+    @classmethod
+    def _probe_candidates(cls, candidates: list, ranks: list, options: dict) -> tuple:
+        """Ping all candidates at once; returns (uri, client, monitor) of the winner.
+
+        Each probe may wait the full server selection timeout, so probing them
+        one after another added those waits up on cold start and reconnect.
+        """
+        executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="mongo-probe")
+        futures = [executor.submit(cls._probe, uri, options) for uri in candidates]
+        index_of = {future: index for index, future in enumerate(futures)}
+        failed = set()
+        succeeded = {}
+        errors = []
+        winner = None
+        try:
+            for future in as_completed(futures):
+                index = index_of[future]
+                try:
+                    succeeded[index] = future.result()
+                except Exception as e:
+                    failed.add(index)
+                    errors.append(f"{type(e).__name__}: {e}")
+
+                for candidate in sorted(succeeded, key=lambda i: (ranks[i], i)):
+                    # Done once nothing ranked above this success is still pending.
+                    if all(i in failed for i in range(len(candidates)) if ranks[i] < ranks[candidate]):
+                        winner = candidate
+                    break
+                if winner is not None:
+                    break
+        finally:
+            executor.shutdown(wait=False)
+            for index, future in enumerate(futures):
+                if index != winner:
+                    future.add_done_callback(cls._close_probe)
+
+        if winner is None:
+            raise RuntimeError(" | ".join(errors[-2:]))
+        client, monitor = succeeded[winner]
+        return candidates[winner], client, monitor
+
     @classmethod
     def connect_db(cls):
-        """Connect to MongoDB"""
-        client = None
+        """Connect to MongoDB (blocking; see ``reconnect_in_background``)"""
+        with cls._connect_lock:
+            cls._connect()
+
+    @classmethod
+    def _connect(cls):
         try:
-            # Reload .env on each connect attempt so updated local config is picked up
-            load_dotenv(override=True)
+            # Reload .env until a connection succeeded once, so updated local
+            # config is picked up without paying for it on every reconnect.
+            if cls._client_uri is None:
+                load_dotenv(override=True)
             mongodb_url = cls._first_env("MONGODB_URL", "MONGODB_URI", "MONGO_URL", default=MONGODB_URL)
             database_name = cls._first_env("DATABASE_NAME", "MONGODB_DATABASE", "MONGO_DB_NAME", default=DATABASE_NAME)
 
@@ -174,7 +483,7 @@ class MongoDB:
             except ValueError:
                 retry_cooldown_seconds = 20
 
-            if cls.db is None and cls._last_failure_at is not None and retry_cooldown_seconds > 0:
+            if cls._last_failure_at is not None and retry_cooldown_seconds > 0:
                 elapsed = time.monotonic() - cls._last_failure_at
                 if elapsed < retry_cooldown_seconds:
                     raise RuntimeError(
@@ -182,65 +491,107 @@ class MongoDB:
                         f"after previous failure: {cls._last_failure_reason or 'unknown error'}"
                     )
 
-            # Close stale client before creating a new one
-            if cls.client is not None:
-                try:
-                    cls.client.close()
-                except Exception:
-                    pass
-
             server_selection_timeout_ms = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "8000"))
             connect_timeout_ms = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "15000"))
             socket_timeout_ms = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
 
-            connection_errors = []
-            for candidate_uri in cls._build_uri_candidates(mongodb_url):
-                try:
-                    client = MongoClient(
-                        candidate_uri,
-                        serverSelectionTimeoutMS=server_selection_timeout_ms,
-                        connectTimeoutMS=connect_timeout_ms,
-                        socketTimeoutMS=socket_timeout_ms,
-                        tlsCAFile=certifi.where(),
-                    )
-                    db = client[database_name]
-
-                    # Test connection using admin database on client
-                    client.admin.command('ping')
-
-                    # Assign only after ping succeeds
-                    cls.client = client
-                    cls.db = db
-                    cls._last_failure_at = None
-                    cls._last_failure_reason = None
-                    logger.info("MongoDB connected successfully")
-
-                    # Create indexes
-                    cls._create_indexes()
-                    return
-                except Exception as connect_err:
-                    connection_errors.append(f"{type(connect_err).__name__}: {connect_err}")
-                    if client is not None:
-                        try:
-                            client.close()
-                        except Exception:
-                            pass
-                    client = None
-
-            raise RuntimeError(" | ".join(connection_errors[-2:]))
+            client_options = {
+                'serverSelectionTimeoutMS': server_selection_timeout_ms,
+                'connectTimeoutMS': connect_timeout_ms,
+                'socketTimeoutMS': socket_timeout_ms,
+                'maxPoolSize': MONGO_MAX_POOL_SIZE,
+                'minPoolSize': min(MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE),
+                'maxIdleTimeMS': MONGO_MAX_IDLE_TIME_MS or None,
+                'heartbeatFrequencyMS': MONGO_HEARTBEAT_FREQUENCY_MS,
+                'tlsCAFile': certifi.where(),
+            }
+
+            candidates = cls._build_uri_candidates(mongodb_url)
+            if not candidates:
+                raise RuntimeError("No usable MongoDB URI configured")
+            ranks = cls._candidate_ranks(candidates, cls._client_uri)
+            uri, client, monitor = cls._probe_candidates(candidates, ranks, client_options)
         except Exception as e:
-            if client is not None:
-                try:
-                    client.close()
-                except Exception:
-                    pass
-            cls.client = None
-            cls.db = None
+            # A client that already exists is kept: the driver keeps monitoring
+            # it and it recovers on its own if its servers come back.
             cls._last_failure_at = time.monotonic()
             cls._last_failure_reason = str(e)
             logger.error(f"Failed to connect to MongoDB: {e}")
             raise
 
+        # Swap in the new client only after its ping succeeded
+        stale = cls.client
+        monitor.active = True
+        cls.health = monitor
+        cls.client = client
+        cls.db = client[database_name]
+        cls._client_uri = uri
+        cls._client_options = client_options
+        cls._generation += 1
+        cls._last_failure_at = None
+        cls._last_failure_reason = None
+        logger.info(f"MongoDB connected successfully ({cls._uri_host(uri)})")
+        if stale is not None:
+            try:
+                stale.close()
+            except Exception:
+                pass
+
+        # Create indexes
+        cls._create_indexes()
+
+    @staticmethod
+    def _uri_host(uri: str | None) -> str | None:
+        """Host part of a URI without credentials, for logs and diagnostics."""
+        return urlsplit(uri).netloc.rsplit('@', 1)[-1] if uri else None
+
+    @classmethod
+    def reconnect_in_background(cls):
+        """Start a reconnect on its own thread unless one is running already."""
+        with cls._reconnect_lock:
+            if cls._reconnect_thread is not None and cls._reconnect_thread.is_alive():
+                return
+            cls._reconnect_thread = threading.Thread(
+                target=cls._reconnect, name="mongo-reconnect", daemon=True
+            )
+            cls._reconnect_thread.start()
+
+    @classmethod
+    def _reconnect(cls):
+        try:
+            cls.connect_db()
+        except Exception:
+            # Logged by connect_db; the next get_db after the cooldown retries.
+            pass
+
+    @classmethod
+    async def get_async_db(cls) -> AsyncDatabase:
+        """Async handle for the current connection (call ``get_db`` first).
+
+        The sync client's heartbeats cover health for both clients, so the
+        async one carries no listener.
+        """
+        if cls.async_db is None or cls._async_generation != cls._generation:
+            if cls.db is None:
+                raise RuntimeError("MongoDB is not connected")
+            stale = cls.async_client
+            cls.async_client = AsyncMongoClient(cls._client_uri, **cls._client_options)
+            cls.async_db = cls.async_client[cls.db.name]
+            cls._async_generation = cls._generation
+            if stale is not None:
+                await stale.close()
+        return cls.async_db
+
+    @classmethod
+    async def close_async_db(cls):
+        """Close the async client (on the event loop, before ``close_db``)."""
+        if cls.async_client is not None:
+            try:
+                await cls.async_client.close()
+            finally:
+                cls.async_client = None
+                cls.async_db = None
+
     @classmethod
     def close_db(cls):
         """Close MongoDB connection"""
@@ -253,58 +604,144 @@ class MongoDB:
                 cls.db = None
 
     @classmethod
-    def _create_indexes(cls):
-        """Create database indexes for performance"""
+    def _create_indexes(cls, db: Database | None = None):
+        """Create database indexes for performance (on ``db``, default the app database)"""
+        db = cls.db if db is None else db
+        # Each build is independent: one failing is logged and the rest still run.
+        # Users collection indexes
+        create_index(db.users, "username", unique=True)
+        create_index(db.users, "email", unique=True, sparse=True)
+
+        # History partitions (current month, legacy collection) and the id index
         try:
-            # Users collection indexes
-            cls.db.users.create_index("username", unique=True)
-            cls.db.users.create_index("email", unique=True, sparse=True)
-
-            # Processing history indexes
-            cls.db.processing_history.create_index("user_id")
-            cls.db.processing_history.create_index("type")
-            cls.db.processing_history.create_index("created_at")
-            cls.db.processing_history.create_index([("user_id", 1), ("created_at", -1)])
-
-            # Optional TTL index to auto-delete old OCR history documents
-            # using dedicated expiry field to avoid index conflicts.
-            if OCR_HISTORY_RETENTION_DAYS > 0:
-                cls.db.processing_history.create_index(
-                    [("ocr_expires_at", 1)],
-                    expireAfterSeconds=0,
-                    name="ocr_history_ttl_idx"
-                )
-
-            logger.info("Database indexes created successfully")
+            HistoryPartitions.create_indexes(db)
         except Exception as e:
-            logger.warning(f"Error creating indexes: {e}")
+            logger.warning(f"Error creating history indexes: {e}")
+
+        # Asynchronous OCR jobs: claim order, lease recovery, polling by owner
+        create_index(db.ocr_jobs, [("status", 1), ("available_at", 1)])
+        create_index(db.ocr_jobs, [("status", 1), ("lease_expires_at", 1)])
+        create_index(db.ocr_jobs, [("user_id", 1), ("created_at", -1)])
+        create_index(
+            db.ocr_jobs,
+            [("expires_at", 1)],
+            expireAfterSeconds=0,
+            name="ocr_jobs_ttl_idx"
+        )
+
+        # Durable batch jobs
+        create_index(db.batch_jobs, [("user_id", 1), ("created_at", -1)])
+        create_index(db.batch_jobs, [("expires_at", 1)], expireAfterSeconds=0, name="batch_jobs_ttl_idx")
+        create_index(db.batch_items, [("batch_id", 1), ("index", 1)], unique=True)
+        create_index(db.batch_items, [("batch_id", 1), ("status", 1)])
+        create_index(db.batch_items, [("status", 1), ("available_at", 1)])
+        create_index(db.batch_items, [("status", 1), ("lease_expires_at", 1)])
+        create_index(db.batch_items, [("expires_at", 1)], expireAfterSeconds=0, name="batch_items_ttl_idx")
+
+        # History stats due for a recount because OCR items expired
+        create_index(db.history_stats, "next_expiry", sparse=True)
+
+        # Archived history months, read back in order on restore
+        create_index(db.history_archive, [("partition", 1), ("sequence", 1)])
+        create_index(db.history_archive, "user_ids")
+
+        # Blobs whose every reference has expired are removed by TTL.
+        create_index(db.text_blobs, "expires_at", expireAfterSeconds=0, name="text_blobs_ttl_idx")
+
+        logger.info("Database indexes checked")
+
+    @staticmethod
+    @contextmanager
+    def consistency(db, profile: str):
+        """``db`` under a consistency profile, timing the block for its metrics.
+
+            with MongoDB.consistency(db, PROFILE_FAST_WRITE) as fast_db:
+                fast_db.processing_history.insert_one(document)
+
+        Works for sync and async handles (the block may await).
+        """
+        selected = CONSISTENCY_PROFILES[profile]
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield selected.apply(db)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            selected.record((time.perf_counter() - started) * 1000, failed)
+
+    @staticmethod
+    def consistency_snapshot() -> dict:
+        return {name: profile.snapshot() for name, profile in CONSISTENCY_PROFILES.items()}
+
+    @classmethod
+    def available(cls) -> bool:
+        """Connected and healthy, without any I/O."""
+        return cls.db is not None and cls.health.healthy
 
     @classmethod
     def get_db(cls) -> Database:
-        """Get database instance"""
-        if cls.client is None or cls.db is None:
+        """Get database instance.
+
+        No round trip: health comes from the driver's heartbeats. The first
+        call connects inline (scripts rely on that); afterwards a lost
+        connection fails fast and is rebuilt by ``reconnect_in_background``,
+        never on the caller's thread.
+        """
+        if cls.client is not None and cls.db is not None:
+            if cls.health.healthy:
+                return cls.db
+            if cls.health.unhealthy_for() >= MONGO_RECONNECT_AFTER_SECONDS:
+                cls.reconnect_in_background()
+            raise RuntimeError(f"MongoDB is unreachable: {cls.health.snapshot()['last_error']}")
+
+        if cls._last_failure_at is None:
             cls.connect_db()
-        else:
-            try:
-                cls.client.admin.command('ping')
-            except Exception:
-                cls.client = None
-                cls.db = None
-                cls.connect_db()
-        return cls.db
+            return cls.db
+
+        cls.reconnect_in_background()
+        raise RuntimeError(f"MongoDB is not connected: {cls._last_failure_reason or 'reconnecting'}")
+
+
+def _database_unavailable(exc: Exception) -> HTTPException:
+    logger.error("Database unavailable: %s", exc)
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=(
+            "Database is unavailable. Verify Render env vars: MONGODB_URL, DATABASE_NAME; "
+            "check Atlas user/password, Network Access IP allowlist, and TLS/SRV DNS connectivity."
+        )
+    )
+
+
+# Database connection helpers
+async def get_database() -> AsyncDatabase:
+    """Dependency for getting the async database (awaited queries in routes)"""
+    try:
+        if not MongoDB.available():
+            # (Re)connecting blocks on server selection; keep it off the event loop.
+            await run_in_threadpool(MongoDB.get_db)
+        return await MongoDB.get_async_db()
+    except Exception as exc:
+        raise _database_unavailable(exc)
 
 
-# Database connection helper
-def get_database() -> Database:
-    """Dependency for getting database"""
+async def get_optional_database() -> AsyncDatabase | None:
+    """Like get_database, but None while the database is unavailable.
+
+    For routes that can run degraded: auth falls back to the verified-user
+    cache and history writes go to the local spool.
+    """
+    try:
+        return await get_database()
+    except HTTPException:
+        return None
+
+
+def get_sync_database() -> Database:
+    """Dependency for the sync database, for services run in the thread pool"""
     try:
         return MongoDB.get_db()
     except Exception as exc:
-        logger.error("Database unavailable: %s", exc)
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=(
-                "Database is unavailable. Verify Render env vars: MONGODB_URL, DATABASE_NAME; "
-                "check Atlas user/password, Network Access IP allowlist, and TLS/SRV DNS connectivity."
-            )
-        )
+        raise _database_unavailable(exc)
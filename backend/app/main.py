@@ -1,11 +1,18 @@
 import logging
 import re
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from datetime import datetime
 from app.config import APP_NAME, APP_VERSION, DEBUG, ALLOWED_ORIGINS, ALLOWED_ORIGIN_REGEX
 from app.database import MongoDB
+from app.services.tesseract_pool import TesseractWorkerPool
+from app.services.ocr_jobs import ocr_job_worker
+from app.services.batch_jobs import batch_item_worker
+from app.services.history_writer import history_writer
+from app.services.history_spool import history_spool
+from app.services.retention_sweeper import retention_sweeper
 from app.routes import auth
 from app.models import ErrorResponse
 
@@ -101,10 +108,24 @@ async def startup():
             exc
         )
 
+    history_writer.start()
+
+    # Background job workers keep polling until the database is reachable.
+    ocr_job_worker.start()
+    batch_item_worker.start()
+    retention_sweeper.start()
+
 @app.on_event("shutdown")
 async def shutdown():
     """Close MongoDB connection on shutdown"""
     logger.info("Shutting down application")
+    await retention_sweeper.stop()
+    await ocr_job_worker.stop()
+    await batch_item_worker.stop()
+    TesseractWorkerPool.shutdown()
+    # Flush buffered history before the connection goes away.
+    await run_in_threadpool(history_writer.stop)
+    await MongoDB.close_async_db()
     MongoDB.close_db()
 
 # Health check endpoint
@@ -125,10 +146,12 @@ async def health_check():
 async def health_db_check():
     """Database connectivity diagnostics for production troubleshooting."""
     snapshot = MongoDB.status_snapshot()
-    if snapshot.get("connected"):
+    spool = await run_in_threadpool(history_spool.snapshot)
+    if snapshot.get("connected") and snapshot["monitor"]["healthy"]:
         return {
             "status": "healthy",
             "db": snapshot,
+            "history_spool": spool,
             "timestamp": datetime.utcnow().isoformat()
         }
 
@@ -137,10 +160,31 @@ async def health_db_check():
         content={
             "status": "unhealthy",
             "db": snapshot,
+            "history_spool": spool,
             "timestamp": datetime.utcnow().isoformat()
         },
     )
 
+@app.get("/health/history-writer")
+@app.get("/api/health/history-writer")
+async def health_history_writer():
+    """Queue depth and flush latency of the write-behind history writer."""
+    snapshot = history_writer.snapshot()
+    return {
+        "status": "healthy" if snapshot["running"] else "stopped",
+        "history_writer": snapshot,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+@app.get("/health/retention")
+@app.get("/api/health/retention")
+async def health_retention():
+    """Last runs of the background OCR history retention sweeper."""
+    return {
+        "retention_sweeper": retention_sweeper.snapshot(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
 # Root endpoint
 @app.get("/")
 @app.get("/api")
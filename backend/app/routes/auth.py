@@ -1,15 +1,24 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime
-from bson.objectid import ObjectId
 from app.models import (
     UserCreate, UserLogin, UserResponse, TokenResponse,
     UserProfileResponse, UpdateProfileRequest, UpdateSettingsRequest,
     ChangePasswordRequest, DeleteAccountRequest
 )
 from app.auth.jwt_handler import JWTHandler
+from app.auth.dependencies import get_current_user
+from app.auth.user_cache import verified_users
 from app.auth.password import PasswordHandler
-from app.database import get_database
+from app.database import (
+    MongoDB, PROFILE_DURABLE, PROFILE_FAST_WRITE,
+    get_database, get_sync_database,
+)
+from app.services.history_archive import HistoryArchive
+from app.services.history_partitions import HistoryPartitions
+from app.services.history_stats import HistoryStatsService
+from app.services.text_blobs import TextBlobStore
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Database
 from pymongo.errors import DuplicateKeyError, PyMongoError
 import logging
@@ -17,7 +26,6 @@ import logging
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
-security = HTTPBearer(auto_error=False)
 
 def _default_settings():
     return {
@@ -27,45 +35,14 @@ def _default_settings():
         "two_factor_enabled": False,
     }
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Database = Depends(get_database)):
-    """Dependency to verify authentication"""
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing authorization header"
-        )
-
-    payload = JWTHandler.verify_token(credentials.credentials)
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token"
-        )
-
-    user_id = payload.get('user_id')
-    try:
-        user = db.users.find_one({'_id': ObjectId(user_id)})
-    except Exception as e:
-        logger.error(f"Auth DB error while fetching current user: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Authentication service temporarily unavailable"
-        )
-
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
-        )
-
-    return user
-
 @router.post("/register", response_model=UserResponse)
-async def register(user_data: UserCreate, db: Database = Depends(get_database)):
+async def register(user_data: UserCreate, db: AsyncDatabase = Depends(get_database)):
     """Register a new user"""
     try:
         # Check if user exists
-        if db.users.find_one({"username": user_data.username}):
+        with MongoDB.consistency(db, PROFILE_DURABLE) as durable_db:
+            existing = await durable_db.users.find_one({"username": user_data.username})
+        if existing:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already exists"
@@ -85,7 +62,8 @@ async def register(user_data: UserCreate, db: Database = Depends(get_database)):
         }
 
         # Insert into database
-        result = db.users.insert_one(user_doc)
+        with MongoDB.consistency(db, PROFILE_DURABLE) as durable_db:
+            result = await durable_db.users.insert_one(user_doc)
 
         return {
             "_id": str(result.inserted_id),
@@ -113,11 +91,11 @@ async def register(user_data: UserCreate, db: Database = Depends(get_database)):
         )
 
 @router.post("/login", response_model=TokenResponse)
-async def login(credentials: UserLogin, db: Database = Depends(get_database)):
+async def login(credentials: UserLogin, db: AsyncDatabase = Depends(get_database)):
     """Login user and return JWT token"""
     try:
         # Find user by username
-        user = db.users.find_one({"username": credentials.username})
+        user = await db.users.find_one({"username": credentials.username})
 
         if not user:
             raise HTTPException(
@@ -138,11 +116,12 @@ async def login(credentials: UserLogin, db: Database = Depends(get_database)):
             username=user["username"]
         )
 
-        # Update last login
-        db.users.update_one(
-            {"_id": user["_id"]},
-            {"$set": {"updated_at": datetime.utcnow()}}
-        )
+        # Update last login (a timestamp only: not worth a majority commit)
+        with MongoDB.consistency(db, PROFILE_FAST_WRITE) as fast_db:
+            await fast_db.users.update_one(
+                {"_id": user["_id"]},
+                {"$set": {"updated_at": datetime.utcnow()}}
+            )
 
         return {
             "access_token": token_data["access_token"],
@@ -166,7 +145,7 @@ async def login(credentials: UserLogin, db: Database = Depends(get_database)):
         )
 
 @router.post("/validate")
-async def validate_token(db: Database = Depends(get_database)):
+async def validate_token(db: AsyncDatabase = Depends(get_database)):
     """Validate current JWT token"""
     try:
         # This endpoint requires authentication middleware
@@ -180,7 +159,7 @@ async def validate_token(db: Database = Depends(get_database)):
         )
 
 @router.post("/refresh")
-async def refresh_token(db: Database = Depends(get_database)):
+async def refresh_token(db: AsyncDatabase = Depends(get_database)):
     """Refresh JWT token"""
     try:
         # This endpoint requires authentication middleware
@@ -206,17 +185,19 @@ async def get_my_profile(current_user = Depends(get_current_user)):
     }
 
 @router.patch("/me", response_model=UserProfileResponse)
-async def update_my_profile(payload: UpdateProfileRequest, db: Database = Depends(get_database), current_user = Depends(get_current_user)):
+async def update_my_profile(payload: UpdateProfileRequest, db: AsyncDatabase = Depends(get_database), current_user = Depends(get_current_user)):
     """Update profile fields"""
     updates = {}
     if payload.email is not None:
         updates["email"] = str(payload.email)
 
-    if updates:
-        updates["updated_at"] = datetime.utcnow()
-        db.users.update_one({"_id": current_user["_id"]}, {"$set": updates})
+    with MongoDB.consistency(db, PROFILE_DURABLE) as durable_db:
+        if updates:
+            updates["updated_at"] = datetime.utcnow()
+            await durable_db.users.update_one({"_id": current_user["_id"]}, {"$set": updates})
 
-    updated = db.users.find_one({"_id": current_user["_id"]})
+        updated = await durable_db.users.find_one({"_id": current_user["_id"]})
+    verified_users.remember(updated)
     return {
         "_id": str(updated["_id"]),
         "username": updated.get("username"),
@@ -227,44 +208,51 @@ async def update_my_profile(payload: UpdateProfileRequest, db: Database = Depend
     }
 
 @router.patch("/settings", response_model=UserProfileResponse)
-async def update_settings(payload: UpdateSettingsRequest, db: Database = Depends(get_database), current_user = Depends(get_current_user)):
+async def update_settings(payload: UpdateSettingsRequest, db: AsyncDatabase = Depends(get_database), current_user = Depends(get_current_user)):
     """Update user settings"""
-    current_settings = current_user.get("settings", _default_settings())
-    next_settings = {**_default_settings(), **current_settings}
-
-    payload_dict = payload.dict(exclude_none=True)
-    for k, v in payload_dict.items():
-        next_settings[k] = bool(v)
-
-    db.users.update_one(
-        {"_id": current_user["_id"]},
-        {"$set": {"settings": next_settings, "updated_at": datetime.utcnow()}}
-    )
+    # Only the submitted fields: current_user may be a cached copy, and
+    # rewriting all settings from it could undo a change made elsewhere.
+    updates = {f"settings.{k}": bool(v) for k, v in payload.dict(exclude_none=True).items()}
+
+    with MongoDB.consistency(db, PROFILE_DURABLE) as durable_db:
+        await durable_db.users.update_one(
+            {"_id": current_user["_id"]},
+            {"$set": {**updates, "updated_at": datetime.utcnow()}}
+        )
 
-    updated = db.users.find_one({"_id": current_user["_id"]})
+        updated = await durable_db.users.find_one({"_id": current_user["_id"]})
+    verified_users.remember(updated)
     return {
         "_id": str(updated["_id"]),
         "username": updated.get("username"),
         "email": updated.get("email"),
         "created_at": updated.get("created_at"),
         "updated_at": updated.get("updated_at"),
-        "settings": updated.get("settings", _default_settings())
+        "settings": {**_default_settings(), **updated.get("settings", {})}
     }
 
+async def _stored_password_hash(db: AsyncDatabase, user_id) -> str:
+    """Checked against the database, not the (possibly cached) current user."""
+    with MongoDB.consistency(db, PROFILE_DURABLE) as durable_db:
+        user = await durable_db.users.find_one({"_id": user_id}, {"password_hash": 1})
+    return (user or {}).get("password_hash", "")
+
 @router.post("/change-password")
-async def change_password(payload: ChangePasswordRequest, db: Database = Depends(get_database), current_user = Depends(get_current_user)):
+async def change_password(payload: ChangePasswordRequest, db: AsyncDatabase = Depends(get_database), current_user = Depends(get_current_user)):
     """Change account password"""
-    if not PasswordHandler.verify_password(payload.current_password, current_user.get("password_hash", "")):
+    if not PasswordHandler.verify_password(payload.current_password, await _stored_password_hash(db, current_user["_id"])):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
 
     new_hash = PasswordHandler.hash_password(payload.new_password)
-    db.users.update_one(
-        {"_id": current_user["_id"]},
-        {"$set": {"password_hash": new_hash, "updated_at": datetime.utcnow()}}
-    )
+    with MongoDB.consistency(db, PROFILE_DURABLE) as durable_db:
+        await durable_db.users.update_one(
+            {"_id": current_user["_id"]},
+            {"$set": {"password_hash": new_hash, "updated_at": datetime.utcnow()}}
+        )
+    verified_users.forget(current_user["_id"])
 
     return {"message": "Password updated successfully"}
 
@@ -288,14 +276,25 @@ async def revoke_other_sessions(current_user = Depends(get_current_user)):
     return {"message": "Other sessions revoked. Please login again on other devices."}
 
 @router.delete("/me")
-async def delete_account(payload: DeleteAccountRequest, db: Database = Depends(get_database), current_user = Depends(get_current_user)):
+async def delete_account(
+    payload: DeleteAccountRequest,
+    db: AsyncDatabase = Depends(get_database),
+    sync_db: Database = Depends(get_sync_database),
+    current_user = Depends(get_current_user)
+):
     """Delete current account and related data"""
-    if not PasswordHandler.verify_password(payload.password, current_user.get("password_hash", "")):
+    if not PasswordHandler.verify_password(payload.password, await _stored_password_hash(db, current_user["_id"])):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Password is incorrect"
         )
 
-    db.processing_history.delete_many({"user_id": current_user["_id"]})
-    db.users.delete_one({"_id": current_user["_id"]})
+    blob_refs = await run_in_threadpool(TextBlobStore.user_references, sync_db, current_user["_id"])
+    await HistoryPartitions.delete_user(db, current_user["_id"])
+    await run_in_threadpool(HistoryArchive.erase_user, sync_db, current_user["_id"])
+    await run_in_threadpool(HistoryStatsService.reset, sync_db, current_user["_id"])
+    await run_in_threadpool(TextBlobStore.release, sync_db, blob_refs)
+    with MongoDB.consistency(db, PROFILE_DURABLE) as durable_db:
+        await durable_db.users.delete_one({"_id": current_user["_id"]})
+    verified_users.forget(current_user["_id"])
     return {"message": "Account deleted successfully"}
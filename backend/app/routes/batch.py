@@ -1,58 +1,98 @@
 import asyncio
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson.objectid import ObjectId
-from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from app.models import BatchProcessingRequest, BatchProcessingResponse, ProcessingType
-from app.services.text_service import TextProcessingService
-from app.services.ocr_service import OCRService
-from app.database import get_database
-from app.auth.jwt_handler import JWTHandler
+from app.services.ocr_service import OCRService, PayloadTooLargeError
+from app.services.batch_jobs import BatchJobService
+from app.services.history_writer import history_writer
+from app.services.history_partitions import HistoryPartitions
+from app.database import get_database, get_sync_database
+from app.auth.dependencies import get_current_user
+from app.config import (
+    MAX_BATCH_SIZE, MAX_BATCH_JOB_SIZE, MAX_STREAM_BATCH_SIZE, MAX_OCR_BATCH_FILES,
+    BATCH_CONCURRENCY, BATCH_ITEM_TIMEOUT, BATCH_WORKER_THREADS,
+)
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Database
+import json
 import time
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/batch", tags=["Batch Processing"])
-security = HTTPBearer(auto_error=False)
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Database = Depends(get_database)):
-    """Dependency to verify authentication"""
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing authorization header"
-        )
+# Batch items run here instead of anyio's shared thread limiter, which the rest
+# of the app (sync routes, run_in_threadpool) depends on.
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKER_THREADS, thread_name_prefix="batch-item")
 
-    token = credentials.credentials
-    payload = JWTHandler.verify_token(token)
+async def _run_holding_slot(semaphore: asyncio.Semaphore, func, *args, **kwargs):
+    """Run func on the batch executor with BATCH_ITEM_TIMEOUT.
 
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token"
-        )
+    The caller has acquired one slot of ``semaphore``; it is released when the
+    thread actually finishes, not when the wait times out or is cancelled, so
+    abandoned items keep counting against the batch's concurrency cap.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        future = _batch_executor.submit(func, *args, **kwargs)
+    except BaseException:
+        semaphore.release()
+        raise
 
-    user_id = payload.get('user_id')
-    user = db.users.find_one({'_id': ObjectId(user_id)})
+    def _release(_):
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            pass  # Event loop already closed
 
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
-        )
+    future.add_done_callback(_release)
+    # Timing out cancels the wrapper, which drops the call if it has not started yet.
+    return await asyncio.wait_for(asyncio.wrap_future(future), timeout=BATCH_ITEM_TIMEOUT)
+
+async def _run_batch_item(processing_type: ProcessingType, idx: int, item: dict, semaphore: asyncio.Semaphore) -> dict:
+    """Process one item under the batch concurrency cap and per-item timeout."""
+    await semaphore.acquire()
+    item_start = time.time()
+    try:
+        result = await _run_holding_slot(semaphore, BatchJobService.process_item, processing_type, item)
+        return {
+            'index': idx,
+            'status': 'success',
+            'data': result,
+            'processing_time_ms': (time.time() - item_start) * 1000
+        }
+    except asyncio.TimeoutError:
+        # The worker thread cannot be interrupted; its late result is discarded.
+        logger.error(f"Batch item {idx} timed out after {BATCH_ITEM_TIMEOUT}s")
+        return {
+            'index': idx,
+            'status': 'error',
+            'error': f"Timed out after {BATCH_ITEM_TIMEOUT} seconds",
+            'processing_time_ms': (time.time() - item_start) * 1000
+        }
+    except Exception as e:
+        logger.error(f"Batch item {idx} processing error: {e}")
+        return {
+            'index': idx,
+            'status': 'error',
+            'error': str(e),
+            'processing_time_ms': (time.time() - item_start) * 1000
+        }
 
-    return user
 
 @router.post("/process", response_model=BatchProcessingResponse)
 async def batch_process(
     request: BatchProcessingRequest,
-    db: Database = Depends(get_database),
     current_user = Depends(get_current_user)
 ):
-    """Process multiple items in batch"""
+    """Process multiple items in batch, running up to BATCH_CONCURRENCY items at once"""
     try:
         start_time = time.time()
 
@@ -63,82 +103,43 @@ async def batch_process(
                 detail="Batch items cannot be empty"
             )
 
-        if len(request.items) > 5:
+        if len(request.items) > MAX_BATCH_SIZE:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Maximum batch size is 5 items"
+                detail=f"Maximum batch size is {MAX_BATCH_SIZE} items"
             )
 
-        # Process items
-        results = []
-        successful = 0
-        failed = 0
-
-        for idx, item in enumerate(request.items):
-            try:
-                if request.processing_type == ProcessingType.GRAMMAR:
-                    result = TextProcessingService.check_grammar(
-                        item.get('text', ''),
-                        item.get('language', 'en')
-                    )
-                    results.append({
-                        'index': idx,
-                        'status': 'success',
-                        'data': result
-                    })
-                    successful += 1
-
-                elif request.processing_type == ProcessingType.PARAPHRASE:
-                    result = TextProcessingService.paraphrase(
-                        item.get('text', ''),
-                        item.get('style', 'normal')
-                    )
-                    results.append({
-                        'index': idx,
-                        'status': 'success',
-                        'data': result
-                    })
-                    successful += 1
+        # Process items concurrently; gather keeps results in index order
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        results = await asyncio.gather(*[
+            _run_batch_item(request.processing_type, idx, item, semaphore)
+            for idx, item in enumerate(request.items)
+        ])
 
-                elif request.processing_type == ProcessingType.TRANSLATE:
-                    result = TextProcessingService.translate(
-                        item.get('text', ''),
-                        item.get('source_language', 'auto'),
-                        item.get('target_language', 'en')
-                    )
-                    results.append({
-                        'index': idx,
-                        'status': 'success',
-                        'data': result
-                    })
-                    successful += 1
-
-                # Save to history
-                db.processing_history.insert_one({
-                    'user_id': current_user['_id'],
-                    'type': request.processing_type.value,
-                    'input_text': item.get('text', '')[:100],
-                    'output_text': results[-1]['data'].get('output_text', '')[:100]
-                        if results[-1]['status'] == 'success' else '',
-                    'processing_time_ms': 0,
-                    'created_at': datetime.utcnow(),
-                    'is_exported': False,
-                    'batch_index': idx
-                })
+        successful = sum(1 for result in results if result['status'] == 'success')
+        failed = len(results) - successful
 
+        # Hand successful items to the write-behind history writer
+        batch_id = str(ObjectId())
+        save_history_enabled = current_user.get('settings', {}).get('save_history', True)
+        history_items = [
+            BatchJobService.build_history_item(
+                current_user['_id'], request.processing_type.value, request.items[result['index']],
+                result['data'], result['processing_time_ms'], result['index'], batch_id
+            )
+            for result in results
+            if result['status'] == 'success'
+        ]
+        if history_items and save_history_enabled:
+            try:
+                await history_writer.enqueue_many_async(history_items)
             except Exception as e:
-                logger.error(f"Batch item {idx} processing error: {e}")
-                results.append({
-                    'index': idx,
-                    'status': 'error',
-                    'error': str(e)
-                })
-                failed += 1
+                logger.error(f"Batch history insert error: {e}")
 
         processing_time = time.time() - start_time
 
         return {
-            'batch_id': str(ObjectId()),
+            'batch_id': batch_id,
             'total_items': len(request.items),
             'successful': successful,
             'failed': failed,
@@ -155,21 +156,302 @@ async def batch_process(
             detail="Batch processing failed"
         )
 
+def _stream_record(record_type: str, payload: dict, output_format: str) -> str:
+    body = json.dumps({'type': record_type, **payload}, default=str)
+    if output_format == 'sse':
+        return f"event: {record_type}\ndata: {body}\n\n"
+    return body + "\n"
+
+@router.post("/process/stream")
+async def batch_process_stream(
+    request: BatchProcessingRequest,
+    format: str = 'ndjson',
+    current_user = Depends(get_current_user)
+):
+    """Process a batch and stream each item's result as soon as it completes.
+
+    Emits one ``item`` record per item in completion order (use ``index`` to
+    reorder) and a final ``summary`` record, as NDJSON lines or, with
+    ``format=sse``, as Server-Sent Events.
+    """
+    output_format = (format or 'ndjson').lower()
+    if output_format not in ('ndjson', 'sse'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be 'ndjson' or 'sse'"
+        )
+
+    if len(request.items) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch items cannot be empty"
+        )
+
+    if len(request.items) > MAX_STREAM_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Maximum streamed batch size is {MAX_STREAM_BATCH_SIZE} items"
+        )
+
+    batch_id = str(ObjectId())
+    user_id = current_user['_id']
+    processing_type = request.processing_type
+    items = request.items
+    save_history_enabled = current_user.get('settings', {}).get('save_history', True)
+
+    async def result_stream():
+        start_time = time.time()
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        tasks = [
+            asyncio.ensure_future(_run_batch_item(processing_type, idx, item, semaphore))
+            for idx, item in enumerate(items)
+        ]
+        successful = 0
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result['status'] == 'success':
+                    successful += 1
+                    if save_history_enabled:
+                        try:
+                            await history_writer.enqueue_async(BatchJobService.build_history_item(
+                                user_id, processing_type.value, items[result['index']],
+                                result['data'], result['processing_time_ms'], result['index'], batch_id
+                            ))
+                        except Exception as e:
+                            logger.error(f"Batch history insert error: {e}")
+                else:
+                    failed += 1
+
+                yield _stream_record('item', result, output_format)
+
+            yield _stream_record('summary', {
+                'batch_id': batch_id,
+                'total_items': len(items),
+                'successful': successful,
+                'failed': failed,
+                'processing_time_ms': (time.time() - start_time) * 1000
+            }, output_format)
+        finally:
+            # Client went away: stop items that have not started yet.
+            for task in tasks:
+                task.cancel()
+
+    media_type = 'text/event-stream' if output_format == 'sse' else 'application/x-ndjson'
+    return StreamingResponse(
+        result_stream(),
+        media_type=media_type,
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def _read_ocr_batch_file(index: int, upload: UploadFile) -> dict:
+    """Read and validate one uploaded file; problems are reported per file."""
+    entry = {
+        'index': index,
+        'filename': upload.filename,
+        'content_hash': None,
+        'image_bytes': None,
+        'header': None,
+        'error': None,
+    }
+    try:
+        image_bytes = await OCRService.read_capped(OCRService.iter_upload(upload), declared_size=upload.size)
+        entry['content_hash'] = hashlib.sha256(image_bytes).hexdigest()
+        entry['header'] = OCRService.validate_image(image_bytes)
+        await run_in_threadpool(OCRService.verify_decodable, image_bytes, entry['header'])
+        entry['image_bytes'] = image_bytes
+    except (PayloadTooLargeError, ValueError) as e:
+        entry['error'] = str(e)
+    return entry
+
+async def _run_ocr_batch_file(entry: dict, semaphore: asyncio.Semaphore) -> dict:
+    """OCR one unique file under the batch concurrency cap and per-item timeout."""
+    await semaphore.acquire()
+    item_start = time.time()
+    try:
+        result = await _run_holding_slot(
+            semaphore, OCRService.process_image_file, entry['image_bytes'], header=entry['header']
+        )
+        return {'status': 'success', 'data': result, 'processing_time_ms': (time.time() - item_start) * 1000}
+    except asyncio.TimeoutError:
+        logger.error(f"OCR batch file {entry['index']} timed out after {BATCH_ITEM_TIMEOUT}s")
+        error = f"Timed out after {BATCH_ITEM_TIMEOUT} seconds"
+    except Exception as e:
+        logger.error(f"OCR batch file {entry['index']} processing error: {e}")
+        error = str(e)
+    return {'status': 'error', 'error': error, 'processing_time_ms': (time.time() - item_start) * 1000}
+
+@router.post("/ocr")
+async def batch_ocr(
+    files: List[UploadFile] = File(...),
+    current_user = Depends(get_current_user)
+):
+    """OCR many uploaded images or PDFs in one request.
+
+    Files with identical content (SHA-256) are recognized once; the copies are
+    answered from the first one and point to it through ``duplicate_of``.
+    Unique files run concurrently up to BATCH_CONCURRENCY, each with its own
+    timeout, and results are returned in upload order.
+    """
+    start_time = time.time()
+
+    if len(files) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch files cannot be empty"
+        )
+
+    if len(files) > MAX_OCR_BATCH_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Maximum OCR batch size is {MAX_OCR_BATCH_FILES} files"
+        )
+
+    # Uploads are already spooled by the form parser, so read them one at a time.
+    entries = []
+    for idx, upload in enumerate(files):
+        entries.append(await _read_ocr_batch_file(idx, upload))
+
+    first_by_hash = {}
+    for entry in entries:
+        if entry['error'] is None:
+            first_by_hash.setdefault(entry['content_hash'], entry['index'])
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    unique_indexes = list(first_by_hash.values())
+    outcomes = dict(zip(unique_indexes, await asyncio.gather(*[
+        _run_ocr_batch_file(entries[idx], semaphore) for idx in unique_indexes
+    ])))
+
+    batch_id = str(ObjectId())
+    results = []
+    history_items = []
+    for entry in entries:
+        result = {
+            'index': entry['index'],
+            'filename': entry['filename'],
+            'content_hash': entry['content_hash'],
+            'duplicate_of': None,
+        }
+        if entry['error'] is not None:
+            result.update({'status': 'error', 'error': entry['error'], 'processing_time_ms': 0.0})
+            results.append(result)
+            continue
+
+        first_index = first_by_hash[entry['content_hash']]
+        outcome = outcomes[first_index]
+        if first_index != entry['index']:
+            result['duplicate_of'] = first_index
+            # Nothing was recognized for the copy itself.
+            result.update({**outcome, 'processing_time_ms': 0.0})
+        else:
+            result.update(outcome)
+            if outcome['status'] == 'success':
+                history_item = OCRService.build_history_item(
+                    current_user['_id'], outcome['data'], f"file://{entry['filename']}"
+                )
+                history_item['batch_id'] = batch_id
+                history_item['batch_index'] = entry['index']
+                history_items.append(history_item)
+        results.append(result)
+
+    save_history_enabled = current_user.get('settings', {}).get('save_history', True)
+    if history_items and save_history_enabled:
+        try:
+            await history_writer.enqueue_many_async(history_items)
+        except Exception as e:
+            logger.error(f"OCR batch history insert error: {e}")
+
+    successful = sum(1 for result in results if result['status'] == 'success')
+
+    return {
+        'batch_id': batch_id,
+        'total_files': len(entries),
+        'unique_files': len(unique_indexes),
+        'successful': successful,
+        'failed': len(results) - successful,
+        'results': results,
+        'processing_time_ms': (time.time() - start_time) * 1000
+    }
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_batch_job(
+    request: BatchProcessingRequest,
+    sync_db: Database = Depends(get_sync_database),
+    current_user = Depends(get_current_user)
+):
+    """Queue a large batch for background processing and return its id"""
+    try:
+        if len(request.items) == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Batch items cannot be empty"
+            )
+
+        if len(request.items) > MAX_BATCH_JOB_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Maximum batch job size is {MAX_BATCH_JOB_SIZE} items"
+            )
+
+        batch = await run_in_threadpool(
+            BatchJobService.submit, sync_db, current_user, request.processing_type, request.items
+        )
+        batch_id = str(batch['_id'])
+
+        return {
+            'batch_id': batch_id,
+            'status': 'queued',
+            'total_items': batch['total_items'],
+            'status_url': f"{router.prefix}/status/{batch_id}",
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch job submission error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to queue batch job"
+        )
+
 @router.get("/status/{batch_id}")
 async def get_batch_status(
     batch_id: str,
-    db: Database = Depends(get_database),
+    include_items: bool = False,
+    after_index: int = -1,
+    items_limit: int = 100,
+    db: AsyncDatabase = Depends(get_database),
+    sync_db: Database = Depends(get_sync_database),
     current_user = Depends(get_current_user)
 ):
-    """Get batch processing status"""
+    """Get batch processing status (live progress for batch jobs)"""
     try:
-        # Fetch batch items from history
-        batch_items = list(
-            db.processing_history.find({
-                'batch_id': batch_id,
+        batch = None
+        if ObjectId.is_valid(batch_id):
+            batch = await db.batch_jobs.find_one({
+                '_id': ObjectId(batch_id),
                 'user_id': current_user['_id']
             })
-        )
+
+        if batch:
+            items_limit = max(1, min(items_limit, 500))
+            return await run_in_threadpool(
+                BatchJobService.status, sync_db, batch, include_items, after_index, items_limit
+            )
+
+        # Synchronous /process batches only leave their history items behind,
+        # all created after the batch id was minted.
+        since = None
+        if ObjectId.is_valid(batch_id):
+            since = HistoryPartitions.id_time(ObjectId(batch_id)) - timedelta(seconds=1)
+        batch_items = []
+        for name in await HistoryPartitions.sources_async(db, since=since):
+            batch_items += await db[name].find({
+                'batch_id': batch_id,
+                'user_id': current_user['_id']
+            }, {'processing_time_ms': 1}).to_list()
 
         if not batch_items:
             raise HTTPException(
@@ -1,81 +1,138 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from bson.objectid import ObjectId
 from app.models import ExportFormat
 from app.services.export_service import ExportService
-from app.database import get_database
-from app.auth.jwt_handler import JWTHandler
-from app.config import OCR_HISTORY_RETENTION_DAYS
+from app.services.history_archive import HistoryArchive
+from app.services.history_codec import HistoryCodec
+from app.services.history_partitions import HistoryPartitions, LEGACY
+from app.services.history_stats import HistoryStatsService
+from app.services.history_writer import history_writer
+from app.services.text_blobs import TextBlobStore
+from app.database import (
+    MongoDB, PROFILE_DEFAULT, PROFILE_FAST_WRITE, PROFILE_STALE_READ,
+    get_database, get_sync_database,
+)
+from app.auth.dependencies import get_current_user
+from app.config import OCR_HISTORY_RETENTION_DAYS, HISTORY_PREVIEW_CHARS
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Database
+from pymongo.errors import OperationFailure
+import asyncio
+import base64
 import io
+import json
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/history", tags=["History & Export"])
-security = HTTPBearer(auto_error=False)
 
+# Mongo error code for a $text query without a text index.
+_INDEX_NOT_FOUND = 27
 
-def _cleanup_expired_ocr_history(db: Database, user_id) -> int:
-    """Delete OCR history older than configured retention window for current user."""
-    if OCR_HISTORY_RETENTION_DAYS <= 0:
-        return 0
+# Listings return metadata plus the previews stored at insert time, never the
+# full texts. Items written before previews existed get them computed server-side.
+_LIST_PROJECTION = {
+    'user_id': 1, 'type': 1, 'created_at': 1, 'input_language': 1, 'output_language': 1,
+    'image_url': 1, 'confidence_score': 1, 'processing_time_ms': 1, 'is_exported': 1,
+    'metadata': 1, 'batch_id': 1, 'batch_index': 1,
+    'input_preview': {'$ifNull': ['$input_preview', {'$substrCP': [{'$ifNull': ['$input_text', '']}, 0, HISTORY_PREVIEW_CHARS]}]},
+    'output_preview': {'$ifNull': ['$output_preview', {'$substrCP': [{'$ifNull': ['$output_text', '']}, 0, HISTORY_PREVIEW_CHARS]}]},
+    'input_length': {'$ifNull': ['$input_length', {'$strLenCP': {'$ifNull': ['$input_text', '']}}]},
+    'output_length': {'$ifNull': ['$output_length', {'$strLenCP': {'$ifNull': ['$output_text', '']}}]},
+}
 
-    cutoff = datetime.utcnow() - timedelta(days=OCR_HISTORY_RETENTION_DAYS)
-    result = db.processing_history.delete_many({
-        'user_id': user_id,
-        'type': 'ocr',
-        'created_at': {'$lt': cutoff}
-    })
-    return result.deleted_count
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Database = Depends(get_database)):
-    """Dependency to verify authentication"""
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing authorization header"
-        )
-
-    token = credentials.credentials
-    payload = JWTHandler.verify_token(token)
-
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token"
-        )
+def _encode_cursor(position: dict) -> str:
+    """Opaque continuation token for a listing position."""
+    raw = json.dumps(position, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
 
-    user_id = payload.get('user_id')
-    user = db.users.find_one({'_id': ObjectId(user_id)})
-
-    if not user:
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if 'o' in data:
+            return {'offset': max(0, int(data['o']))}
+        return {'created_at': datetime.fromisoformat(data['t']), '_id': ObjectId(data['id'])}
+    except Exception:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
         )
 
-    return user
+def _utc(moment: datetime | None) -> datetime | None:
+    """Naive UTC, as stored."""
+    if moment is not None and moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def _text_search_filter(search: str, exact: bool) -> dict:
+    """``$text`` filter; ``exact`` matches the input as one literal phrase."""
+    if exact:
+        # Inside a phrase only the quote character is special.
+        return {'$text': {'$search': '"' + search.replace('"', ' ') + '"'}}
+    return {'$text': {'$search': search}}
+
+def _literal_search_filter(search: str) -> dict:
+    """Index-less fallback: case-insensitive literal substring match."""
+    pattern = re.escape(search)
+    return {'$or': [
+        {field: {'$regex': pattern, '$options': 'i'}}
+        for field in ('input_text', 'output_text', 'search_text', 'input_preview', 'output_preview')
+    ]}
 
 @router.get("")
 async def get_history(
     limit: int = 20,
     offset: int = 0,
+    cursor: str = None,
+    include_total: bool = False,
     type: str = None,
     search: str = None,
-    db: Database = Depends(get_database),
+    exact: bool = False,
+    sort: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    db: AsyncDatabase = Depends(get_database),
     current_user = Depends(get_current_user)
 ):
-    """Get user's processing history with pagination and filtering"""
+    """Get user's processing history.
+
+    Items carry metadata and short ``input_preview``/``output_preview`` texts
+    only; fetch ``GET /api/history/{id}`` for the full input and output.
+    Listings are newest first and keyset-paginated on ``(created_at, _id)``:
+    pass the returned ``next_cursor`` as ``cursor`` to get the next page, which
+    costs the same at any depth. ``offset`` is still accepted for older
+    clients. The exact ``total`` is only counted when ``include_total`` is set.
+
+    ``search`` uses the per-user text index on ``input_text``/``output_text``
+    and ranks by relevance unless ``sort=recent``; ``exact`` matches the
+    whole search string as a literal phrase. Texts stored compressed or as
+    blobs are matched on their first HISTORY_SEARCH_TEXT_CHARS characters.
+
+    ``since``/``until`` limit the listing to items created in that range;
+    only the monthly history partitions it overlaps are read.
+    """
     try:
-        _cleanup_expired_ocr_history(db, current_user['_id'])
-
         # Validate parameters
         limit = min(limit, 100)  # Max 100 items per request
         if limit <= 0: limit = 20
         if offset < 0: offset = 0
+        search = (search or '').strip()[:200]
+        sort = (sort or ('relevance' if search else 'recent')).lower()
+        if sort not in ('relevance', 'recent'):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="sort must be 'relevance' or 'recent'"
+            )
+        by_relevance = bool(search) and sort == 'relevance'
+
+        position = _decode_cursor(cursor) if cursor else None
 
         # Build query
         query = {'user_id': current_user['_id']}
@@ -84,22 +141,39 @@ async def get_history(
             query['type'] = type.lower()
 
         if search:
-            # Text search on input and output
-            query['$or'] = [
-                {'input_text': {'$regex': search, '$options': 'i'}},
-                {'output_text': {'$regex': search, '$options': 'i'}}
-            ]
-
-        # Get total count
-        total_count = db.processing_history.count_documents(query)
-
-        # Get paginated results
-        history = list(
-            db.processing_history.find(query)
-            .sort('created_at', -1)  # Most recent first
-            .skip(offset)
-            .limit(limit)
-        )
+            query.update(_text_search_filter(search, exact))
+
+        since, until = _utc(since), _utc(until)
+        if since or until:
+            query['created_at'] = {
+                **({'$gte': since} if since else {}),
+                **({'$lt': until} if until else {}),
+            }
+
+        # Searches may be served by a secondary; plain listings must show
+        # what was just saved.
+        profile = PROFILE_STALE_READ if search else PROFILE_DEFAULT
+        with MongoDB.consistency(db, profile) as read_db:
+            try:
+                history, total_count, next_position = await _find_history_page(
+                    read_db, query, limit, offset, position, by_relevance, include_total, since, until
+                )
+            except OperationFailure as e:
+                if not search or e.code != _INDEX_NOT_FOUND:
+                    raise
+                # Text index not built (yet): scan with an escaped literal pattern.
+                logger.warning(f"History text index unavailable, falling back to literal scan: {e}")
+                del query['$text']
+                query.update(_literal_search_filter(search))
+                history, total_count, next_position = await _find_history_page(
+                    read_db, query, limit, offset, position, False, include_total, since, until
+                )
+
+        if position is None and offset == 0 and not search:
+            # Newest page: show items still in the write-behind buffer.
+            history, total_count, next_position = _merge_buffered(
+                history, total_count, next_position, current_user['_id'], query, limit
+            )
 
         # Convert MongoDB ObjectId to string
         for item in history:
@@ -111,10 +185,13 @@ async def get_history(
             'items': history,
             'total': total_count,
             'limit': limit,
-            'offset': offset,
-            'has_more': (offset + limit) < total_count
+            'offset': offset if not cursor else None,
+            'next_cursor': _encode_cursor(next_position) if next_position else None,
+            'has_more': next_position is not None
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Get history error: {e}")
         raise HTTPException(
@@ -122,10 +199,116 @@ async def get_history(
             detail="Failed to retrieve history"
         )
 
+def _merge_buffered(history: list, total_count: int | None, next_position: dict | None,
+                    user_id, query: dict, limit: int) -> tuple:
+    """Add the user's not yet written items matching ``query`` to the first listing page."""
+    created = query.get('created_at', {})
+    seen = {item['_id'] for item in history}
+    pending = [
+        {key: document.get(key) for key in _LIST_PROJECTION if key in document} | {'_id': document['_id']}
+        for document in history_writer.buffered(user_id)
+        if document['_id'] not in seen and isinstance(document.get('created_at'), datetime)
+        and ('type' not in query or document.get('type') == query['type'])
+        and ('$gte' not in created or document['created_at'] >= created['$gte'])
+        and ('$lt' not in created or document['created_at'] < created['$lt'])
+    ]
+    if not pending:
+        return history, total_count, next_position
+
+    merged = sorted(history + pending, key=lambda item: (item['created_at'], item['_id']), reverse=True)
+    if total_count is not None:
+        total_count += len(pending)
+    if len(merged) > limit:
+        # Items pushed off this page start the next one.
+        history = merged[:limit]
+        last = history[-1]
+        return history, total_count, {'t': last['created_at'].isoformat(), 'id': str(last['_id'])}
+    return merged, total_count, next_position
+
+async def _find_history_page(db: AsyncDatabase, query: dict, limit: int, offset: int,
+                             position: dict | None, by_relevance: bool, include_total: bool,
+                             since: datetime | None = None, until: datetime | None = None) -> tuple:
+    """Run one listing page; returns (items, total or None, next cursor position or None)."""
+    if position is not None and 'offset' in position:
+        offset, position = position['offset'], None
+    if position is not None:
+        # Nothing newer than the cursor is needed.
+        bound = position['created_at'] + timedelta(microseconds=1)
+        until = min(until, bound) if until else bound
+
+    sources = await HistoryPartitions.sources_async(db, since, until)
+    total_count = None
+    if include_total:
+        counts = await asyncio.gather(*(db[name].count_documents(query) for name in sources))
+        total_count = sum(counts)
+
+    if by_relevance:
+        # Relevance order has no stable key to seek on; the cursor carries the
+        # position within the (already index-bounded) set of matches. Every
+        # partition contributes its best matches and they are merged by score.
+        skip = offset
+        projection = {**_LIST_PROJECTION, 'score': {'$meta': 'textScore'}}
+        pages = await asyncio.gather(*(
+            db[name].find(query, projection)
+            .sort([('score', {'$meta': 'textScore'}), ('created_at', -1), ('_id', -1)])
+            .limit(skip + limit + 1)
+            .to_list()
+            for name in sources
+        ))
+        history = sorted(
+            (item for page in pages for item in page),
+            key=lambda item: (item.get('score', 0), item['created_at'], item['_id']),
+            reverse=True
+        )[skip:skip + limit + 1]
+        has_more = len(history) > limit
+        return history[:limit], total_count, ({'o': skip + limit} if has_more else None)
+
+    page_query = query
+    if position:
+        page_query = {'$and': [query, {'$or': [
+            {'created_at': {'$lt': position['created_at']}},
+            {'created_at': position['created_at'], '_id': {'$lt': position['_id']}}
+        ]}]}
+
+    # Partitions hold consecutive months, so walking them newest first yields
+    # the listing in order; stop as soon as the page (plus one extra item that
+    # tells whether another page exists) is full.
+    skip = offset if position is None else 0
+    wanted = skip + limit + 1
+    history = []
+    for name in sources:
+        if name == LEGACY:
+            # Unpartitioned documents can be of any date: merge them in.
+            history += await _find_recent(db, name, page_query, wanted)
+            history.sort(key=lambda item: (item['created_at'], item['_id']), reverse=True)
+        elif len(history) < wanted:
+            history += await _find_recent(db, name, page_query, wanted - len(history))
+    history = history[skip:wanted]
+
+    has_more = len(history) > limit
+    history = history[:limit]
+    if not has_more:
+        return history, total_count, None
+    last = history[-1]
+    return history, total_count, {'t': last['created_at'].isoformat(), 'id': str(last['_id'])}
+
+async def _find_recent(db: AsyncDatabase, name: str, query: dict, limit: int) -> list:
+    return await (
+        db[name].find(query, _LIST_PROJECTION)
+        .sort([('created_at', -1), ('_id', -1)])  # Most recent first
+        .limit(limit)
+        .to_list()
+    )
+
+def _restore_texts(db: Database, item: dict) -> dict:
+    """Full input/output of a stored item (decompression and blob reads)."""
+    return TextBlobStore.resolve(db, HistoryCodec.decode(item))
+
 @router.get("/{item_id}")
 async def get_history_item(
     item_id: str,
-    db: Database = Depends(get_database),
+    db: AsyncDatabase = Depends(get_database),
+    sync_db: Database = Depends(get_sync_database),
     current_user = Depends(get_current_user)
 ):
     """Get specific history item details"""
@@ -139,10 +322,10 @@ async def get_history_item(
                 detail="Invalid history ID"
             )
 
-        item = db.processing_history.find_one({
+        _, item = await HistoryPartitions.locate(db, obj_id, lambda collection: collection.find_one({
             '_id': obj_id,
             'user_id': current_user['_id']
-        })
+        }))
 
         if not item:
             raise HTTPException(
@@ -151,6 +334,7 @@ async def get_history_item(
             )
 
         # Convert to JSON-serializable format
+        await run_in_threadpool(_restore_texts, sync_db, item)
         item['_id'] = str(item['_id'])
         item['user_id'] = str(item['user_id'])
         item['created_at'] = item['created_at'].isoformat()
@@ -169,7 +353,8 @@ async def get_history_item(
 @router.delete("/{item_id}")
 async def delete_history_item(
     item_id: str,
-    db: Database = Depends(get_database),
+    db: AsyncDatabase = Depends(get_database),
+    sync_db: Database = Depends(get_sync_database),
     current_user = Depends(get_current_user)
 ):
     """Delete a history item"""
@@ -182,17 +367,23 @@ async def delete_history_item(
                 detail="Invalid history ID"
             )
 
-        result = db.processing_history.delete_one({
-            '_id': obj_id,
-            'user_id': current_user['_id']
-        })
+        _, deleted = await HistoryPartitions.locate(db, obj_id, lambda collection: collection.find_one_and_delete(
+            {'_id': obj_id, 'user_id': current_user['_id']},
+            projection={
+                'user_id': 1, 'type': 1, 'is_exported': 1, 'processing_time_ms': 1,
+                'input_text_ref': 1, 'output_text_ref': 1,
+            }
+        ))
 
-        if result.deleted_count == 0:
+        if deleted is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="History item not found"
             )
 
+        await run_in_threadpool(HistoryStatsService.record_deleted, sync_db, [deleted])
+        await run_in_threadpool(TextBlobStore.release, sync_db, TextBlobStore.references([deleted]))
+
         return {
             'message': 'History item deleted successfully',
             'item_id': item_id
@@ -211,7 +402,8 @@ async def delete_history_item(
 async def export_history_item(
     item_id: str,
     format: ExportFormat = ExportFormat.PDF,
-    db: Database = Depends(get_database),
+    db: AsyncDatabase = Depends(get_database),
+    sync_db: Database = Depends(get_sync_database),
     current_user = Depends(get_current_user)
 ):
     """Export a history item to specified format"""
@@ -225,10 +417,10 @@ async def export_history_item(
             )
 
         # Fetch history item
-        item = db.processing_history.find_one({
+        partition, item = await HistoryPartitions.locate(db, obj_id, lambda collection: collection.find_one({
             '_id': obj_id,
             'user_id': current_user['_id']
-        })
+        }))
 
         if not item:
             raise HTTPException(
@@ -236,12 +428,14 @@ async def export_history_item(
                 detail="History item not found"
             )
 
-        # Export based on format
+        await run_in_threadpool(_restore_texts, sync_db, item)
+
+        # Export based on format (rendering is CPU-bound, off the event loop)
         if format == ExportFormat.PDF:
-            file_content = ExportService.export_to_pdf(item)
+            file_content = await run_in_threadpool(ExportService.export_to_pdf, item)
             media_type = 'application/pdf'
         elif format == ExportFormat.DOCX:
-            file_content = ExportService.export_to_docx(item)
+            file_content = await run_in_threadpool(ExportService.export_to_docx, item)
             media_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
         elif format == ExportFormat.TXT:
             file_content = ExportService.export_to_txt(item)
@@ -253,11 +447,14 @@ async def export_history_item(
                 detail="Invalid export format"
             )
 
-        # Mark as exported
-        db.processing_history.update_one(
-            {'_id': obj_id},
-            {'$set': {'is_exported': True}}
-        )
+        # Mark as exported (counted once, on the first export)
+        with MongoDB.consistency(db, PROFILE_FAST_WRITE) as fast_db:
+            marked = await fast_db[partition].update_one(
+                {'_id': obj_id, 'is_exported': {'$ne': True}},
+                {'$set': {'is_exported': True}}
+            )
+        if marked.modified_count:
+            await run_in_threadpool(HistoryStatsService.record_exported, sync_db, current_user['_id'])
 
         # Generate filename
         filename = ExportService.get_filename(item['type'], format.value)
@@ -282,18 +479,22 @@ async def export_history_item(
 
 @router.delete("")
 async def clear_history(
-    db: Database = Depends(get_database),
+    db: AsyncDatabase = Depends(get_database),
+    sync_db: Database = Depends(get_sync_database),
     current_user = Depends(get_current_user)
 ):
     """Delete all history items for current user"""
     try:
-        result = db.processing_history.delete_many({
-            'user_id': current_user['_id']
-        })
+        refs = await run_in_threadpool(TextBlobStore.user_references, sync_db, current_user['_id'])
+        deleted_count = await HistoryPartitions.delete_user(db, current_user['_id'])
+        # Archived months too, so a later restore cannot bring them back.
+        await run_in_threadpool(HistoryArchive.erase_user, sync_db, current_user['_id'])
+        await run_in_threadpool(HistoryStatsService.reset, sync_db, current_user['_id'])
+        await run_in_threadpool(TextBlobStore.release, sync_db, refs)
 
         return {
             'message': 'All history items deleted',
-            'deleted_count': result.deleted_count
+            'deleted_count': deleted_count
         }
 
     except Exception as e:
@@ -305,47 +506,18 @@ async def clear_history(
 
 @router.get("/stats/summary")
 async def get_history_stats(
-    db: Database = Depends(get_database),
+    sync_db: Database = Depends(get_sync_database),
     current_user = Depends(get_current_user)
 ):
-    """Get statistics about user's processing history"""
+    """Get statistics about user's processing history (one point read)"""
     try:
-        user_id = current_user['_id']
-        _cleanup_expired_ocr_history(db, user_id)
-
-        # Count by type
-        type_counts = {}
-        for type_name in ['ocr', 'grammar', 'paraphrase', 'translate']:
-            count = db.processing_history.count_documents({
-                'user_id': user_id,
-                'type': type_name
-            })
-            if count > 0:
-                type_counts[type_name] = count
-
-        # Total items
-        total = db.processing_history.count_documents({
-            'user_id': user_id
-        })
-
-        # Exported count
-        exported = db.processing_history.count_documents({
-            'user_id': user_id,
-            'is_exported': True
-        })
-
-        # Average processing time
-        pipeline = [
-            {'$match': {'user_id': user_id}},
-            {'$group': {
-                '_id': None,
-                'avg_time': {'$avg': '$processing_time_ms'}
-            }}
-        ]
-        avg_time = 0
-        result = list(db.processing_history.aggregate(pipeline))
-        if result:
-            avg_time = result[0]['avg_time']
+        with MongoDB.consistency(sync_db, PROFILE_STALE_READ) as read_db:
+            stats = await run_in_threadpool(HistoryStatsService.get, sync_db, current_user['_id'], read_db)
+
+        type_counts = {type_name: count for type_name, count in stats.get('by_type', {}).items() if count > 0}
+        total = stats.get('total', 0)
+        exported = stats.get('exported', 0)
+        avg_time = stats['time_sum_ms'] / stats['time_count'] if stats.get('time_count') else 0
 
         return {
             'total_items': total,
@@ -1,142 +1,198 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.formparsers import MultiPartException, MultiPartParser
 from bson.objectid import ObjectId
+from pydantic import ValidationError
 from app.models import OCRRequest, OCRResponse, OCRProcessingType
-from app.services.ocr_service import OCRService
-from app.database import get_database
-from app.auth.jwt_handler import JWTHandler
-from app.config import OCR_HISTORY_RETENTION_DAYS
+from app.services.history_writer import history_writer
+from app.services.ocr_service import OCRService, PayloadTooLargeError
+from app.services.ocr_jobs import OCRJobService, ocr_job_worker
+from app.services.job_queue import FINAL_STATES
+from app.database import get_database, get_sync_database
+from app.auth.dependencies import get_current_user
+from app.config import MAX_FILE_SIZE
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Database
+import asyncio
+import base64
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/ocr", tags=["OCR"])
-security = HTTPBearer(auto_error=False)
-
-
-def _cleanup_expired_ocr_history(db: Database, user_id) -> int:
-    """Delete OCR history older than configured retention window for current user."""
-    if OCR_HISTORY_RETENTION_DAYS <= 0:
-        return 0
-
-    cutoff = datetime.utcnow() - timedelta(days=OCR_HISTORY_RETENTION_DAYS)
-    result = db.processing_history.delete_many({
-        'user_id': user_id,
-        'type': 'ocr',
-        'created_at': {'$lt': cutoff}
-    })
-    return result.deleted_count
-
-
-def _build_ocr_history_item(current_user, result: dict, image_url: str | None):
-    now = datetime.utcnow()
-    item = {
-        'user_id': current_user['_id'],
-        'type': 'ocr',
-        'input_text': result['extracted_text'],
-        'output_text': result['extracted_text'],
-        'image_url': image_url,
-        'confidence_score': result['confidence_score'],
-        'processing_time_ms': result['processing_time_ms'],
-        'created_at': now,
-        'is_exported': False,
-    }
-
-    if OCR_HISTORY_RETENTION_DAYS > 0:
-        item['ocr_expires_at'] = now + timedelta(days=OCR_HISTORY_RETENTION_DAYS)
-
-    return item
-
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Database = Depends(get_database)):
-    """Dependency to verify authentication"""
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing authorization header"
-        )
-
-    token = credentials.credentials
-    payload = JWTHandler.verify_token(token)
-
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token"
-        )
 
-    user_id = payload.get('user_id')
-    user = db.users.find_one({'_id': ObjectId(user_id)})
+# Room for multipart boundaries, part headers and the small form fields.
+_MULTIPART_OVERHEAD = 64 * 1024
 
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
-        )
 
-    return user
-
-@router.post("/process", response_model=OCRResponse)
-async def process_ocr(
-    ocr_request: OCRRequest,
-    db: Database = Depends(get_database),
-    current_user = Depends(get_current_user)
-):
-    """Process image for OCR text extraction"""
+def _declared_length(request: Request):
     try:
-        _cleanup_expired_ocr_history(db, current_user['_id'])
+        return int(request.headers.get('content-length'))
+    except (TypeError, ValueError):
+        return None
+
+
+async def _read_ocr_payload(request: Request):
+    """Read an OCR request body in any supported encoding.
+
+    Accepted bodies:
+    - raw image bytes (``image/*``, ``application/pdf``, ``application/octet-stream``)
+    - ``multipart/form-data`` with a ``file`` part (what the frontend posts)
+    - legacy JSON ``OCRRequest`` with base64 ``image_data``, or an ``image_url``
+      for URL processing (the only body that can ask for it)
+
+    Returns:
+        Tuple of (processing_type, image_url, image_bytes) where image_bytes is a
+        memoryview, or None for URL processing
+    """
+    content_type = (request.headers.get('content-type') or '').split(';')[0].strip().lower()
+
+    if content_type == 'application/json':
+        # base64 inflates the image by a third; allow for that plus the JSON envelope.
+        body = await OCRService.read_capped(
+            request.stream(),
+            max_size=MAX_FILE_SIZE * 4 // 3 + 64 * 1024,
+            declared_size=_declared_length(request),
+        )
+        try:
+            ocr_request = OCRRequest.model_validate_json(bytes(body))
+        except ValidationError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid OCR request body"
+            )
 
-        # Route based on processing type
         if ocr_request.processing_type == OCRProcessingType.URL:
             if not ocr_request.image_url:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="URL required for URL type processing"
                 )
-            result = OCRService.process_image_url(ocr_request.image_url)
-
-        else:
-            # Handle base64 data
-            if not ocr_request.image_data:
+            return ocr_request.processing_type, ocr_request.image_url, None
+
+        if not ocr_request.image_data:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Image data required"
+            )
+        try:
+            image_bytes = memoryview(base64.b64decode(ocr_request.image_data))
+        except Exception:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid base64 image data"
+            )
+        return ocr_request.processing_type, ocr_request.image_url, image_bytes
+
+    if content_type == 'multipart/form-data':
+        # The cap applies to the raw body as it streams in, so chunked uploads
+        # (no Content-Length) are cut off too instead of being spooled whole.
+        max_body = MAX_FILE_SIZE + _MULTIPART_OVERHEAD
+        declared = _declared_length(request)
+        if declared is not None and declared > max_body:
+            raise PayloadTooLargeError(f"File too large, max {MAX_FILE_SIZE} bytes")
+
+        parser = MultiPartParser(
+            request.headers,
+            OCRService.capped_stream(request.stream(), max_body),
+            max_files=1,
+            max_fields=10,
+        )
+        form = None
+        try:
+            try:
+                form = await parser.parse()
+            except PayloadTooLargeError:
+                raise PayloadTooLargeError(f"File too large, max {MAX_FILE_SIZE} bytes")
+            except MultiPartException as e:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Image data required"
+                    detail=e.message
                 )
-
-            import base64
-            try:
-                image_bytes = base64.b64decode(ocr_request.image_data)
-            except Exception as e:
+            upload = form.get('file')
+            if upload is None or isinstance(upload, str):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invalid base64 image data"
+                    detail="Image file required"
                 )
+            image_bytes = await OCRService.read_capped(
+                OCRService.iter_upload(upload),
+                declared_size=upload.size,
+            )
+            image_url = form.get('image_url') or f"file://{upload.filename}"
+        finally:
+            if form is not None:
+                await form.close()
+            else:
+                # parse() only closes its spooled files on MultiPartException.
+                for spooled in parser._files_to_close_on_error:
+                    spooled.close()
+        return OCRProcessingType.UPLOAD, image_url, image_bytes
+
+    image_bytes = await OCRService.read_capped(
+        request.stream(),
+        declared_size=_declared_length(request),
+    )
+    return OCRProcessingType.UPLOAD, None, image_bytes
+
+
+@router.post("/process", response_model=OCRResponse)
+async def process_ocr(
+    request: Request,
+    current_user = Depends(get_current_user)
+):
+    """Process image for OCR text extraction (raw binary, multipart or base64 JSON body)"""
+    try:
+        processing_type, image_url, image_bytes = await _read_ocr_payload(request)
+        try:
+            processing_type = OCRProcessingType(processing_type)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid processing type"
+            )
+
+        # Route based on processing type
+        if image_bytes is None:
+            result = await run_in_threadpool(OCRService.process_image_url, image_url)
 
-            # Validate image
-            OCRService.validate_image(image_bytes)
+        else:
+            # Validate image from its header, then hand the same buffer to providers
+            header = OCRService.validate_image(image_bytes)
+            await run_in_threadpool(OCRService.verify_decodable, image_bytes, header)
 
-            result = OCRService.process_image_file(image_bytes)
+            result = await run_in_threadpool(OCRService.process_image_file, image_bytes, header=header)
 
         history_id = None
         save_history_enabled = current_user.get('settings', {}).get('save_history', True)
 
         if save_history_enabled:
-            history_item = _build_ocr_history_item(current_user, result, ocr_request.image_url)
-            insert_result = db.processing_history.insert_one(history_item)
-            history_id = str(insert_result.inserted_id)
+            history_item = OCRService.build_history_item(current_user['_id'], result, image_url)
+            history_id = str(await history_writer.enqueue_async(history_item))
 
         return {
             'extracted_text': result['extracted_text'],
             'confidence_score': result['confidence_score'],
             'processing_time_ms': result['processing_time_ms'],
             'image_dimensions': result['image_dimensions'],
-            'processing_type': ocr_request.processing_type,
+            'processing_type': processing_type,
             'history_id': history_id
         }
 
     except HTTPException:
         raise
+    except PayloadTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logger.error(f"OCR processing error: {e}")
         raise HTTPException(
@@ -147,29 +203,26 @@ async def process_ocr(
 @router.post("/upload")
 async def upload_image(
     file: UploadFile = File(...),
-    db: Database = Depends(get_database),
     current_user = Depends(get_current_user)
 ):
     """Upload and process image file"""
     try:
-        _cleanup_expired_ocr_history(db, current_user['_id'])
-
-        # Read file
-        contents = await file.read()
+        # Read file, enforcing the size cap while reading
+        contents = await OCRService.read_capped(OCRService.iter_upload(file), declared_size=file.size)
 
         # Validate image
-        OCRService.validate_image(contents)
+        header = OCRService.validate_image(contents)
+        await run_in_threadpool(OCRService.verify_decodable, contents, header)
 
         # Process OCR
-        result = OCRService.process_image_file(contents, file.content_type)
+        result = await run_in_threadpool(OCRService.process_image_file, contents, file.content_type, header)
 
         history_id = None
         save_history_enabled = current_user.get('settings', {}).get('save_history', True)
 
         if save_history_enabled:
-            history_item = _build_ocr_history_item(current_user, result, f"file://{file.filename}")
-            insert_result = db.processing_history.insert_one(history_item)
-            history_id = str(insert_result.inserted_id)
+            history_item = OCRService.build_history_item(current_user['_id'], result, f"file://{file.filename}")
+            history_id = str(await history_writer.enqueue_async(history_item))
 
         return {
             'extracted_text': result['extracted_text'],
@@ -181,9 +234,146 @@ async def upload_image(
 
     except HTTPException:
         raise
+    except PayloadTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logger.error(f"File upload OCR error: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+
+
+async def _find_job(db: AsyncDatabase, job_id: str, user_id):
+    try:
+        obj_id = ObjectId(job_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid job ID"
+        )
+
+    job = await db.ocr_jobs.find_one({'_id': obj_id, 'user_id': user_id}, {'image_data': 0})
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="OCR job not found"
+        )
+    return job
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_ocr_job(
+    request: Request,
+    sync_db: Database = Depends(get_sync_database),
+    current_user = Depends(get_current_user)
+):
+    """Queue an OCR job and return immediately (same body formats as /process)"""
+    try:
+        processing_type, image_url, image_bytes = await _read_ocr_payload(request)
+        try:
+            processing_type = OCRProcessingType(processing_type)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid processing type"
+            )
+
+        header = None
+        if image_bytes is not None:
+            header = OCRService.validate_image(image_bytes)
+            await run_in_threadpool(OCRService.verify_decodable, image_bytes, header)
+        job = await run_in_threadpool(
+            OCRJobService.submit, sync_db, current_user, processing_type.value, image_url, image_bytes, header
+        )
+        job_id = str(job['_id'])
+
+        return {
+            **OCRJobService.public_view(job),
+            'status_url': f"{router.prefix}/jobs/{job_id}",
+            'events_url': f"{router.prefix}/jobs/{job_id}/events",
+        }
+
+    except HTTPException:
+        raise
+    except PayloadTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"OCR job submission error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to queue OCR job"
+        )
+
+@router.get("/jobs/{job_id}")
+async def get_ocr_job(
+    job_id: str,
+    db: AsyncDatabase = Depends(get_database),
+    current_user = Depends(get_current_user)
+):
+    """Poll the state of an OCR job"""
+    return OCRJobService.public_view(await _find_job(db, job_id, current_user['_id']))
+
+@router.get("/jobs/{job_id}/events")
+async def stream_ocr_job_events(
+    job_id: str,
+    db: AsyncDatabase = Depends(get_database),
+    current_user = Depends(get_current_user)
+):
+    """Server-Sent Events stream of OCR job state until it completes or fails"""
+    job = await _find_job(db, job_id, current_user['_id'])
+    user_id = current_user['_id']
+
+    async def event_stream():
+        changed = ocr_job_worker.subscribe(job_id)
+        last_update = None
+        current = job
+        try:
+            while True:
+                if current['updated_at'] != last_update:
+                    last_update = current['updated_at']
+                    view = OCRJobService.public_view(current)
+                    yield f"event: {view['status']}\ndata: {json.dumps(view)}\n\n"
+                    if current['status'] in FINAL_STATES:
+                        return
+                else:
+                    yield ": keep-alive\n\n"
+
+                # Woken immediately when this instance processes the job,
+                # otherwise re-read after the poll interval.
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=ocr_job_worker.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+                try:
+                    current = await _find_job(db, job_id, user_id)
+                except HTTPException as e:
+                    # The response has started: report the job as gone (expired
+                    # or deleted) in-band and end the stream.
+                    gone = {'job_id': job_id, 'status': 'not_found', 'error': e.detail}
+                    yield f"event: error\ndata: {json.dumps(gone)}\n\n"
+                    return
+        finally:
+            ocr_job_worker.unsubscribe(job_id, changed)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -1,55 +1,22 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime
-from bson.objectid import ObjectId
 from app.models import (
     GrammarCheckRequest, GrammarCheckResponse,
     ParaphraseRequest, ParaphraseResponse,
     TranslateRequest, TranslateResponse
 )
 from app.services.text_service import TextProcessingService
-from app.database import get_database
-from app.auth.jwt_handler import JWTHandler
-from pymongo.database import Database
+from app.services.history_writer import history_writer
+from app.auth.dependencies import get_current_user
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/text", tags=["Text Processing"])
-security = HTTPBearer(auto_error=False)
-
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Database = Depends(get_database)):
-    """Dependency to verify authentication"""
-    if not credentials:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing authorization header"
-        )
-
-    token = credentials.credentials
-    payload = JWTHandler.verify_token(token)
-
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token"
-        )
-
-    user_id = payload.get('user_id')
-    user = db.users.find_one({'_id': ObjectId(user_id)})
-
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
-        )
-
-    return user
 
 @router.post("/grammar-check", response_model=GrammarCheckResponse)
 async def check_grammar(
     request: GrammarCheckRequest,
-    db: Database = Depends(get_database),
     current_user = Depends(get_current_user)
 ):
     """Check grammar and spelling in text"""
@@ -78,8 +45,7 @@ async def check_grammar(
                     'suggestions_count': len(result['suggestions'])
                 }
             }
-            insert_result = db.processing_history.insert_one(history_item)
-            history_id = str(insert_result.inserted_id)
+            history_id = str(await history_writer.enqueue_async(history_item))
 
         return {
             'original_text': result['original_text'],
@@ -104,7 +70,6 @@ async def check_grammar(
 @router.post("/paraphrase", response_model=ParaphraseResponse)
 async def paraphrase_text(
     request: ParaphraseRequest,
-    db: Database = Depends(get_database),
     current_user = Depends(get_current_user)
 ):
     """Paraphrase and improve text"""
@@ -128,8 +93,7 @@ async def paraphrase_text(
                     'alternatives_count': len(result['alternatives'])
                 }
             }
-            insert_result = db.processing_history.insert_one(history_item)
-            history_id = str(insert_result.inserted_id)
+            history_id = str(await history_writer.enqueue_async(history_item))
 
         return {
             'original_text': result['original_text'],
@@ -153,7 +117,6 @@ async def paraphrase_text(
 @router.post("/translate", response_model=TranslateResponse)
 async def translate_text(
     request: TranslateRequest,
-    db: Database = Depends(get_database),
     current_user = Depends(get_current_user)
 ):
     """Translate text to target language"""
@@ -182,8 +145,7 @@ async def translate_text(
                     'detected_language': result['detected_language']
                 }
             }
-            insert_result = db.processing_history.insert_one(history_item)
-            history_id = str(insert_result.inserted_id)
+            history_id = str(await history_writer.enqueue_async(history_item))
 
         return {
             'original_text': result['original_text'],
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from pymongo.database import Database
+from app.config import (
+    BATCH_ITEM_TIMEOUT, BATCH_JOB_WORKERS, BATCH_JOB_LEASE_SECONDS,
+    BATCH_JOB_MAX_ATTEMPTS, BATCH_JOB_RETENTION_HOURS,
+)
+from app.models import ProcessingType
+from app.services.history_writer import insert_once
+from app.services.job_queue import (
+    LeasedJobWorker, JOB_QUEUED, JOB_PROCESSING, JOB_COMPLETED, JOB_FAILED,
+)
+from app.services.text_service import TextProcessingService
+
+logger = logging.getLogger(__name__)
+
+# Items are written in chunks so very large batches stay under the 16 MB
+# wire-message limit and do not hold one huge list in memory.
+_INSERT_CHUNK_SIZE = 1000
+
+
+class BatchJobService:
+    """Durable batch jobs stored in ``batch_jobs`` / ``batch_items``.
+
+    Every item is its own leased job, so items of one batch are spread over
+    all worker slots of all API instances and are retried independently.
+    Progress is computed from the stored item states.
+    """
+
+    @staticmethod
+    def process_item(processing_type: ProcessingType, item: dict) -> dict:
+        """Run one batch item through the matching text service (blocking)."""
+        if processing_type == ProcessingType.GRAMMAR:
+            return TextProcessingService.check_grammar(
+                item.get('text', ''),
+                item.get('language', 'en')
+            )
+
+        if processing_type == ProcessingType.PARAPHRASE:
+            return TextProcessingService.paraphrase(
+                item.get('text', ''),
+                item.get('style', 'normal')
+            )
+
+        if processing_type == ProcessingType.TRANSLATE:
+            return TextProcessingService.translate(
+                item.get('text', ''),
+                item.get('source_language', 'auto'),
+                item.get('target_language', 'en')
+            )
+
+        raise ValueError(f"Unsupported processing type: {processing_type}")
+
+    @staticmethod
+    def build_history_item(user_id, processing_type: str, item: dict, data: dict,
+                           processing_time_ms: float, index: int, batch_id: str) -> dict:
+        return {
+            'user_id': user_id,
+            'type': processing_type,
+            'input_text': item.get('text', '')[:100],
+            'output_text': data.get('output_text', '')[:100],
+            'processing_time_ms': processing_time_ms,
+            'created_at': datetime.utcnow(),
+            'is_exported': False,
+            'batch_id': batch_id,
+            'batch_index': index
+        }
+
+    @staticmethod
+    def submit(db: Database, current_user, processing_type: ProcessingType, items: list) -> dict:
+        now = datetime.utcnow()
+        expires_at = now + timedelta(hours=BATCH_JOB_RETENTION_HOURS)
+        save_history = current_user.get('settings', {}).get('save_history', True)
+
+        batch = {
+            'user_id': current_user['_id'],
+            'processing_type': processing_type.value,
+            'total_items': len(items),
+            'created_at': now,
+            'expires_at': expires_at,
+        }
+        batch['_id'] = db.batch_jobs.insert_one(batch).inserted_id
+
+        try:
+            for chunk_start in range(0, len(items), _INSERT_CHUNK_SIZE):
+                chunk = items[chunk_start:chunk_start + _INSERT_CHUNK_SIZE]
+                db.batch_items.insert_many([
+                    {
+                        'batch_id': batch['_id'],
+                        'user_id': current_user['_id'],
+                        'index': chunk_start + offset,
+                        'processing_type': processing_type.value,
+                        'input': item,
+                        'save_history': save_history,
+                        'status': JOB_QUEUED,
+                        'attempts': 0,
+                        'created_at': now,
+                        'updated_at': now,
+                        'available_at': now,
+                        'expires_at': expires_at,
+                    }
+                    for offset, item in enumerate(chunk)
+                ], ordered=False)
+        except Exception:
+            # A batch missing some of its items would never complete: remove
+            # what was written so the submission fails as a whole.
+            try:
+                db.batch_items.delete_many({'batch_id': batch['_id']})
+                db.batch_jobs.delete_one({'_id': batch['_id']})
+            except Exception as cleanup_err:
+                logger.error(f"Could not remove partial batch {batch['_id']}: {cleanup_err}")
+            raise
+
+        batch_item_worker.notify()
+        return batch
+
+    @staticmethod
+    def status(db: Database, batch: dict, include_items: bool = False,
+               after_index: int = -1, items_limit: int = 100) -> dict:
+        """Live progress of a batch job from its stored item states."""
+        counts = {JOB_QUEUED: 0, JOB_PROCESSING: 0, JOB_COMPLETED: 0, JOB_FAILED: 0}
+        total_time = 0.0
+        started_at = None
+        finished_at = None
+
+        for group in db.batch_items.aggregate([
+            {'$match': {'batch_id': batch['_id']}},
+            {'$group': {
+                '_id': '$status',
+                'count': {'$sum': 1},
+                'total_time': {'$sum': {'$ifNull': ['$processing_time_ms', 0]}},
+                'first_started': {'$min': '$started_at'},
+                'last_finished': {'$max': '$finished_at'},
+            }},
+        ]):
+            counts[group['_id']] = group['count']
+            total_time += group['total_time']
+            if group.get('first_started') and (started_at is None or group['first_started'] < started_at):
+                started_at = group['first_started']
+            if group.get('last_finished') and (finished_at is None or group['last_finished'] > finished_at):
+                finished_at = group['last_finished']
+
+        done = counts[JOB_COMPLETED] + counts[JOB_FAILED]
+        total = batch['total_items']
+        if done >= total:
+            batch_status = JOB_COMPLETED
+        elif done or counts[JOB_PROCESSING]:
+            batch_status = JOB_PROCESSING
+        else:
+            batch_status = JOB_QUEUED
+            finished_at = None
+
+        response = {
+            'batch_id': str(batch['_id']),
+            'status': batch_status,
+            'processing_type': batch['processing_type'],
+            'total_items': total,
+            'queued': counts[JOB_QUEUED],
+            'processing': counts[JOB_PROCESSING],
+            'successful': counts[JOB_COMPLETED],
+            'failed': counts[JOB_FAILED],
+            'completed': done,
+            'progress': round(done / total, 4) if total else 1.0,
+            'total_processing_time_ms': total_time,
+            'average_time_per_item': total_time / counts[JOB_COMPLETED] if counts[JOB_COMPLETED] else 0,
+            'created_at': batch['created_at'].isoformat(),
+            'started_at': started_at.isoformat() if started_at else None,
+            'finished_at': finished_at.isoformat() if finished_at and batch_status == JOB_COMPLETED else None,
+        }
+
+        if include_items:
+            items = list(
+                db.batch_items.find(
+                    {'batch_id': batch['_id'], 'index': {'$gt': after_index}},
+                    {'index': 1, 'status': 1, 'attempts': 1, 'result': 1, 'last_error': 1,
+                     'processing_time_ms': 1, 'started_at': 1, 'finished_at': 1}
+                )
+                .sort('index', 1)
+                .limit(items_limit)
+            )
+            response['items'] = [
+                {
+                    'index': item['index'],
+                    'status': item['status'],
+                    'attempts': item.get('attempts', 0),
+                    'processing_time_ms': item.get('processing_time_ms'),
+                    'started_at': item['started_at'].isoformat() if item.get('started_at') else None,
+                    'finished_at': item['finished_at'].isoformat() if item.get('finished_at') else None,
+                    'data': item.get('result'),
+                    'error': item.get('last_error') if item['status'] != JOB_COMPLETED else None,
+                }
+                for item in items
+            ]
+            response['next_after_index'] = items[-1]['index'] if len(items) == items_limit else None
+
+        return response
+
+    @staticmethod
+    async def process(job: dict) -> dict:
+        """Worker handler for one batch item."""
+        item_start = time.time()
+        try:
+            data = await asyncio.wait_for(
+                run_in_threadpool(BatchJobService.process_item, ProcessingType(job['processing_type']), job['input']),
+                timeout=BATCH_ITEM_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out after {BATCH_ITEM_TIMEOUT} seconds")
+        processing_time_ms = (time.time() - item_start) * 1000
+
+        if job.get('save_history'):
+            history_item = BatchJobService.build_history_item(
+                job['user_id'], job['processing_type'], job['input'], data,
+                processing_time_ms, job['index'], str(job['batch_id'])
+            )
+            # Reuse the item id so a retried item cannot be recorded twice.
+            history_item['_id'] = job['_id']
+            await run_in_threadpool(insert_once, history_item)
+
+        return {'result': data, 'processing_time_ms': processing_time_ms}
+
+
+batch_item_worker = LeasedJobWorker(
+    name="batch-items",
+    collection_name="batch_items",
+    handler=BatchJobService.process,
+    concurrency=BATCH_JOB_WORKERS,
+    lease_seconds=BATCH_JOB_LEASE_SECONDS,
+    poll_seconds=2,
+    max_attempts=BATCH_JOB_MAX_ATTEMPTS,
+)
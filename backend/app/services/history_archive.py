@@ -0,0 +1,377 @@
+import gzip
+import logging
+import os
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+import bson
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.config import HISTORY_ARCHIVE_DIR, HISTORY_ARCHIVE_CHUNK_ITEMS
+from app.services.history_codec import HistoryCodec
+from app.services.history_partitions import HistoryPartitions
+from app.services.history_stats import HistoryStatsService
+from app.services.history_writer import add_previews
+from app.services.text_blobs import TextBlobStore
+
+logger = logging.getLogger(__name__)
+
+_DUPLICATE_KEY = 11000
+
+# An archive run that has not finished after this long is considered dead.
+_STALE_RUN = timedelta(hours=6)
+
+RUN_ARCHIVING = "archiving"
+RUN_RELEASED = "released"
+RUN_ARCHIVED = "archived"
+
+# A month being archived is renamed to this, so writers cannot add to it.
+_STAGING_SUFFIX = "_archiving"
+
+
+class HistoryArchive:
+    """Cold storage for whole history months.
+
+    ``archive_partition`` reads a month partition in ``_id`` order, restores
+    each document's full texts (codec and blob references) and writes it to
+    either the ``history_archive`` collection (zlib-compressed BSON chunks of
+    HISTORY_ARCHIVE_CHUNK_ITEMS documents) or, with HISTORY_ARCHIVE_DIR, one
+    ``<partition>.bson.gz`` file (mongorestore-compatible). Only once the
+    archive is complete are the blob references released, the users' stats
+    invalidated and the partition dropped. ``restore_partition`` reverses it.
+
+    The partition is first renamed to ``<partition>_archiving`` and archived
+    from there. Late writes to the month (spool replay, long-running jobs)
+    recreate the partition; they are moved into the staged collection and
+    appended to the archive before it closes. Any arriving after that stay
+    online in the recreated partition, so nothing is dropped unarchived.
+
+    ``history_archive_runs`` records one document per archived month; it also
+    keeps two instances from archiving the same month concurrently.
+
+    Erasing a user's history (``erase_user``) rewrites the ``history_archive``
+    chunks holding their documents. Archive files cannot be edited in place,
+    so ``history_erasures`` also records when each user's history was erased;
+    archiving and restoring skip documents created before that moment.
+    """
+
+    # ---- archiving ----
+
+    @staticmethod
+    def candidates(db: Database, keep_months: int) -> list:
+        """Partitions older than the newest ``keep_months`` months, oldest first."""
+        HistoryPartitions.refresh(db)
+        names = HistoryPartitions.months_before(HistoryPartitions.month_start(datetime.utcnow(), keep_months))
+        # Months whose archive run died after staging them.
+        staged = [
+            staging[:-len(_STAGING_SUFFIX)]
+            for staging in db.list_collection_names(filter={'name': {'$regex': f'{_STAGING_SUFFIX}$'}})
+        ]
+        return sorted(set(names) | {name for name in staged if HistoryPartitions.month_of(name) is not None})
+
+    @staticmethod
+    def _claim(db: Database, name: str) -> dict | None:
+        now = datetime.utcnow()
+        try:
+            run = {'_id': name, 'status': RUN_ARCHIVING, 'started_at': now}
+            db.history_archive_runs.insert_one(run)
+            return run
+        except DuplicateKeyError:
+            # Take over a run that died half-way; it may already have released.
+            return db.history_archive_runs.find_one_and_update(
+                {'_id': name, 'status': {'$ne': RUN_ARCHIVED}, 'started_at': {'$lt': now - _STALE_RUN}},
+                {'$set': {'started_at': now}}
+            )
+
+    @staticmethod
+    def archive_partition(db: Database, name: str, directory: str = HISTORY_ARCHIVE_DIR,
+                          chunk_items: int = HISTORY_ARCHIVE_CHUNK_ITEMS) -> dict | None:
+        """Archive and drop one past month; None if another run holds it."""
+        month = HistoryPartitions.month_of(name)
+        if month is None or month >= HistoryPartitions.month_start(datetime.utcnow()):
+            raise ValueError(f"{name} is not a past history month")
+
+        run = HistoryArchive._claim(db, name)
+        if run is None:
+            return None
+
+        staging = f"{name}{_STAGING_SUFFIX}"
+        totals = {}
+        users = set()
+        # A taken-over run past RUN_RELEASED already has its archive complete.
+        if run['status'] != RUN_RELEASED:
+            HistoryArchive._stage(db, name, staging)
+            try:
+                totals = HistoryArchive._write_archive(db, name, staging, directory, chunk_items)
+            except Exception:
+                HistoryArchive._unstage(db, name, staging)
+                raise
+            users = totals.pop('users')
+            # The archive holds the full texts now; the month's references go.
+            TextBlobStore.release(db, totals.pop('refs'))
+            db.history_archive_runs.update_one({'_id': name}, {'$set': {'status': RUN_RELEASED}})
+        HistoryPartitions.forget(db, name)
+        db[staging].drop()
+        HistoryStatsService.invalidate(db, users)
+
+        db.history_archive_runs.update_one({'_id': name}, {'$set': {
+            'status': RUN_ARCHIVED,
+            'finished_at': datetime.utcnow(),
+            **totals,
+        }})
+        logger.info(f"Archived {totals.get('documents', 0)} history documents of {name} to {totals.get('target')}")
+        return totals
+
+    @staticmethod
+    def _stage(db: Database, name: str, staging: str):
+        """Rename the partition out of the writers' way (kept if staged already)."""
+        existing = db.list_collection_names(filter={'name': {'$regex': f'^{name}({_STAGING_SUFFIX})?$'}})
+        if name in existing and staging not in existing:
+            db[name].rename(staging)
+
+    @staticmethod
+    def _unstage(db: Database, name: str, staging: str):
+        """Put a month back online after a failed run.
+
+        If late writes recreated the partition meanwhile, the staged month is
+        left for the next run (``candidates`` lists it).
+        """
+        try:
+            if name not in db.list_collection_names(filter={'name': name}):
+                db[staging].rename(name)
+        except Exception as e:
+            logger.error(f"Could not put {staging} back online as {name}: {e}")
+
+    @staticmethod
+    def _take_late_writes(db: Database, name: str, staging: str, limit: int) -> list:
+        """Move documents written to the month since it was staged into ``staging``."""
+        batch = list(db[name].find().sort('_id', 1).limit(limit))
+        if not batch:
+            return []
+        try:
+            db[staging].insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Copied by an earlier, interrupted pass.
+            if any(err.get('code') != _DUPLICATE_KEY for err in e.details.get('writeErrors', [])):
+                raise
+        # Only once the copy is stored, so a failure cannot lose them.
+        db[name].delete_many({'_id': {'$in': [document['_id'] for document in batch]}})
+        return batch
+
+    @staticmethod
+    def _write_archive(db: Database, name: str, staging: str, directory: str, chunk_items: int) -> dict:
+        refs = Counter()
+        users = set()
+        totals = {'documents': 0, 'chunks': 0, 'bson_bytes': 0}
+        sink = _FileSink(directory, name) if directory else _CollectionSink(db, name)
+
+        def archive(batch: list):
+            # References of erased documents are released with the rest.
+            refs.update(TextBlobStore.references(batch))
+            batch = HistoryArchive._without_erased(db, batch)
+            if not batch:
+                return
+            for document in batch:
+                HistoryCodec.decode(document)
+                users.add(document.get('user_id'))
+            TextBlobStore.resolve_many(db, batch)
+
+            totals['bson_bytes'] += sink.write(batch)
+            totals['documents'] += len(batch)
+            totals['chunks'] += 1
+
+        try:
+            last_id = None
+            while True:
+                query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+                batch = list(db[staging].find(query).sort('_id', 1).limit(max(1, chunk_items)))
+                if not batch:
+                    break
+                last_id = batch[-1]['_id']
+                archive(batch)
+
+            # Writes that reached the month while it was being read.
+            while True:
+                batch = HistoryArchive._take_late_writes(db, name, staging, max(1, chunk_items))
+                if not batch:
+                    break
+                logger.info(f"Archiving {len(batch)} late history writes to {name}")
+                archive(batch)
+            sink.close()
+        except Exception:
+            sink.abort()
+            db.history_archive_runs.delete_one({'_id': name, 'status': RUN_ARCHIVING})
+            raise
+        return {**totals, 'stored_bytes': sink.stored_bytes, 'target': sink.target, 'refs': refs, 'users': users}
+
+    # ---- erasure ----
+
+    @staticmethod
+    def erase_user(db: Database, user_id) -> int:
+        """Remove a user's archived history (cleared history, deleted account).
+
+        Returns how many documents were removed from ``history_archive``;
+        documents in archive files are only skipped on restore.
+        """
+        db.history_erasures.update_one(
+            {'_id': user_id}, {'$max': {'erased_at': datetime.utcnow()}}, upsert=True
+        )
+        removed = 0
+        # Chunks written before they listed their users are checked too.
+        for chunk in db.history_archive.find({'$or': [{'user_ids': user_id}, {'user_ids': {'$exists': False}}]}):
+            documents = bson.decode_all(zlib.decompress(chunk['data']))
+            kept = [document for document in documents if document.get('user_id') != user_id]
+            if len(kept) == len(documents):
+                continue
+            removed += len(documents) - len(kept)
+            if not kept:
+                db.history_archive.delete_one({'_id': chunk['_id']})
+                continue
+            db.history_archive.update_one({'_id': chunk['_id']}, {'$set': {
+                'data': zlib.compress(b''.join(bson.encode(document) for document in kept)),
+                'count': len(kept),
+                'first_id': kept[0]['_id'],
+                'last_id': kept[-1]['_id'],
+                'user_ids': list({document.get('user_id') for document in kept}),
+            }})
+        if removed:
+            logger.info(f"Erased {removed} archived history documents of user {user_id}")
+        return removed
+
+    @staticmethod
+    def _without_erased(db: Database, batch: list) -> list:
+        """``batch`` minus documents created before their user's history was erased."""
+        users = list({document.get('user_id') for document in batch})
+        erased = {erasure['_id']: erasure['erased_at'] for erasure in db.history_erasures.find({'_id': {'$in': users}})}
+        if not erased:
+            return batch
+
+        def created(document):
+            created_at = document.get('created_at')
+            return created_at if isinstance(created_at, datetime) else HistoryPartitions.id_time(document['_id'])
+
+        return [
+            document for document in batch
+            if document.get('user_id') not in erased or created(document) >= erased[document.get('user_id')]
+        ]
+
+    # ---- restoring ----
+
+    @staticmethod
+    def restore_partition(db: Database, name: str, directory: str = HISTORY_ARCHIVE_DIR,
+                          batch_size: int = HISTORY_ARCHIVE_CHUNK_ITEMS) -> int:
+        """Write an archived month back into its partition; returns documents restored."""
+        source = _FileSink.read(directory, name) if directory else _CollectionSink.read(db, name)
+        restored = 0
+        batch = []
+        for document in source:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                restored += HistoryArchive._restore_batch(db, batch)
+                batch = []
+        if batch:
+            restored += HistoryArchive._restore_batch(db, batch)
+
+        if not directory:
+            db.history_archive.delete_many({'partition': name})
+        db.history_archive_runs.delete_one({'_id': name})
+        logger.info(f"Restored {restored} history documents of {name}")
+        return restored
+
+    @staticmethod
+    def _restore_batch(db: Database, batch: list) -> int:
+        batch = HistoryArchive._without_erased(db, batch)
+        if not batch:
+            return 0
+        for document in batch:
+            add_previews(document)
+        TextBlobStore.externalize(db, batch)
+        for document in batch:
+            HistoryCodec.encode(document)
+        try:
+            HistoryPartitions.insert_many(db, batch)
+            inserted = len(batch)
+        except BulkWriteError as e:
+            # Documents restored by an earlier, interrupted run.
+            write_errors = e.details.get('writeErrors', [])
+            if any(err.get('code') != _DUPLICATE_KEY for err in write_errors):
+                raise
+            TextBlobStore.release(db, TextBlobStore.references([batch[err['index']] for err in write_errors]))
+            inserted = e.details.get('nInserted', 0)
+        HistoryStatsService.invalidate(db, {document.get('user_id') for document in batch})
+        return inserted
+
+
+class _CollectionSink:
+    """Archive chunks in ``history_archive`` (``_id`` = partition:sequence)."""
+
+    def __init__(self, db: Database, name: str):
+        self.db = db
+        self.name = name
+        self.target = "history_archive"
+        self.stored_bytes = 0
+        self._sequence = 0
+        # Leftovers of an interrupted run are rewritten from scratch.
+        db.history_archive.delete_many({'partition': name})
+
+    def write(self, documents: list) -> int:
+        encoded = b''.join(bson.encode(document) for document in documents)
+        raw = len(encoded)
+        data = zlib.compress(encoded)
+        self.db.history_archive.insert_one({
+            '_id': f"{self.name}:{self._sequence:06d}",
+            'partition': self.name,
+            'sequence': self._sequence,
+            'first_id': documents[0]['_id'],
+            'last_id': documents[-1]['_id'],
+            'count': len(documents),
+            # Lets erasing a user's history find the chunks to rewrite.
+            'user_ids': list({document.get('user_id') for document in documents}),
+            'codec': 'zlib',
+            'data': data,
+            'archived_at': datetime.utcnow(),
+        })
+        self._sequence += 1
+        self.stored_bytes += len(data)
+        return raw
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+    @staticmethod
+    def read(db: Database, name: str):
+        for chunk in db.history_archive.find({'partition': name}).sort('sequence', 1):
+            yield from bson.decode_all(zlib.decompress(chunk['data']))
+
+
+class _FileSink:
+    """``<directory>/<partition>.bson.gz``, written under a temporary name."""
+
+    def __init__(self, directory: str, name: str):
+        os.makedirs(directory, exist_ok=True)
+        self.target = os.path.join(directory, f"{name}.bson.gz")
+        self._partial = self.target + ".partial"
+        self.stored_bytes = 0
+        self._file = gzip.open(self._partial, 'wb')
+
+    def write(self, documents: list) -> int:
+        data = b''.join(bson.encode(document) for document in documents)
+        self._file.write(data)
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._partial, self.target)
+        self.stored_bytes = os.path.getsize(self.target)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._partial)
+
+    @staticmethod
+    def read(directory: str, name: str):
+        with gzip.open(os.path.join(directory, f"{name}.bson.gz"), 'rb') as file:
+            yield from bson.decode_file_iter(file)
@@ -0,0 +1,102 @@
+import logging
+import zlib
+from bson.binary import Binary
+from app.config import HISTORY_COMPRESS_MIN_BYTES, HISTORY_COMPRESS_LEVEL, HISTORY_SEARCH_TEXT_CHARS
+
+logger = logging.getLogger(__name__)
+
+CODEC_ZLIB = "zlib"
+TEXT_FIELDS = ('input_text', 'output_text')
+SEARCH_FIELD = 'search_text'
+
+
+class HistoryCodec:
+    """Storage codec for the large text fields of history documents.
+
+    A text field of at least HISTORY_COMPRESS_MIN_BYTES (UTF-8) is stored
+    zlib-compressed in ``<field>_z`` instead of ``<field>``; the document's
+    ``text_codec`` names the codec. Documents without a marker are plain and
+    pass through ``decode`` unchanged, so old and new documents can coexist.
+
+    NOTE:
+    - Listings never read these fields (they use the stored previews), so
+      only single-item reads and exports pay for decompression.
+    - Texts at or above the threshold (which also covers the larger ones
+      moved to ``text_blobs``) keep a capped plain copy in ``search_text``
+      for ``$text`` search; reads drop it.
+    """
+
+    @staticmethod
+    def add_search_text(document: dict) -> dict:
+        """Store the first HISTORY_SEARCH_TEXT_CHARS of texts that will not stay plain.
+
+        Call before ``encode``/externalizing, while the texts are still there.
+        """
+        if SEARCH_FIELD in document:
+            return document
+        parts = [
+            document[field][:HISTORY_SEARCH_TEXT_CHARS]
+            for field in TEXT_FIELDS
+            if isinstance(document.get(field), str)
+            and len(document[field].encode('utf-8')) >= HISTORY_COMPRESS_MIN_BYTES
+        ]
+        if parts:
+            document[SEARCH_FIELD] = '\n'.join(parts)
+        return document
+
+    @staticmethod
+    def encode(document: dict) -> dict:
+        """Compress large text fields in place; returns the document."""
+        for field in TEXT_FIELDS:
+            text = document.get(field)
+            if not isinstance(text, str):
+                continue
+            compressed = HistoryCodec.compress(text)
+            if compressed is None:
+                continue
+            document[f'{field}_z'] = compressed
+            document['text_codec'] = CODEC_ZLIB
+            del document[field]
+        return document
+
+    @staticmethod
+    def decode(document: dict) -> dict:
+        """Restore compressed text fields in place; returns the document."""
+        document.pop(SEARCH_FIELD, None)
+        codec = document.pop('text_codec', None)
+        if codec is None:
+            return document
+        if codec != CODEC_ZLIB:
+            raise ValueError(f"Unknown history text codec: {codec}")
+
+        for field in TEXT_FIELDS:
+            compressed = document.pop(f'{field}_z', None)
+            if compressed is not None:
+                document[field] = HistoryCodec.decompress(compressed)
+        return document
+
+    @staticmethod
+    def compress(text: str):
+        """zlib payload for ``text``, or None when it is small or incompressible."""
+        raw = text.encode('utf-8')
+        if len(raw) < HISTORY_COMPRESS_MIN_BYTES:
+            return None
+        compressed = zlib.compress(raw, HISTORY_COMPRESS_LEVEL)
+        # Keep incompressible text (already short, or random) as it is.
+        if len(compressed) >= len(raw):
+            return None
+        return Binary(compressed)
+
+    @staticmethod
+    def decompress(payload) -> str:
+        return zlib.decompress(payload).decode('utf-8')
+
+    @staticmethod
+    def needs_encoding(document: dict) -> bool:
+        if document.get('text_codec'):
+            return False
+        return any(
+            isinstance(document.get(field), str)
+            and len(document[field].encode('utf-8')) >= HISTORY_COMPRESS_MIN_BYTES
+            for field in TEXT_FIELDS
+        )
@@ -0,0 +1,370 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, PyMongoError
+from app.config import OCR_HISTORY_RETENTION_DAYS, HISTORY_PARTITION_REFRESH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Unpartitioned collection of documents written before partitioning.
+LEGACY = 'processing_history'
+
+_NAME_RE = re.compile(r'^processing_history_(\d{4})_(\d{2})$')
+
+
+def _month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def create_index(collection: Collection, keys, **kwargs) -> bool:
+    """``create_index`` that logs a failure instead of raising.
+
+    Index builds run in sequence at startup; one that fails (e.g. a spec
+    conflicting with an existing index) must not skip the ones after it.
+    """
+    try:
+        collection.create_index(keys, **kwargs)
+        return True
+    except PyMongoError as e:
+        logger.warning(f"Could not create index {kwargs.get('name', keys)} on {collection.name}: {e}")
+        return False
+
+
+class HistoryPartitions:
+    """Monthly ``processing_history_YYYY_MM`` collections.
+
+    A history document lives in the partition of the month of its
+    ``created_at`` (UTC), so a partition covers one contiguous time range and
+    its indexes only grow for a month. Listings walk partitions newest first
+    and stop once a page is full; time-bounded queries only touch the months
+    they overlap.
+
+    Lookups by id go to the month of the ObjectId's timestamp. Jobs mint the
+    id at submission and set ``created_at`` when processed, so the two can
+    fall in different months; those documents also get an entry in
+    ``history_partition_index`` that lookups consult on a miss.
+
+    NOTE:
+    - ``processing_history`` itself (documents from before partitioning) is
+      part of every fan-out while it holds documents; ``python -m
+      app.tools.history_partitions migrate`` moves them into their months.
+    - The set of existing partitions is cached for
+      HISTORY_PARTITION_REFRESH_SECONDS; the current month is always included.
+    """
+
+    _lock = threading.Lock()
+    _indexed = set()
+    _known = {'months': [], 'legacy': False, 'refreshed_at': None}
+
+    # ---- naming ----
+
+    @staticmethod
+    def name_for(moment: datetime) -> str:
+        return f"{LEGACY}_{moment.year:04d}_{moment.month:02d}"
+
+    @staticmethod
+    def month_of(name: str) -> datetime | None:
+        match = _NAME_RE.match(name)
+        return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+    @staticmethod
+    def month_start(moment: datetime, months_back: int = 0) -> datetime:
+        """First day of ``moment``'s month, or of ``months_back`` months before it."""
+        month = _month_start(moment)
+        for _ in range(months_back):
+            month = _month_start(month - timedelta(days=1))
+        return month
+
+    @staticmethod
+    def id_time(item_id: ObjectId) -> datetime:
+        return item_id.generation_time.replace(tzinfo=None)
+
+    @staticmethod
+    def name_of(document: dict) -> str:
+        """Partition of a history document."""
+        created_at = document.get('created_at')
+        if not isinstance(created_at, datetime):
+            created_at = HistoryPartitions.id_time(document['_id'])
+        return HistoryPartitions.name_for(created_at)
+
+    # ---- indexes ----
+
+    @staticmethod
+    def ensure_indexes(db: Database, name: str):
+        """Create the history indexes on one partition (idempotent)."""
+        collection = db[name]
+        create_index(collection, "user_id")
+        create_index(collection, "type")
+        create_index(collection, "created_at")
+        # Keyset pagination of GET /api/history sorts on (created_at, _id)
+        create_index(collection, [("user_id", 1), ("created_at", -1), ("_id", -1)])
+        create_index(collection, [("user_id", 1), ("type", 1), ("created_at", -1), ("_id", -1)])
+
+        # Optional TTL index to auto-delete old OCR history documents
+        # using dedicated expiry field to avoid index conflicts.
+        if OCR_HISTORY_RETENTION_DAYS > 0:
+            create_index(
+                collection,
+                [("ocr_expires_at", 1)],
+                expireAfterSeconds=0,
+                name="ocr_history_ttl_idx"
+            )
+            # Lets the retention sweeper find OCR items still missing an expiry.
+            create_index(collection, [("type", 1), ("ocr_expires_at", 1)])
+
+        create_index(
+            collection,
+            [("batch_id", 1), ("user_id", 1)],
+            partialFilterExpression={"batch_id": {"$exists": True}}
+        )
+
+        # History search: text index partitioned by user (queries always pin user_id).
+        # No language stemming/stop words, since history holds many languages.
+        # Compressed or externalized texts are searched through their capped
+        # search_text copy (previews for items written before it existed).
+        HistoryPartitions._replace_text_index(
+            collection,
+            [
+                ("user_id", 1),
+                ("input_text", "text"), ("output_text", "text"), ("search_text", "text"),
+                ("input_preview", "text"), ("output_preview", "text"),
+            ],
+            default_language="none",
+            language_override="text_search_language",
+            name="history_search_idx"
+        )
+
+        # Content-addressed history texts: references for recounting.
+        create_index(collection, "input_text_ref", sparse=True, name="history_input_ref_idx")
+        create_index(collection, "output_text_ref", sparse=True, name="history_output_ref_idx")
+        # Clearing a user's history counts only their documents holding references.
+        for field in ("input_text_ref", "output_text_ref"):
+            create_index(
+                collection,
+                [("user_id", 1), (field, 1)],
+                partialFilterExpression={field: {"$exists": True}}
+            )
+
+    @staticmethod
+    def _replace_text_index(collection: Collection, keys: list, name: str, **kwargs):
+        """Create the text index ``name``, dropping any other text index first.
+
+        A collection holds at most one text index, and an index whose name is
+        reused with different keys cannot be created; so an older text index
+        (e.g. ``history_text_idx`` on previous deployments) whose name or
+        fields differ is dropped before the build.
+        """
+        fields = {field for field, kind in keys if kind == "text"}
+        try:
+            existing = collection.index_information()
+        except PyMongoError as e:
+            logger.warning(f"Could not list indexes of {collection.name}: {e}")
+            existing = {}
+        for index_name, spec in existing.items():
+            if 'textIndexVersion' not in spec:
+                continue
+            if index_name == name and set(spec.get('weights', {})) == fields:
+                return
+            try:
+                collection.drop_index(index_name)
+                logger.info(f"Dropped outdated text index {index_name} on {collection.name}")
+            except PyMongoError as e:
+                logger.warning(f"Could not drop text index {index_name} on {collection.name}: {e}")
+        create_index(collection, keys, name=name, **kwargs)
+
+    @staticmethod
+    def create_indexes(db: Database):
+        """Indexes of the partition index, the current month and legacy history."""
+        create_index(db.history_partition_index, "partition")
+        create_index(db.history_partition_index, "user_id")
+        HistoryPartitions.refresh(db)
+        names = [HistoryPartitions.name_for(datetime.utcnow())]
+        if LEGACY in db.list_collection_names(filter={'name': LEGACY}):
+            names.append(LEGACY)
+        for name in names:
+            HistoryPartitions.ensure_indexes(db, name)
+            with HistoryPartitions._lock:
+                HistoryPartitions._indexed.add(name)
+
+    @staticmethod
+    def _collection(db: Database, name: str) -> Collection:
+        # Indexes are built once per process and month, before the first insert.
+        if name not in HistoryPartitions._indexed:
+            HistoryPartitions.ensure_indexes(db, name)
+            with HistoryPartitions._lock:
+                HistoryPartitions._indexed.add(name)
+        return db[name]
+
+    # ---- writes ----
+
+    @staticmethod
+    def _pointers(documents: list, names: list) -> list:
+        """Index entries for documents whose id points at another month."""
+        return [
+            UpdateOne(
+                {'_id': document['_id']},
+                {'$set': {'partition': name, 'user_id': document.get('user_id')}},
+                upsert=True
+            )
+            for document, name in zip(documents, names)
+            if HistoryPartitions.name_for(HistoryPartitions.id_time(document['_id'])) != name
+        ]
+
+    @staticmethod
+    def insert_one(db: Database, document: dict):
+        name = HistoryPartitions.name_of(document)
+        pointers = HistoryPartitions._pointers([document], [name])
+        if pointers:
+            db.history_partition_index.bulk_write(pointers, ordered=False)
+        HistoryPartitions._collection(db, name).insert_one(document)
+
+    @staticmethod
+    def insert_many(db: Database, documents: list):
+        """Unordered insert into each document's partition.
+
+        Raises one BulkWriteError whose ``writeErrors`` indexes refer to
+        ``documents``, like a single ``insert_many(ordered=False)``.
+        """
+        names = [HistoryPartitions.name_of(document) for document in documents]
+        pointers = HistoryPartitions._pointers(documents, names)
+        if pointers:
+            db.history_partition_index.bulk_write(pointers, ordered=False)
+
+        groups = {}
+        for index, name in enumerate(names):
+            groups.setdefault(name, []).append(index)
+
+        inserted = 0
+        write_errors = []
+        for name, indexes in groups.items():
+            try:
+                HistoryPartitions._collection(db, name).insert_many(
+                    [documents[index] for index in indexes], ordered=False
+                )
+                inserted += len(indexes)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                inserted += e.details.get('nInserted', len(indexes) - len(errors))
+                write_errors.extend({**err, 'index': indexes[err['index']]} for err in errors)
+
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors, 'nInserted': inserted})
+
+    # ---- routing ----
+
+    @staticmethod
+    def _stale() -> bool:
+        refreshed_at = HistoryPartitions._known['refreshed_at']
+        return refreshed_at is None or time.monotonic() - refreshed_at >= HISTORY_PARTITION_REFRESH_SECONDS
+
+    @staticmethod
+    def _remember(names: list, legacy: bool):
+        months = sorted({month for month in map(HistoryPartitions.month_of, names) if month is not None})
+        HistoryPartitions._known = {'months': months, 'legacy': legacy, 'refreshed_at': time.monotonic()}
+
+    @staticmethod
+    def refresh(db: Database):
+        names = db.list_collection_names(filter={'name': {'$regex': f'^{LEGACY}'}})
+        legacy = LEGACY in names and db[LEGACY].estimated_document_count() > 0
+        HistoryPartitions._remember(names, legacy)
+
+    @staticmethod
+    async def refresh_async(db: AsyncDatabase):
+        names = await db.list_collection_names(filter={'name': {'$regex': f'^{LEGACY}'}})
+        legacy = LEGACY in names and await db[LEGACY].estimated_document_count() > 0
+        HistoryPartitions._remember(names, legacy)
+
+    @staticmethod
+    def _select(since: datetime | None, until: datetime | None) -> list:
+        known = HistoryPartitions._known
+        months = set(known['months'])
+        months.add(_month_start(datetime.utcnow()))
+        names = [
+            HistoryPartitions.name_for(month)
+            for month in sorted(months, reverse=True)
+            if (until is None or month < until) and (since is None or _next_month(month) > since)
+        ]
+        if known['legacy']:
+            names.append(LEGACY)
+        return names
+
+    @staticmethod
+    def sources(db: Database, since: datetime | None = None, until: datetime | None = None) -> list:
+        """Collections that may hold history created in [since, until), newest first.
+
+        The legacy collection, when present, comes last; its documents are not
+        ordered relative to the partitions.
+        """
+        if HistoryPartitions._stale():
+            HistoryPartitions.refresh(db)
+        return HistoryPartitions._select(since, until)
+
+    @staticmethod
+    async def sources_async(db: AsyncDatabase, since: datetime | None = None, until: datetime | None = None) -> list:
+        if HistoryPartitions._stale():
+            await HistoryPartitions.refresh_async(db)
+        return HistoryPartitions._select(since, until)
+
+    @staticmethod
+    def months_before(month: datetime) -> list:
+        """Known partition names of months before ``month``, oldest first."""
+        return [HistoryPartitions.name_for(m) for m in HistoryPartitions._known['months'] if m < month]
+
+    @staticmethod
+    async def locate(db: AsyncDatabase, item_id: ObjectId, operation) -> tuple:
+        """Run ``operation(collection)`` where ``item_id`` may live until it returns a result.
+
+        Returns (partition name, result) or (None, None).
+        """
+        name = HistoryPartitions.name_for(HistoryPartitions.id_time(item_id))
+        result = await operation(db[name])
+        if result is not None:
+            return name, result
+
+        candidates = []
+        pointer = await db.history_partition_index.find_one({'_id': item_id})
+        if pointer and pointer['partition'] != name:
+            candidates.append(pointer['partition'])
+        if HistoryPartitions._stale():
+            await HistoryPartitions.refresh_async(db)
+        if HistoryPartitions._known['legacy']:
+            candidates.append(LEGACY)
+        for candidate in candidates:
+            result = await operation(db[candidate])
+            if result is not None:
+                return candidate, result
+        return None, None
+
+    @staticmethod
+    async def delete_user(db: AsyncDatabase, user_id) -> int:
+        """Delete a user's history from every partition; returns how many went."""
+        # Not the cached list: a month restored moments ago must not survive.
+        await HistoryPartitions.refresh_async(db)
+        results = await asyncio.gather(*(
+            db[name].delete_many({'user_id': user_id}) for name in HistoryPartitions._select(None, None)
+        ))
+        await db.history_partition_index.delete_many({'user_id': user_id})
+        return sum(result.deleted_count for result in results)
+
+    @staticmethod
+    def forget(db: Database, name: str):
+        """Drop a partition from the cache and the id index (after archiving)."""
+        db.history_partition_index.delete_many({'partition': name})
+        with HistoryPartitions._lock:
+            HistoryPartitions._indexed.discard(name)
+        month = HistoryPartitions.month_of(name)
+        known = HistoryPartitions._known
+        HistoryPartitions._known = {**known, 'months': [m for m in known['months'] if m != month]}
+
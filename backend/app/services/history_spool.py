@@ -0,0 +1,196 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+import bson
+from app.config import HISTORY_SPOOL_PATH, HISTORY_SPOOL_MAX_ITEMS, HISTORY_SPOOL_OVERFLOW
+from app.services.text_blobs import TextBlobStore
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+
+
+class HistorySpool:
+    """Local append-only spool for history documents (SQLite).
+
+    While MongoDB is unreachable the history writer appends its batches here
+    instead of holding them in memory, so they survive restarts. Documents are
+    stored BSON-encoded under an increasing sequence number and replayed in
+    that order once the database is back (``peek`` then ``ack``).
+
+    NOTE:
+    - The spool is per instance (local disk); put HISTORY_SPOOL_PATH on a
+      persistent volume where the platform offers one.
+    - When ``max_items`` is reached the overflow policy drops either the
+      oldest spooled documents or the incoming ones; drops are counted.
+      Dropped documents may hold text_blobs references; those are kept in
+      memory (``take_dropped_refs``) until the writer can release them, and
+      left to the blob garbage collector if the process stops first.
+    """
+
+    def __init__(
+        self,
+        path: str = HISTORY_SPOOL_PATH,
+        max_items: int = HISTORY_SPOOL_MAX_ITEMS,
+        overflow: str = HISTORY_SPOOL_OVERFLOW,
+    ):
+        self.path = path
+        self.max_items = max(0, max_items)
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            logger.warning(f"Unknown HISTORY_SPOOL_OVERFLOW '{overflow}', using {OVERFLOW_DROP_OLDEST}")
+            overflow = OVERFLOW_DROP_OLDEST
+        self.overflow = overflow
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._depth = 0
+        self._dropped_refs = Counter()
+        self._stats = {
+            'spooled': 0,
+            'replayed': 0,
+            'dropped': 0,
+            'last_spooled_at': None,
+            'last_replayed_at': None,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, doc BLOB NOT NULL, spooled_at REAL NOT NULL)"
+            )
+            self._depth = conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+            self._conn = conn
+            if self._depth:
+                logger.info(f"History spool holds {self._depth} documents from an earlier outage")
+        return self._conn
+
+    # ---- producers ----
+
+    def append(self, documents: list) -> int:
+        """Spool documents; returns how many were kept (the rest overflowed)."""
+        if not documents:
+            return 0
+        if not self.enabled:
+            self._count_dropped(documents)
+            return 0
+
+        with self._lock:
+            conn = self._connect()
+            free = self.max_items - self._depth
+            dropped = []
+            if len(documents) > free:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    dropped = documents[max(0, free):]
+                    documents = documents[:max(0, free)]
+                else:
+                    # Keep the newest max_items overall.
+                    if len(documents) > self.max_items:
+                        dropped = documents[:-self.max_items]
+                        documents = documents[-self.max_items:]
+                    evict = len(documents) - free
+                    if evict > 0:
+                        rows = conn.execute("SELECT seq, doc FROM spool ORDER BY seq LIMIT ?", (evict,)).fetchall()
+                        if rows:
+                            conn.execute("DELETE FROM spool WHERE seq <= ?", (rows[-1][0],))
+                            self._depth -= len(rows)
+                            dropped += [bson.decode(row[1]) for row in rows]
+
+            now = time.time()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT INTO spool (doc, spooled_at) VALUES (?, ?)",
+                    [(bson.encode(document), now) for document in documents]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._depth += len(documents)
+            self._stats['spooled'] += len(documents)
+            self._stats['last_spooled_at'] = datetime.utcnow().isoformat()
+
+        if dropped:
+            self._count_dropped(dropped)
+        return len(documents)
+
+    def _count_dropped(self, documents: list):
+        with self._lock:
+            self._dropped_refs.update(TextBlobStore.references(documents))
+        self._stats['dropped'] += len(documents)
+        logger.error(f"History spool full ({self.overflow}): dropped {len(documents)} history documents")
+
+    def take_dropped_refs(self) -> Counter:
+        """Blob references of dropped documents not released yet (cleared)."""
+        with self._lock:
+            refs, self._dropped_refs = self._dropped_refs, Counter()
+        return refs
+
+    # ---- replay ----
+
+    def depth(self) -> int:
+        if self._conn is None and self.enabled and os.path.exists(self.path):
+            with self._lock:
+                self._connect()
+        return self._depth
+
+    def peek(self, limit: int) -> tuple:
+        """Oldest spooled documents: (last sequence number, documents)."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT seq, doc FROM spool ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+        if not rows:
+            return None, []
+        return rows[-1][0], [bson.decode(row[1]) for row in rows]
+
+    def ack(self, last_seq: int, count: int):
+        """Forget everything up to ``last_seq`` after it was written."""
+        with self._lock:
+            deleted = self._connect().execute("DELETE FROM spool WHERE seq <= ?", (last_seq,)).rowcount
+            self._depth = max(0, self._depth - deleted)
+            self._stats['replayed'] += count
+            self._stats['last_replayed_at'] = datetime.utcnow().isoformat()
+
+    # ---- metrics ----
+
+    def snapshot(self) -> dict:
+        depth = self.depth()
+        oldest = None
+        if depth and self._conn is not None:
+            with self._lock:
+                row = self._conn.execute("SELECT MIN(spooled_at) FROM spool").fetchone()
+            if row and row[0]:
+                oldest = round(time.time() - row[0], 1)
+        return {
+            'enabled': self.enabled,
+            'depth': depth,
+            'capacity': self.max_items,
+            'overflow': self.overflow,
+            'oldest_age_seconds': oldest,
+            **self._stats,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+history_spool = HistorySpool()
@@ -0,0 +1,211 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError
+from app.services.history_partitions import HistoryPartitions
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStatsService:
+    """Per-user history counters kept in the ``history_stats`` collection.
+
+    One document per user (``_id`` = user id) holds the total, exported and
+    per-type counts plus the processing-time sum, updated with ``$inc`` as
+    history items are inserted, deleted or exported, so reading the stats is a
+    single point read.
+
+    Items removed by the TTL monitor are never seen by the application. Each
+    stats document therefore remembers the earliest ``ocr_expires_at`` it
+    counted (``next_expiry``); once that moment has passed, the retention
+    sweeper recomputes the document (``reconcile_expired``) with one
+    ``$facet`` aggregation per history partition. Reads never wait for that:
+    until the sweeper's next run they may still count recently expired items.
+
+    Every counter update also bumps ``version``; a recomputed document is
+    only stored if the version it started from is still current, so an update
+    landing during the aggregation is not overwritten (the recount retries).
+    """
+
+    # Recounts in a row that may lose to concurrent updates before giving up.
+    RECONCILE_ATTEMPTS = 3
+
+    @staticmethod
+    def _delta(documents: list, sign: int) -> dict:
+        deltas = defaultdict(lambda: {'inc': defaultdict(int), 'next_expiry': None})
+        for document in documents:
+            delta = deltas[document['user_id']]
+            inc = delta['inc']
+            inc['total'] += sign
+            inc[f"by_type.{document.get('type', 'unknown')}"] += sign
+            if document.get('is_exported'):
+                inc['exported'] += sign
+            processing_time = document.get('processing_time_ms')
+            if isinstance(processing_time, (int, float)):
+                inc['time_sum_ms'] += sign * processing_time
+                inc['time_count'] += sign
+            expires_at = document.get('ocr_expires_at')
+            if sign > 0 and expires_at and (delta['next_expiry'] is None or expires_at < delta['next_expiry']):
+                delta['next_expiry'] = expires_at
+        return deltas
+
+    @staticmethod
+    def _apply(db: Database, deltas: dict):
+        if not deltas:
+            return
+        now = datetime.utcnow()
+        operations = []
+        for user_id, delta in deltas.items():
+            update = {
+                '$inc': {**delta['inc'], 'version': 1},
+                '$set': {'updated_at': now},
+            }
+            if delta['next_expiry'] is not None:
+                update['$min'] = {'next_expiry': delta['next_expiry']}
+            # No upsert: a missing document is rebuilt from scratch on the next read.
+            operations.append(UpdateOne({'_id': user_id}, update))
+        db.history_stats.bulk_write(operations, ordered=False)
+
+    @staticmethod
+    def record_inserted(db: Database, documents: list):
+        """Count newly inserted history documents (never raises)."""
+        try:
+            HistoryStatsService._apply(db, HistoryStatsService._delta(documents, 1))
+        except Exception as e:
+            logger.warning(f"History stats update failed, will reconcile on read: {e}")
+            HistoryStatsService.invalidate(db, {document['user_id'] for document in documents})
+
+    @staticmethod
+    def record_deleted(db: Database, documents: list):
+        """Uncount deleted history documents (never raises)."""
+        try:
+            HistoryStatsService._apply(db, HistoryStatsService._delta(documents, -1))
+        except Exception as e:
+            logger.warning(f"History stats update failed, will reconcile on read: {e}")
+            HistoryStatsService.invalidate(db, {document['user_id'] for document in documents})
+
+    @staticmethod
+    def record_exported(db: Database, user_id):
+        try:
+            db.history_stats.update_one(
+                {'_id': user_id},
+                {'$inc': {'exported': 1, 'version': 1}, '$set': {'updated_at': datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.warning(f"History stats update failed, will reconcile on read: {e}")
+            HistoryStatsService.invalidate(db, {user_id})
+
+    @staticmethod
+    def reset(db: Database, user_id):
+        """Forget a user's counters after their whole history was removed."""
+        db.history_stats.delete_one({'_id': user_id})
+
+    @staticmethod
+    def invalidate(db: Database, user_ids: set):
+        """Drop counters so the next read rebuilds them (never raises)."""
+        try:
+            db.history_stats.delete_many({'_id': {'$in': list(user_ids)}})
+        except Exception as e:
+            logger.error(f"Could not invalidate history stats: {e}")
+
+    @staticmethod
+    def get(db: Database, user_id, read_db: Database | None = None) -> dict:
+        """Current counters for a user; rebuilt only when there are none yet.
+
+        ``read_db`` (e.g. a secondary-preferred handle) serves the counters
+        read; reconciling always reads and writes through ``db``.
+        """
+        stats = (read_db if read_db is not None else db).history_stats.find_one({'_id': user_id})
+        if stats is None:
+            stats = HistoryStatsService.reconcile(db, user_id)
+        return stats
+
+    @staticmethod
+    def reconcile_expired(db: Database, limit: int) -> int:
+        """Recount up to ``limit`` users whose counters include expired OCR items."""
+        due = db.history_stats.find(
+            {'next_expiry': {'$lte': datetime.utcnow()}}, {'_id': 1}
+        ).sort('next_expiry', 1).limit(limit)
+        count = 0
+        for stats in list(due):
+            HistoryStatsService.reconcile(db, stats['_id'])
+            count += 1
+        return count
+
+    @staticmethod
+    def reconcile(db: Database, user_id) -> dict:
+        """Recompute and store a user's counters, retrying if they change meanwhile."""
+        for _ in range(HistoryStatsService.RECONCILE_ATTEMPTS):
+            current = db.history_stats.find_one({'_id': user_id}, {'version': 1})
+            stats = HistoryStatsService._count(db, user_id)
+            if current is None:
+                try:
+                    db.history_stats.insert_one({**stats, 'version': 0})
+                    return stats
+                except DuplicateKeyError:
+                    continue
+            # Documents from before versioning have no version field (matched by None).
+            version = current.get('version')
+            stats['version'] = (version or 0) + 1
+            if db.history_stats.replace_one({'_id': user_id, 'version': version}, stats).matched_count:
+                return stats
+
+        # Still counting as it is being written to; the stored counters stay
+        # as they are and the next recount tries again.
+        logger.warning(f"History stats of {user_id} changed during every recount, not stored")
+        return stats
+
+    @staticmethod
+    def _count(db: Database, user_id) -> dict:
+        """A user's counters from every history partition (one aggregation each)."""
+        now = datetime.utcnow()
+        by_type = defaultdict(int)
+        totals = defaultdict(int)
+        next_expiry = None
+        for name in HistoryPartitions.sources(db):
+            result = list(db[name].aggregate([
+                # Expired OCR items count as gone even before the TTL monitor runs.
+                {'$match': {
+                    'user_id': user_id,
+                    '$or': [{'ocr_expires_at': {'$exists': False}}, {'ocr_expires_at': {'$gt': now}}],
+                }},
+                {'$facet': {
+                    'by_type': [{'$group': {'_id': '$type', 'count': {'$sum': 1}}}],
+                    'totals': [{'$group': {
+                        '_id': None,
+                        'total': {'$sum': 1},
+                        'exported': {'$sum': {'$cond': [{'$eq': ['$is_exported', True]}, 1, 0]}},
+                        'time_sum_ms': {'$sum': '$processing_time_ms'},
+                        'time_count': {'$sum': {'$cond': [{'$isNumber': '$processing_time_ms'}, 1, 0]}},
+                        'next_expiry': {'$min': '$ocr_expires_at'},
+                    }}],
+                }},
+            ]))
+            facets = result[0] if result else {'by_type': [], 'totals': []}
+            for group in facets['by_type']:
+                if group['_id']:
+                    by_type[group['_id']] += group['count']
+            if facets['totals']:
+                partition_totals = facets['totals'][0]
+                for key in ('total', 'exported', 'time_sum_ms', 'time_count'):
+                    totals[key] += partition_totals.get(key, 0)
+                expiry = partition_totals.get('next_expiry')
+                if expiry and (next_expiry is None or expiry < next_expiry):
+                    next_expiry = expiry
+
+        stats = {
+            '_id': user_id,
+            'total': totals.get('total', 0),
+            'exported': totals.get('exported', 0),
+            'by_type': dict(by_type),
+            'time_sum_ms': totals.get('time_sum_ms', 0),
+            'time_count': totals.get('time_count', 0),
+            'updated_at': now,
+            'reconciled_at': now,
+        }
+        # Left out rather than null: $min treats null as smaller than any date.
+        if next_expiry:
+            stats['next_expiry'] = next_expiry
+        return stats
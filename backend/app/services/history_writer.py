@@ -0,0 +1,423 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from bson.objectid import ObjectId
+from fastapi.concurrency import run_in_threadpool
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.config import (
+    HISTORY_WRITE_QUEUE_SIZE, HISTORY_WRITE_BATCH_SIZE, HISTORY_WRITE_FLUSH_MS, HISTORY_PREVIEW_CHARS,
+)
+from app.database import MongoDB, PROFILE_FAST_WRITE
+from app.services.history_codec import HistoryCodec
+from app.services.history_partitions import HistoryPartitions
+from app.services.history_spool import HistorySpool, history_spool
+from app.services.history_stats import HistoryStatsService
+from app.services.text_blobs import TextBlobStore
+
+logger = logging.getLogger(__name__)
+
+_DUPLICATE_KEY = 11000
+
+
+def add_previews(document: dict) -> dict:
+    """Store short previews and lengths so listings never read the full texts."""
+    for field in ('input', 'output'):
+        text = document.get(f'{field}_text') or ''
+        document.setdefault(f'{field}_preview', text[:HISTORY_PREVIEW_CHARS])
+        document.setdefault(f'{field}_length', len(text))
+    # Large texts are compressed or externalized later; keep them searchable.
+    return HistoryCodec.add_search_text(document)
+
+
+def prepare_document(db, document: dict) -> dict:
+    """Previews, blob references and storage encoding, for direct inserts."""
+    add_previews(document)
+    TextBlobStore.externalize(db, [document])
+    return HistoryCodec.encode(document)
+
+
+def insert_once(document: dict) -> bool:
+    """Insert a history document with a reserved ``_id``, bypassing the buffer.
+
+    For job workers that retry after a lost lease: if an earlier attempt
+    already wrote the document, this copy's blob references are released and
+    False is returned.
+    """
+    db = MongoDB.get_db()
+    prepare_document(db, document)
+    try:
+        with MongoDB.consistency(db, PROFILE_FAST_WRITE) as fast_db:
+            HistoryPartitions.insert_one(fast_db, document)
+    except DuplicateKeyError:
+        # The earlier attempt holds its own blob references.
+        TextBlobStore.release(db, TextBlobStore.references([document]))
+        return False
+    HistoryStatsService.record_inserted(db, [document])
+    return True
+
+
+class HistoryWriter:
+    """Write-behind buffer for history inserts (into the monthly partitions).
+
+    ``enqueue`` assigns the document ``_id`` client-side and returns at once, so
+    routes can hand out ``history_id`` without waiting for the database. A
+    background thread flushes the queue with unordered ``insert_many`` whenever
+    ``batch_size`` documents are waiting or ``flush_interval`` has passed.
+
+    NOTE:
+    - A freshly written item shows up in history listings after the next flush
+      (at most ``flush_interval`` later under normal load).
+    - When the queue is full, or the writer is not running, the document is
+      inserted synchronously by the caller instead of being dropped.
+    - Batches that cannot be written because the database is unreachable go
+      to the local ``spool``; it is replayed (oldest first, before anything
+      newer) once the database is available again.
+    - Readers that must see their own writes (the history listing) merge in
+      ``buffered(user_id)``, the user's documents not written yet, instead of
+      waiting for a flush. Spooled documents show up once replayed.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = HISTORY_WRITE_QUEUE_SIZE,
+        batch_size: int = HISTORY_WRITE_BATCH_SIZE,
+        flush_interval: float = HISTORY_WRITE_FLUSH_MS / 1000,
+        spool: HistorySpool = history_spool,
+    ):
+        self.spool = spool
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.01, flush_interval)
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._pending = []
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        # Queued documents not written (or given up on) yet, by user id.
+        self._buffered = {}
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'sync_writes': 0,
+            'spooled': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'total_flush_ms': 0.0,
+            'last_flush_ms': None,
+            'max_flush_ms': 0.0,
+            'last_flush_at': None,
+            'last_error': None,
+        }
+
+    # ---- lifecycle ----
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        logger.info("History writer started")
+
+    def stop(self, timeout: float = 10.0):
+        """Flush everything still buffered and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+        # Anything left (e.g. the thread was stuck on a dead connection).
+        self._drain()
+        if self._pending and not (self._replay_spool() and self._flush(self._pending)):
+            # Replayed on the next start.
+            self._spool_pending()
+        if self._pending:
+            with self._stats_lock:
+                self._stats['dropped'] += len(self._pending)
+            logger.error(f"History writer dropped {len(self._pending)} items at shutdown")
+            self._settle(self._pending)
+            self._pending = []
+        self.spool.close()
+
+    # ---- producers ----
+
+    def enqueue(self, document: dict) -> ObjectId:
+        """Queue a history document and return its (pre-assigned) id (may block)."""
+        if self._try_queue(document):
+            return document['_id']
+        return self._write_direct(document)
+
+    async def enqueue_async(self, document: dict) -> ObjectId:
+        """``enqueue`` for request handlers: a synchronous fallback write runs in the thread pool."""
+        if self._try_queue(document):
+            return document['_id']
+        return await run_in_threadpool(self._write_direct, document)
+
+    def enqueue_many(self, documents: list) -> list:
+        return [self.enqueue(document) for document in documents]
+
+    async def enqueue_many_async(self, documents: list) -> list:
+        return [await self.enqueue_async(document) for document in documents]
+
+    def _try_queue(self, document: dict) -> bool:
+        """Hand a document to the writer thread; False if it must be written directly."""
+        document.setdefault('_id', ObjectId())
+        add_previews(document)
+
+        if self._thread is not None and not self._stopping.is_set():
+            try:
+                # Listed before the writer thread can settle it.
+                with self._stats_lock:
+                    self._buffered.setdefault(document.get('user_id'), {})[document['_id']] = document
+                self._queue.put_nowait(document)
+                with self._stats_lock:
+                    self._stats['enqueued'] += 1
+                return True
+            except queue.Full:
+                self._settle([document])
+                logger.warning("History write queue is full, writing synchronously")
+        return False
+
+    def _write_direct(self, document: dict) -> ObjectId:
+        # Back-pressure: the caller pays for the round trip instead of losing data.
+        try:
+            db = MongoDB.get_db()
+            prepare_document(db, document)
+            with MongoDB.consistency(db, PROFILE_FAST_WRITE) as fast_db:
+                HistoryPartitions.insert_one(fast_db, document)
+        except Exception as e:
+            if not self.spool.enabled:
+                raise
+            logger.warning(f"History write failed, spooling locally: {e}")
+            self.spool.append([document])
+            with self._stats_lock:
+                self._stats['spooled'] += 1
+            return document['_id']
+        HistoryStatsService.record_inserted(db, [document])
+        with self._stats_lock:
+            self._stats['sync_writes'] += 1
+            self._stats['written'] += 1
+        return document['_id']
+
+    def buffered(self, user_id) -> list:
+        """Shallow copies of a user's queued documents not written yet (never blocks on I/O)."""
+        with self._stats_lock:
+            return [dict(document) for document in self._buffered.get(user_id, {}).values()]
+
+    def held_references(self) -> Counter:
+        """Blob references of queued documents not written yet (externalized by a failed flush)."""
+        with self._stats_lock:
+            documents = [document for user_buffer in self._buffered.values() for document in user_buffer.values()]
+        return TextBlobStore.references(documents)
+
+    # ---- metrics ----
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        flushes = stats.pop('flushes')
+        total_flush_ms = stats.pop('total_flush_ms')
+        return {
+            'running': self._thread is not None,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'buffered': len(self._pending),
+            'flushes': flushes,
+            'avg_flush_ms': round(total_flush_ms / flushes, 2) if flushes else None,
+            **stats,
+        }
+
+    # ---- writer thread ----
+
+    def _settle(self, documents: list):
+        """Queued documents were written, spooled or dropped: no longer buffered."""
+        with self._stats_lock:
+            for document in documents:
+                user_buffer = self._buffered.get(document.get('user_id'))
+                if user_buffer is not None:
+                    user_buffer.pop(document['_id'], None)
+                    if not user_buffer:
+                        del self._buffered[document.get('user_id')]
+
+    def _drain(self):
+        while len(self._pending) < self.batch_size:
+            try:
+                self._pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _run(self):
+        retry_delay = self.flush_interval
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self._pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._drain()
+
+            if self._pending:
+                # Spooled documents go first; while the database is still
+                # unreachable new items queue up behind them in the spool.
+                if self._replay_spool() and self._flush(self._pending):
+                    retry_delay = self.flush_interval
+                elif self._spool_pending():
+                    retry_delay = self.flush_interval
+                else:
+                    # Keep the batch and back off; new items wait in the bounded queue.
+                    self._stopping.wait(retry_delay)
+                    retry_delay = min(retry_delay * 2, 30)
+                    if self._stopping.is_set():
+                        return
+                    continue
+
+            elif self.spool.depth():
+                self._replay_spool()
+
+            if self._stopping.is_set() and self._queue.empty():
+                return
+
+    def _spool_pending(self) -> bool:
+        """Move the pending batch to the local spool (it counts as settled)."""
+        if not self.spool.enabled:
+            return False
+        try:
+            kept = self.spool.append(self._pending)
+        except Exception as e:
+            # Keep the batch in memory and retry with backoff as before.
+            logger.error(f"History spool write failed: {e}")
+            return False
+        with self._stats_lock:
+            self._stats['spooled'] += kept
+        self._settle(self._pending)
+        self._pending = []
+        return True
+
+    def _replay_spool(self) -> bool:
+        """Write spooled documents back, oldest first; True once the spool is empty."""
+        if MongoDB.available():
+            # References held by documents the spool had to drop.
+            TextBlobStore.release(MongoDB.get_db(), self.spool.take_dropped_refs())
+        if not self.spool.depth():
+            return True
+        if not MongoDB.available():
+            return False
+        while not self._stopping.is_set():
+            last_seq, documents = self.spool.peek(self.batch_size)
+            if not documents:
+                logger.info("History spool replayed")
+                return True
+            if not self._write(documents):
+                return False
+            self.spool.ack(last_seq, len(documents))
+        return False
+
+    def _flush(self, batch: list) -> bool:
+        """Insert one queued batch; returns False when it should be retried."""
+        if not self._write(batch):
+            return False
+        self._settle(batch)
+        del batch[:]
+        return True
+
+    def _write(self, batch: list) -> bool:
+        """Insert documents (blob refs, encoding, stats); False on failure."""
+        started = time.perf_counter()
+        try:
+            db = MongoDB.get_db()
+            # Blob references and compression happen here, off the request
+            # path; both skip fields a failed earlier attempt already handled.
+            TextBlobStore.externalize(db, batch)
+            for document in batch:
+                HistoryCodec.encode(document)
+            with MongoDB.consistency(db, PROFILE_FAST_WRITE) as fast_db:
+                HistoryPartitions.insert_many(fast_db, batch)
+            inserted = batch
+            written = len(batch)
+            error = None
+        except BulkWriteError as e:
+            # Unordered: everything but the failed documents was written.
+            write_errors = e.details.get('writeErrors', [])
+            failed_indexes = {err.get('index') for err in write_errors}
+            inserted = [document for index, document in enumerate(batch) if index not in failed_indexes]
+            failed = [err for err in write_errors if err.get('code') != _DUPLICATE_KEY]
+            # Duplicates were stored by an earlier attempt and own their blob
+            # references (taken once, externalize is idempotent); rejected ones do not.
+            TextBlobStore.release(db, TextBlobStore.references([batch[err.get('index')] for err in failed]))
+            written = e.details.get('nInserted', len(batch) - len(write_errors))
+            error = f"{len(failed)} history documents rejected" if failed else None
+            if failed:
+                logger.error(f"History writer: {error}: {failed[0].get('errmsg')}")
+                with self._stats_lock:
+                    self._stats['dropped'] += len(failed)
+        except InvalidDocument as e:
+            # A document the server can never take (e.g. over 16 MB) fails the
+            # whole batch: write one by one and drop only the bad ones, so a
+            # spooled batch holding one cannot block replay forever.
+            logger.warning(f"History writer batch holds an invalid document ({e}), writing one by one")
+            try:
+                inserted, rejected = self._write_each(db, batch)
+            except Exception as each_err:
+                logger.warning(f"History writer flush of {len(batch)} items failed: {each_err}")
+                with self._stats_lock:
+                    self._stats['failed_flushes'] += 1
+                    self._stats['last_error'] = str(each_err)
+                return False
+            TextBlobStore.release(db, TextBlobStore.references(rejected))
+            written = len(inserted)
+            error = f"{len(rejected)} history documents rejected" if rejected else None
+            if rejected:
+                with self._stats_lock:
+                    self._stats['dropped'] += len(rejected)
+        except Exception as e:
+            logger.warning(f"History writer flush of {len(batch)} items failed: {e}")
+            with self._stats_lock:
+                self._stats['failed_flushes'] += 1
+                self._stats['last_error'] = str(e)
+            return False
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        HistoryStatsService.record_inserted(db, inserted)
+        with self._stats_lock:
+            self._stats['written'] += written
+            self._stats['flushes'] += 1
+            self._stats['total_flush_ms'] += elapsed_ms
+            self._stats['last_flush_ms'] = round(elapsed_ms, 2)
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], round(elapsed_ms, 2))
+            self._stats['last_flush_at'] = datetime.utcnow().isoformat()
+            if error:
+                self._stats['last_error'] = error
+        return True
+
+    def _write_each(self, db, batch: list) -> tuple:
+        """Insert documents one at a time: (inserted, rejected as invalid).
+
+        Connection errors propagate, so the caller retries the whole batch
+        (documents already written then come back as duplicates).
+        """
+        inserted = []
+        rejected = []
+        with MongoDB.consistency(db, PROFILE_FAST_WRITE) as fast_db:
+            for document in batch:
+                try:
+                    HistoryPartitions.insert_one(fast_db, document)
+                    inserted.append(document)
+                except DuplicateKeyError:
+                    # Stored by an earlier attempt, which owns its blob references.
+                    pass
+                except InvalidDocument as e:
+                    logger.error(f"History writer: dropping invalid history document {document.get('_id')}: {e}")
+                    rejected.append(document)
+        return inserted, rejected
+
+
+history_writer = HistoryWriter()
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
+from pymongo.database import Database
+from app.database import MongoDB
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_PROCESSING = "processing"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+FINAL_STATES = (JOB_COMPLETED, JOB_FAILED)
+
+
+class LeasedJobWorker:
+    """Background worker that leases job documents from a Mongo collection.
+
+    Jobs are claimed with an atomic ``find_one_and_update`` that stamps a lease
+    owner and expiry, so several API instances can share one collection: a job
+    whose worker died is picked up again once its lease runs out.
+
+    Job documents need ``status``, ``available_at``, ``attempts`` and
+    ``created_at``; the handler returns the fields to ``$set`` on completion
+    and raises to request a retry. Exceptions in ``permanent_errors`` (bad
+    input by default: undecodable or oversized images, unsupported options)
+    fail the job right away, since another attempt cannot succeed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        collection_name: str,
+        handler,
+        concurrency: int = 1,
+        lease_seconds: int = 120,
+        poll_seconds: float = 2.0,
+        max_attempts: int = 3,
+        permanent_errors: tuple = (ValueError,),
+    ):
+        self.name = name
+        self.collection_name = collection_name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.lease_seconds = max(5, lease_seconds)
+        self.poll_seconds = max(0.1, poll_seconds)
+        self.max_attempts = max(1, max_attempts)
+        self.permanent_errors = permanent_errors
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{name}"
+        self._tasks = []
+        self._wake: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopping: asyncio.Event | None = None
+        self._listeners = {}
+
+    # ---- lifecycle ----
+
+    def start(self):
+        """Start the worker slots on the running event loop."""
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._tasks = [
+            asyncio.create_task(self._run_slot(slot), name=f"{self.name}-{slot}")
+            for slot in range(self.concurrency)
+        ]
+        logger.info(f"{self.name} worker started with {self.concurrency} slots")
+
+    async def stop(self):
+        """Stop claiming new jobs; leased jobs are recovered after lease expiry."""
+        if not self._tasks:
+            return
+        self._stopping.set()
+        self._wake.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle slots after a job was enqueued on this instance.
+
+        Safe to call from the thread pool (submits run there).
+        """
+        if self._wake is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # ---- state change notifications (same-instance push) ----
+
+    def subscribe(self, job_id: str) -> asyncio.Event:
+        event = asyncio.Event()
+        self._listeners.setdefault(job_id, set()).add(event)
+        return event
+
+    def unsubscribe(self, job_id: str, event: asyncio.Event):
+        listeners = self._listeners.get(job_id)
+        if listeners is not None:
+            listeners.discard(event)
+            if not listeners:
+                self._listeners.pop(job_id, None)
+
+    def _publish(self, job_id):
+        for event in self._listeners.get(str(job_id), ()):
+            event.set()
+
+    # ---- leasing ----
+
+    def _collection(self, db: Database):
+        return db[self.collection_name]
+
+    def _claim(self):
+        db = MongoDB.get_db()
+        now = datetime.utcnow()
+        return self._collection(db).find_one_and_update(
+            {'$or': [
+                {'status': JOB_QUEUED, 'available_at': {'$lte': now}},
+                {'status': JOB_PROCESSING, 'lease_expires_at': {'$lt': now}},
+            ]},
+            {
+                '$set': {
+                    'status': JOB_PROCESSING,
+                    'lease_owner': self.worker_id,
+                    'lease_expires_at': now + timedelta(seconds=self.lease_seconds),
+                    'started_at': now,
+                    'updated_at': now,
+                },
+                '$inc': {'attempts': 1},
+            },
+            sort=[('available_at', 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _renew(self, job_id):
+        db = MongoDB.get_db()
+        now = datetime.utcnow()
+        self._collection(db).update_one(
+            {'_id': job_id, 'lease_owner': self.worker_id, 'status': JOB_PROCESSING},
+            {'$set': {'lease_expires_at': now + timedelta(seconds=self.lease_seconds)}},
+        )
+
+    def _finish(self, job_id, fields: dict):
+        db = MongoDB.get_db()
+        now = datetime.utcnow()
+        self._collection(db).update_one(
+            {'_id': job_id, 'lease_owner': self.worker_id},
+            {
+                '$set': {**fields, 'status': JOB_COMPLETED, 'finished_at': now, 'updated_at': now},
+                '$unset': {'lease_expires_at': ''},
+            },
+        )
+
+    def _fail(self, job, error: str, retry: bool = True):
+        db = MongoDB.get_db()
+        now = datetime.utcnow()
+        attempts = job.get('attempts', 1)
+        if retry and attempts < self.max_attempts:
+            # Exponential backoff before the job becomes claimable again.
+            update = {
+                'status': JOB_QUEUED,
+                'available_at': now + timedelta(seconds=min(300, 2 ** attempts)),
+                'last_error': error,
+                'updated_at': now,
+            }
+        else:
+            update = {
+                'status': JOB_FAILED,
+                'last_error': error,
+                'finished_at': now,
+                'updated_at': now,
+            }
+        self._collection(db).update_one(
+            {'_id': job['_id'], 'lease_owner': self.worker_id},
+            {'$set': update, '$unset': {'lease_expires_at': ''}},
+        )
+
+    # ---- processing loop ----
+
+    async def _run_slot(self, slot: int):
+        while not self._stopping.is_set():
+            try:
+                job = await run_in_threadpool(self._claim)
+            except Exception as e:
+                logger.warning(f"{self.name} worker could not claim a job: {e}")
+                job = None
+
+            if job is None:
+                await self._idle()
+                continue
+
+            await self._process(job)
+
+    async def _idle(self):
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _keep_leased(self, job_id):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await run_in_threadpool(self._renew, job_id)
+            except Exception as e:
+                logger.warning(f"{self.name} lease renewal failed for {job_id}: {e}")
+
+    async def _process(self, job: dict):
+        job_id = job['_id']
+        self._publish(job_id)
+
+        if job.get('attempts', 1) > self.max_attempts:
+            await run_in_threadpool(self._fail, job, "Exceeded retry attempts")
+            self._publish(job_id)
+            return
+
+        heartbeat = asyncio.create_task(self._keep_leased(job_id))
+        try:
+            fields = await self.handler(job)
+            await run_in_threadpool(self._finish, job_id, fields or {})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retry = not isinstance(e, self.permanent_errors)
+            logger.error(
+                f"{self.name} job {job_id} failed (attempt {job.get('attempts', 1)}"
+                f"{'' if retry else ', not retryable'}): {e}"
+            )
+            try:
+                await run_in_threadpool(self._fail, job, str(e), retry)
+            except Exception as fail_err:
+                logger.error(f"{self.name} could not record failure for {job_id}: {fail_err}")
+        finally:
+            heartbeat.cancel()
+            self._publish(job_id)
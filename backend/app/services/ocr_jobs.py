@@ -0,0 +1,111 @@
+import logging
+from datetime import datetime, timedelta
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from fastapi.concurrency import run_in_threadpool
+from pymongo.database import Database
+from app.config import (
+    OCR_JOB_WORKERS, OCR_JOB_LEASE_SECONDS, OCR_JOB_MAX_ATTEMPTS,
+    OCR_JOB_POLL_SECONDS, OCR_JOB_RETENTION_HOURS,
+)
+from app.services.history_writer import insert_once
+from app.services.job_queue import LeasedJobWorker, JOB_QUEUED, JOB_COMPLETED
+from app.services.ocr_service import OCRService
+
+logger = logging.getLogger(__name__)
+
+
+class OCRJobService:
+    """Asynchronous OCR jobs persisted in the ``ocr_jobs`` collection.
+
+    Uploaded bytes are stored on the job document until it completes, so a job
+    submitted before a restart is still processed afterwards. The history item
+    id is reserved at submit time, which keeps retries from writing the same
+    result twice.
+    """
+
+    @staticmethod
+    def submit(db: Database, current_user, processing_type: str, image_url: str | None,
+               image_bytes=None, header: dict | None = None) -> dict:
+        now = datetime.utcnow()
+        save_history = current_user.get('settings', {}).get('save_history', True)
+        job = {
+            'user_id': current_user['_id'],
+            'status': JOB_QUEUED,
+            'processing_type': processing_type,
+            'image_url': image_url,
+            'image_data': Binary(bytes(image_bytes)) if image_bytes is not None else None,
+            'image_header': header,
+            'history_id': ObjectId() if save_history else None,
+            'attempts': 0,
+            'created_at': now,
+            'updated_at': now,
+            'available_at': now,
+            'expires_at': now + timedelta(hours=OCR_JOB_RETENTION_HOURS),
+        }
+        result = db.ocr_jobs.insert_one(job)
+        job['_id'] = result.inserted_id
+        ocr_job_worker.notify()
+        return job
+
+    @staticmethod
+    def public_view(job: dict) -> dict:
+        """JSON-safe job state for polling and SSE clients."""
+        view = {
+            'job_id': str(job['_id']),
+            'status': job['status'],
+            'processing_type': job.get('processing_type'),
+            'attempts': job.get('attempts', 0),
+            'created_at': job['created_at'].isoformat(),
+            'updated_at': job['updated_at'].isoformat(),
+        }
+        if job.get('finished_at'):
+            view['finished_at'] = job['finished_at'].isoformat()
+        if job['status'] == JOB_COMPLETED:
+            view['result'] = {
+                **job.get('result', {}),
+                'processing_type': job.get('processing_type'),
+                'history_id': str(job['history_id']) if job.get('history_id') else None,
+            }
+        elif job.get('last_error'):
+            view['error'] = job['last_error']
+        return view
+
+    @staticmethod
+    async def process(job: dict) -> dict:
+        """Worker handler: run OCR, record history, return completion fields."""
+        if job.get('image_data') is not None:
+            image_bytes = memoryview(job['image_data'])
+            result = await run_in_threadpool(
+                OCRService.process_image_file, image_bytes, header=job.get('image_header')
+            )
+        else:
+            result = await run_in_threadpool(OCRService.process_image_url, job['image_url'])
+
+        if job.get('history_id'):
+            history_item = OCRService.build_history_item(job['user_id'], result, job.get('image_url'))
+            history_item['_id'] = job['history_id']
+            await run_in_threadpool(insert_once, history_item)
+
+        return {
+            'result': {
+                'extracted_text': result['extracted_text'],
+                'confidence_score': result['confidence_score'],
+                'processing_time_ms': result['processing_time_ms'],
+                'image_dimensions': result['image_dimensions'],
+            },
+            # Drop the upload once it is no longer needed and let TTL clean up.
+            'image_data': None,
+            'expires_at': datetime.utcnow() + timedelta(hours=OCR_JOB_RETENTION_HOURS),
+        }
+
+
+ocr_job_worker = LeasedJobWorker(
+    name="ocr-jobs",
+    collection_name="ocr_jobs",
+    handler=OCRJobService.process,
+    concurrency=OCR_JOB_WORKERS,
+    lease_seconds=OCR_JOB_LEASE_SECONDS,
+    poll_seconds=OCR_JOB_POLL_SECONDS,
+    max_attempts=OCR_JOB_MAX_ATTEMPTS,
+)
@@ -1,36 +1,116 @@
 import base64
 import io
 import logging
+import struct
+import threading
 import time
 import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from PIL import Image
-from datetime import datetime
+from datetime import datetime, timedelta
 from app.models import OCRResponse
-from app.config import OCR_PROVIDER, OCR_SPACE_API_KEY, OCR_SPACE_LANGUAGE, TESSERACT_LANG
-
-try:
-    import pytesseract
-except Exception:  # pragma: no cover - optional dependency in some deployments
-    pytesseract = None
+from app.config import (
+    OCR_PROVIDER, OCR_SPACE_API_KEY, OCR_SPACE_LANGUAGE,
+    OCR_AUTO_MIN_CONFIDENCE, OCR_AUTO_MIN_TEXT_CHARS, OCR_PROVIDER_THREADS, OCR_SPACE_TIMEOUT_SECONDS,
+    MAX_FILE_SIZE, MAX_IMAGE_PIXELS, ALLOWED_IMAGE_TYPES, OCR_URL_CACHE_SIZE,
+    OCR_URL_FETCH_TIMEOUT_SECONDS, OCR_HISTORY_RETENTION_DAYS,
+)
+from app.services.tesseract_pool import TesseractWorkerPool
 
 logger = logging.getLogger(__name__)
 
+# Runs the competing providers of an auto-mode race. Tesseract itself fans out
+# onto TesseractWorkerPool; these threads mostly wait on I/O or on that pool.
+_provider_executor = ThreadPoolExecutor(max_workers=OCR_PROVIDER_THREADS, thread_name_prefix="ocr-provider")
+# Held by every OCR.Space call on the executor, including abandoned ones still
+# waiting for their timeout, so they can never take all of its threads.
+_ocr_space_slots = threading.BoundedSemaphore(max(1, OCR_PROVIDER_THREADS // 2))
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+_FILE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'PDF': 'pdf'}
+
+
+class PayloadTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size cap."""
+
+
+class _TruncatedHeaderError(ValueError):
+    """Raised by the sniffers when more leading bytes are needed."""
+
+
+def _sniff_png(view: memoryview):
+    if len(view) < 24:
+        raise _TruncatedHeaderError("Truncated PNG header")
+    if bytes(view[12:16]) != b'IHDR':
+        raise ValueError("Corrupt PNG header")
+    width, height = struct.unpack('>II', view[16:24])
+    return width, height
+
+
+def _sniff_jpeg(view: memoryview):
+    # Walk marker segments until a start-of-frame marker carries the size.
+    pos = 2
+    while pos + 4 <= len(view):
+        if view[pos] != 0xFF:
+            raise ValueError("Corrupt JPEG header")
+        marker = view[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        (length,) = struct.unpack('>H', view[pos + 2:pos + 4])
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if pos + 9 > len(view):
+                break
+            height, width = struct.unpack('>HH', view[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    raise _TruncatedHeaderError("Truncated JPEG header")
+
+
+def _sniff_webp(view: memoryview):
+    if len(view) < 30:
+        raise _TruncatedHeaderError("Truncated WEBP header")
+    chunk = bytes(view[12:16])
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', view[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        (bits,) = struct.unpack('<I', view[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        width = int.from_bytes(view[24:27], 'little') + 1
+        height = int.from_bytes(view[27:30], 'little') + 1
+        return width, height
+    raise ValueError("Unsupported WEBP encoding")
+
+
 class OCRService:
     """Service for handling OCR operations.
 
     NOTE:
     - Primary OCR path is backend-only (no popup login dependency).
     - Providers: OCR.Space API and/or local Tesseract, with safe fallback.
+    - URL results are cached per URL with their ETag/Last-Modified validators,
+      so repeat requests cost one conditional GET.
     """
 
+    _url_cache: OrderedDict = OrderedDict()
+    _url_cache_lock = threading.Lock()
+
     @staticmethod
-    def process_image_file(file_bytes, file_type='image/jpeg'):
+    def process_image_file(file_bytes, file_type='image/jpeg', header=None):
         """
         Process image bytes and extract text using configured backend OCR provider.
 
         Args:
-            file_bytes: Image file in bytes
+            file_bytes: Image file as bytes or memoryview (not copied)
             file_type: MIME type of the image
+            header: Result of ``validate_image`` if the caller already ran it
 
         Returns:
             Dict with extracted text and metadata
@@ -38,14 +118,10 @@ class OCRService:
         try:
             start_time = time.time()
 
-            # Validate image
-            image = Image.open(io.BytesIO(file_bytes))
-            width, height = image.size
-
-            if width * height > 10000000:  # 10MP limit
-                raise ValueError("Image too large, max 10MP")
+            if header is None:
+                header = OCRService.validate_image(file_bytes)
 
-            extracted_text, confidence = OCRService._extract_text(file_bytes, image)
+            extracted_text, confidence = OCRService._extract_text(file_bytes, header)
 
             processing_time = time.time() - start_time
 
@@ -53,7 +129,7 @@ class OCRService:
                 'extracted_text': extracted_text,
                 'confidence_score': confidence,
                 'processing_time_ms': processing_time * 1000,
-                'image_dimensions': {'width': width, 'height': height}
+                'image_dimensions': {'width': header['width'], 'height': header['height']}
             }
 
         except Exception as e:
@@ -65,6 +141,11 @@ class OCRService:
         """
         Process image from URL using configured backend OCR provider.
 
+        The download is streamed: it is aborted on a non-image content type,
+        once the body passes MAX_FILE_SIZE, as soon as the image header
+        reports dimensions over the pixel limit, or when it runs past
+        OCR_URL_FETCH_TIMEOUT_SECONDS in total.
+
         Args:
             image_url: URL of the image
 
@@ -74,32 +155,148 @@ class OCRService:
         try:
             start_time = time.time()
 
-            # Download image
-            response = requests.get(image_url, timeout=10)
-            response.raise_for_status()
-
-            # Validate image
-            image = Image.open(io.BytesIO(response.content))
-            width, height = image.size
-
-            if width * height > 10000000:
-                raise ValueError("Image too large, max 10MP")
+            cached = OCRService._get_cached_url_result(image_url)
+            request_headers = {}
+            if cached:
+                if cached.get('etag'):
+                    request_headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    request_headers['If-Modified-Since'] = cached['last_modified']
 
-            extracted_text, confidence = OCRService._extract_text(response.content, image)
+            # Download image
+            deadline = time.monotonic() + OCR_URL_FETCH_TIMEOUT_SECONDS
+            read_timeout = min(10, OCR_URL_FETCH_TIMEOUT_SECONDS)
+            with requests.get(image_url, headers=request_headers, stream=True, timeout=read_timeout) as response:
+                if response.status_code == 304 and cached:
+                    return {
+                        **cached['result'],
+                        'processing_time_ms': (time.time() - start_time) * 1000,
+                    }
+                response.raise_for_status()
+
+                image_bytes, header = OCRService._read_image_response(response, deadline=deadline)
+                validators = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }
+
+            extracted_text, confidence = OCRService._extract_text(image_bytes, header)
 
             processing_time = time.time() - start_time
 
-            return {
+            result = {
                 'extracted_text': extracted_text,
                 'confidence_score': confidence,
                 'processing_time_ms': processing_time * 1000,
-                'image_dimensions': {'width': width, 'height': height}
+                'image_dimensions': {'width': header['width'], 'height': header['height']}
             }
 
+            if extracted_text and (validators['etag'] or validators['last_modified']):
+                OCRService._store_url_result(image_url, validators, result)
+
+            return result
+
         except Exception as e:
             logger.error(f"OCR URL processing error: {e}")
             raise
 
+    @staticmethod
+    def _read_image_response(response, max_size=MAX_FILE_SIZE, deadline=None):
+        """Stream an image download into one buffer, validating as bytes arrive.
+
+        ``deadline`` is a ``time.monotonic()`` value the whole body must arrive by.
+        """
+        content_type = (response.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type and content_type not in ALLOWED_IMAGE_TYPES and content_type != 'application/octet-stream':
+            raise ValueError(f"URL does not point to a supported image (content type {content_type})")
+
+        try:
+            declared_size = int(response.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            declared_size = None
+        if declared_size is not None and declared_size > max_size:
+            raise PayloadTooLargeError(f"File too large, max {max_size} bytes")
+
+        buffer = bytearray()
+        header = None
+        for chunk in OCRService._iter_download(response):
+            if deadline is not None and time.monotonic() > deadline:
+                raise ValueError(f"Image download took longer than {OCR_URL_FETCH_TIMEOUT_SECONDS} seconds")
+            if len(buffer) + len(chunk) > max_size:
+                raise PayloadTooLargeError(f"File too large, max {max_size} bytes")
+            buffer += chunk
+
+            if header is None:
+                try:
+                    header = OCRService.sniff_image_header(buffer)
+                except _TruncatedHeaderError:
+                    continue
+                OCRService._check_dimensions(header)
+
+        if header is None:
+            header = OCRService.validate_image(buffer, max_size=max_size)
+
+        return memoryview(buffer), header
+
+    @staticmethod
+    def _iter_download(response):
+        """Yield the body as it arrives, one socket read at a time.
+
+        ``iter_content`` blocks until a whole chunk is filled, so a slow sender
+        would keep the caller from checking its deadline between chunks.
+        """
+        if not hasattr(response.raw, 'read1'):
+            # urllib3 < 2 has no read1
+            yield from response.iter_content(chunk_size=UPLOAD_CHUNK_SIZE)
+            return
+        while True:
+            chunk = response.raw.read1(UPLOAD_CHUNK_SIZE, decode_content=True)
+            if not chunk:
+                return
+            yield chunk
+
+    @classmethod
+    def _get_cached_url_result(cls, image_url: str):
+        with cls._url_cache_lock:
+            entry = cls._url_cache.get(image_url)
+            if entry is not None:
+                cls._url_cache.move_to_end(image_url)
+            return entry
+
+    @classmethod
+    def _store_url_result(cls, image_url: str, validators: dict, result: dict):
+        if OCR_URL_CACHE_SIZE <= 0:
+            return
+        with cls._url_cache_lock:
+            cls._url_cache[image_url] = {
+                **validators,
+                'result': {key: value for key, value in result.items() if key != 'processing_time_ms'},
+            }
+            cls._url_cache.move_to_end(image_url)
+            while len(cls._url_cache) > OCR_URL_CACHE_SIZE:
+                cls._url_cache.popitem(last=False)
+
+    @staticmethod
+    def build_history_item(user_id, result: dict, image_url: str | None) -> dict:
+        """Build the processing_history document for an OCR result."""
+        now = datetime.utcnow()
+        item = {
+            'user_id': user_id,
+            'type': 'ocr',
+            'input_text': result['extracted_text'],
+            'output_text': result['extracted_text'],
+            'image_url': image_url,
+            'confidence_score': result['confidence_score'],
+            'processing_time_ms': result['processing_time_ms'],
+            'created_at': now,
+            'is_exported': False,
+        }
+
+        if OCR_HISTORY_RETENTION_DAYS > 0:
+            item['ocr_expires_at'] = now + timedelta(days=OCR_HISTORY_RETENTION_DAYS)
+
+        return item
+
     @staticmethod
     def _fallback_ocr_result():
         """
@@ -119,92 +316,267 @@ class OCRService:
             raise
 
     @staticmethod
-    def validate_image(file_bytes, max_size=10485760):  # 10MB
+    def sniff_image_header(file_bytes) -> dict:
         """
-        Validate image file
+        Identify an upload from its leading bytes without decoding it.
 
         Args:
-            file_bytes: Image file in bytes
+            file_bytes: Image file as bytes or memoryview
+
+        Returns:
+            Dict with format, width and height (0 for PDF documents)
+        """
+        # Release the view on exit so a growing download buffer can be extended.
+        with memoryview(file_bytes) as view:
+            signature = bytes(view[:12])
+
+            if signature.startswith(b'\x89PNG\r\n\x1a\n'):
+                image_format = 'PNG'
+                width, height = _sniff_png(view)
+            elif signature.startswith(b'\xff\xd8\xff'):
+                image_format = 'JPEG'
+                width, height = _sniff_jpeg(view)
+            elif signature[:4] == b'RIFF' and signature[8:12] == b'WEBP':
+                image_format = 'WEBP'
+                width, height = _sniff_webp(view)
+            elif signature.startswith(b'%PDF-'):
+                image_format = 'PDF'
+                width, height = 0, 0
+            elif len(signature) < 12:
+                raise _TruncatedHeaderError("Truncated image header")
+            else:
+                raise ValueError("Unsupported format: expected JPEG, PNG, WEBP or PDF")
+
+        return {'format': image_format, 'width': width, 'height': height}
+
+    @staticmethod
+    def validate_image(file_bytes, max_size=MAX_FILE_SIZE):
+        """
+        Validate image file from its header only (single pass, no decode)
+
+        Args:
+            file_bytes: Image file as bytes or memoryview
             max_size: Maximum file size in bytes
 
         Returns:
-            True if valid, raises exception otherwise
+            Header dict from ``sniff_image_header``, raises exception otherwise
         """
         try:
             if len(file_bytes) > max_size:
-                raise ValueError(f"File too large, max {max_size} bytes")
+                raise PayloadTooLargeError(f"File too large, max {max_size} bytes")
 
-            img = Image.open(io.BytesIO(file_bytes))
-            if img.format not in ['JPEG', 'PNG', 'WEBP', 'PDF']:
-                raise ValueError(f"Unsupported format: {img.format}")
+            header = OCRService.sniff_image_header(file_bytes)
+            OCRService._check_dimensions(header)
 
-            return True
+            return header
 
         except Exception as e:
             logger.error(f"Image validation error: {e}")
             raise
 
     @staticmethod
-    def _extract_text(file_bytes: bytes, image: Image.Image):
+    def verify_decodable(file_bytes, header: dict):
+        """Reject truncated or corrupt images before they reach the providers.
+
+        ``Image.verify()`` checks structure and checksums but does nothing for
+        JPEG, so JPEGs are decoded in draft mode (1/8 scale), which still reads
+        every scan. PDFs are left to OCR.Space.
+        """
+        if header['format'] == 'PDF':
+            return
+        try:
+            image = OCRService._decode_image(file_bytes, header)
+            if header['format'] == 'JPEG':
+                image.draft('L', (max(1, header['width'] // 8), max(1, header['height'] // 8)))
+                image.load()
+            else:
+                image.verify()
+        except Exception as e:
+            logger.warning(f"Image decode check failed: {e}")
+            raise ValueError("Image data is corrupt or truncated")
+
+    @staticmethod
+    def _check_dimensions(header: dict):
+        if header['width'] * header['height'] > MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image too large, max {MAX_IMAGE_PIXELS // 1000000}MP")
+
+    @staticmethod
+    async def read_capped(chunks, max_size=MAX_FILE_SIZE, declared_size=None) -> memoryview:
+        """
+        Buffer an async byte stream, aborting as soon as it exceeds ``max_size``.
+
+        Args:
+            chunks: Async iterator of byte chunks (request body or upload)
+            max_size: Maximum accepted size in bytes
+            declared_size: Content-Length / upload size if known, checked up front
+
+        Returns:
+            memoryview over the received bytes
+        """
+        if declared_size is not None and declared_size > max_size:
+            raise PayloadTooLargeError(f"File too large, max {max_size} bytes")
+
+        buffer = bytearray()
+        async for chunk in chunks:
+            if len(buffer) + len(chunk) > max_size:
+                raise PayloadTooLargeError(f"File too large, max {max_size} bytes")
+            buffer += chunk
+        return memoryview(buffer)
+
+    @staticmethod
+    async def capped_stream(chunks, max_size):
+        """Pass an async byte stream through, aborting once it exceeds ``max_size``."""
+        received = 0
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > max_size:
+                raise PayloadTooLargeError(f"File too large, max {max_size} bytes")
+            yield chunk
+
+    @staticmethod
+    async def iter_upload(upload):
+        """Yield an UploadFile in fixed-size chunks."""
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    @staticmethod
+    def _decode_image(file_bytes, header: dict):
+        """Decode pixels for local OCR; only Tesseract needs them."""
+        if header['format'] == 'PDF':
+            return None
+
+        view = memoryview(file_bytes)
+        # BytesIO shares an immutable bytes buffer instead of copying it.
+        source = view.obj if isinstance(view.obj, bytes) and view.nbytes == len(view.obj) else view
+        return Image.open(io.BytesIO(source))
+
+    @staticmethod
+    def _extract_text(file_bytes, header: dict):
         """Primary OCR extraction path with backend-only providers.
 
         Strategy:
-        1) OCR.Space API (if explicitly configured or forced)
-        2) Local Tesseract OCR
-        3) Empty fallback
+        1) OCR.Space API and/or local Tesseract, depending on OCR_PROVIDER
+           (``auto`` races both, see ``_race_providers``)
+        2) Empty fallback
         """
         provider = (OCR_PROVIDER or "auto").strip().lower()
 
         if provider in ("ocr_space", "ocr.space"):
-            text, conf = OCRService._extract_with_ocr_space(file_bytes)
+            text, conf = OCRService._extract_with_ocr_space(file_bytes, header)
             if text:
                 return text, conf
 
         if provider in ("tesseract",):
-            text, conf = OCRService._extract_with_tesseract(image)
+            text, conf = OCRService._extract_with_tesseract(file_bytes, header)
             if text:
                 return text, conf
 
         if provider == "auto":
-            # Auto strategy prioritizes cloud OCR first (no local binary required),
-            # then local Tesseract as fallback.
-            text, conf = OCRService._extract_with_ocr_space(file_bytes)
-            if text:
-                return text, conf
-
-            text, conf = OCRService._extract_with_tesseract(image)
+            text, conf = OCRService._race_providers(file_bytes, header)
             if text:
                 return text, conf
 
         return OCRService._fallback_ocr_result()
 
     @staticmethod
-    def _extract_with_tesseract(image: Image.Image):
-        if pytesseract is None:
+    def _race_providers(file_bytes, header: dict):
+        """Run OCR.Space and local Tesseract concurrently and keep the first usable result.
+
+        Results are taken in order of arrival: the first one with at least
+        OCR_AUTO_MIN_TEXT_CHARS characters wins (a Tesseract result must also
+        reach OCR_AUTO_MIN_CONFIDENCE) and the other provider is abandoned.
+        The two confidences are not compared, since OCR.Space does not report
+        one. If no result qualifies, the first non-empty one is returned.
+
+        While every OCR.Space slot is taken (e.g. by calls abandoned under
+        load) the race runs Tesseract alone rather than queueing behind them.
+        """
+        cancel_event = threading.Event()
+        futures = {}
+        if _ocr_space_slots.acquire(blocking=False):
+            futures[_provider_executor.submit(OCRService._race_ocr_space, file_bytes, header, cancel_event)] = "ocr_space"
+        if TesseractWorkerPool.is_available() and header['format'] != 'PDF':
+            futures[_provider_executor.submit(OCRService._extract_with_tesseract, file_bytes, header, cancel_event)] = "tesseract"
+        if not futures:
+            # Nothing to race: call OCR.Space on the caller's thread.
+            return OCRService._extract_with_ocr_space(file_bytes, header)
+
+        arrived = []
+        winner = None
+        pending = set(futures)
+        try:
+            while pending and winner is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures[future]
+                    text, conf = future.result()
+                    arrived.append((name, text, conf))
+                    if winner is None and OCRService._race_result_usable(name, text, conf):
+                        winner = (name, text, conf)
+        finally:
+            # Stop queued Tesseract strips and OCR.Space calls that have not
+            # started; an in-flight OCR.Space call is left to hit its own
+            # timeout (holding its slot) and its result is discarded.
+            cancel_event.set()
+            for future in pending:
+                if future.cancel() and futures[future] == "ocr_space":
+                    _ocr_space_slots.release()
+
+        if winner is None:
+            winner = next(((name, text, conf) for name, text, conf in arrived if text), None)
+        if winner is None:
+            return "", 0.0
+
+        name, text, conf = winner
+        logger.debug(f"OCR auto race won by {name} (confidence {conf:.2f})")
+        return text, conf
+
+    @staticmethod
+    def _race_result_usable(name: str, text: str, conf: float) -> bool:
+        if len((text or "").strip()) < OCR_AUTO_MIN_TEXT_CHARS:
+            return False
+        return name != "tesseract" or conf >= OCR_AUTO_MIN_CONFIDENCE
+
+    @staticmethod
+    def _extract_with_tesseract(file_bytes, header: dict, cancel_event: threading.Event = None):
+        if not TesseractWorkerPool.is_available():
             return "", 0.0
 
         try:
-            # Improve OCR stability
-            if image.mode not in ("L", "RGB"):
-                image = image.convert("RGB")
+            image = OCRService._decode_image(file_bytes, header)
+            if image is None:
+                return "", 0.0
 
-            text = pytesseract.image_to_string(image, lang=TESSERACT_LANG or "eng")
+            text, confidence = TesseractWorkerPool.recognize(image, cancel_event)
             clean = (text or "").strip()
             if not clean:
                 return "", 0.0
 
-            # Tesseract doesn't provide a single confidence directly in this call.
-            return clean, 0.86
+            return clean, confidence
         except Exception as e:
             logger.warning(f"Tesseract OCR failed: {e}")
             return "", 0.0
 
     @staticmethod
-    def _extract_with_ocr_space(file_bytes: bytes):
+    def _race_ocr_space(file_bytes, header: dict, cancel_event: threading.Event):
+        try:
+            if cancel_event.is_set():
+                return "", 0.0
+            return OCRService._extract_with_ocr_space(file_bytes, header)
+        finally:
+            _ocr_space_slots.release()
+
+    @staticmethod
+    def _extract_with_ocr_space(file_bytes, header: dict = None):
         try:
             url = "https://api.ocr.space/parse/image"
+            # OCR.Space picks its decoder from the file extension.
+            extension = _FILE_EXTENSIONS.get((header or {}).get('format'), 'png')
             files = {
-                "filename": ("ocr-image.png", file_bytes)
+                "filename": (f"ocr-image.{extension}", file_bytes)
             }
             payload = {
                 "language": OCR_SPACE_LANGUAGE or "eng",
@@ -217,7 +589,7 @@ class OCRService:
                 "apikey": OCR_SPACE_API_KEY or "helloworld"
             }
 
-            response = requests.post(url, files=files, data=payload, headers=headers, timeout=40)
+            response = requests.post(url, files=files, data=payload, headers=headers, timeout=OCR_SPACE_TIMEOUT_SECONDS)
             response.raise_for_status()
             data = response.json()
 
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from pymongo import UpdateOne
+from app.config import (
+    OCR_HISTORY_RETENTION_DAYS, RETENTION_SWEEP_INTERVAL_SECONDS,
+    RETENTION_SWEEP_BATCH_SIZE, RETENTION_SWEEP_MAX_BATCHES, RETENTION_SWEEP_PAUSE_MS,
+    HISTORY_BLOB_MIN_BYTES, TEXT_BLOB_GC_BATCH_SIZE, HISTORY_ARCHIVE_AFTER_MONTHS,
+)
+from app.database import MongoDB
+from app.services.history_archive import HistoryArchive
+from app.services.history_partitions import HistoryPartitions
+from app.services.history_stats import HistoryStatsService
+from app.services.history_writer import history_writer
+from app.services.text_blobs import TextBlobStore
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionSweeper:
+    """Background enforcement of the OCR history retention window.
+
+    Deletion itself is left to the ``ocr_history_ttl_idx`` TTL index. The
+    sweeper only finds OCR items written without ``ocr_expires_at`` (older
+    documents, or written while retention was disabled) and stamps them with
+    ``created_at + retention`` in small batches, so the TTL monitor takes them
+    over. Runs are spread out with jitter so several API instances do not
+    sweep at the same moment.
+
+    Each run also recounts the history stats of up to ``batch_size`` users
+    whose counters still include expired OCR items, recounts a slice of
+    ``text_blobs`` (``TextBlobStore.collect_garbage``), resuming where the
+    previous run stopped, and archives at most one history month older than
+    HISTORY_ARCHIVE_AFTER_MONTHS.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: int = RETENTION_SWEEP_INTERVAL_SECONDS,
+        batch_size: int = RETENTION_SWEEP_BATCH_SIZE,
+        max_batches: int = RETENTION_SWEEP_MAX_BATCHES,
+        pause_seconds: float = RETENTION_SWEEP_PAUSE_MS / 1000,
+    ):
+        self.interval_seconds = max(60, interval_seconds)
+        self.batch_size = max(1, batch_size)
+        self.max_batches = max(1, max_batches)
+        self.pause_seconds = max(0.0, pause_seconds)
+        self._task: asyncio.Task | None = None
+        self._blob_cursor: str | None = None
+        self._stats = {
+            'runs': 0,
+            'stamped': 0,
+            'last_run_at': None,
+            'last_run_ms': None,
+            'last_stamped': 0,
+            'stats_reconciled': 0,
+            'blobs_repaired': 0,
+            'blobs_deleted': 0,
+            'archived_months': 0,
+            'last_archived': None,
+            'last_error': None,
+            'next_run_at': None,
+        }
+
+    # ---- lifecycle ----
+
+    def start(self):
+        if self._task is not None or (
+            OCR_HISTORY_RETENTION_DAYS <= 0 and HISTORY_BLOB_MIN_BYTES <= 0 and HISTORY_ARCHIVE_AFTER_MONTHS <= 0
+        ):
+            return
+        self._task = asyncio.create_task(self._run(), name="retention-sweeper")
+        logger.info("Retention sweeper started")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    # ---- metrics ----
+
+    def snapshot(self) -> dict:
+        return {
+            'running': self._task is not None,
+            'retention_days': OCR_HISTORY_RETENTION_DAYS,
+            'interval_seconds': self.interval_seconds,
+            **self._stats,
+        }
+
+    # ---- sweeping ----
+
+    def _next_delay(self, first: bool = False) -> float:
+        if first:
+            # Spread the first run of freshly started instances.
+            return random.uniform(30, min(600, self.interval_seconds))
+        return self.interval_seconds * random.uniform(0.8, 1.2)
+
+    async def _run(self):
+        delay = self._next_delay(first=True)
+        while True:
+            self._stats['next_run_at'] = (datetime.utcnow() + timedelta(seconds=delay)).isoformat()
+            await asyncio.sleep(delay)
+            await self.sweep()
+            delay = self._next_delay()
+
+    async def sweep(self) -> int:
+        """Stamp up to ``max_batches`` batches of unstamped OCR items."""
+        started = time.perf_counter()
+        stamped = 0
+        try:
+            for _ in range(self.max_batches if OCR_HISTORY_RETENTION_DAYS > 0 else 0):
+                count = await run_in_threadpool(self._stamp_batch)
+                stamped += count
+                if count < self.batch_size:
+                    break
+                await asyncio.sleep(self.pause_seconds)
+            if OCR_HISTORY_RETENTION_DAYS > 0:
+                await run_in_threadpool(self._reconcile_stats)
+            if HISTORY_ARCHIVE_AFTER_MONTHS > 0:
+                await run_in_threadpool(self._archive_month)
+            if HISTORY_BLOB_MIN_BYTES > 0:
+                await run_in_threadpool(self._collect_blobs)
+            self._stats['last_error'] = None
+        except Exception as e:
+            logger.warning(f"Retention sweep failed: {e}")
+            self._stats['last_error'] = str(e)
+
+        self._stats['runs'] += 1
+        self._stats['stamped'] += stamped
+        self._stats['last_stamped'] = stamped
+        self._stats['last_run_at'] = datetime.utcnow().isoformat()
+        self._stats['last_run_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        if stamped:
+            logger.info(f"Retention sweep handed {stamped} OCR history items to the TTL index")
+        return stamped
+
+    def _stamp_batch(self) -> int:
+        db = MongoDB.get_db()
+        retention = timedelta(days=OCR_HISTORY_RETENTION_DAYS)
+        now = datetime.utcnow()
+        stamped = 0
+        users = set()
+        for name in HistoryPartitions.sources(db):
+            batch = list(
+                db[name].find(
+                    {'type': 'ocr', 'ocr_expires_at': {'$exists': False}},
+                    {'_id': 1, 'user_id': 1, 'created_at': 1}
+                ).limit(self.batch_size - stamped)
+            )
+            if not batch:
+                continue
+
+            db[name].bulk_write([
+                UpdateOne(
+                    {'_id': item['_id'], 'ocr_expires_at': {'$exists': False}},
+                    {'$set': {'ocr_expires_at': (item.get('created_at') or now) + retention}}
+                )
+                for item in batch
+            ], ordered=False)
+            stamped += len(batch)
+            users.update(item['user_id'] for item in batch)
+            if stamped >= self.batch_size:
+                break
+
+        # These users' counters did not know about the new expiry dates.
+        if users:
+            HistoryStatsService.invalidate(db, users)
+        return stamped
+
+    def _reconcile_stats(self):
+        """Take expired OCR items out of the history stats (off the request path)."""
+        self._stats['stats_reconciled'] += HistoryStatsService.reconcile_expired(MongoDB.get_db(), self.batch_size)
+
+    def _archive_month(self):
+        """Archive the oldest month past HISTORY_ARCHIVE_AFTER_MONTHS, if any."""
+        db = MongoDB.get_db()
+        for name in HistoryArchive.candidates(db, HISTORY_ARCHIVE_AFTER_MONTHS):
+            totals = HistoryArchive.archive_partition(db, name)
+            if totals is not None:
+                self._stats['archived_months'] += 1
+                self._stats['last_archived'] = name
+                return
+
+    def _collect_blobs(self):
+        if history_writer.spool.depth():
+            # Spooled documents hold references the database cannot see yet.
+            logger.info("Text blob GC skipped while the history spool is being replayed")
+            return
+        self._blob_cursor, repaired, deleted = TextBlobStore.collect_garbage(
+            MongoDB.get_db(), self._blob_cursor, TEXT_BLOB_GC_BATCH_SIZE, history_writer.held_references()
+        )
+        self._stats['blobs_repaired'] += repaired
+        self._stats['blobs_deleted'] += deleted
+        if repaired or deleted:
+            logger.info(f"Text blob GC repaired {repaired} and deleted {deleted} blobs")
+
+
+retention_sweeper = RetentionSweeper()
@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from app.config import OCR_WORKER_COUNT, OCR_TILE_HEIGHT, OCR_TILE_OVERLAP, TESSERACT_LANG
+
+try:
+    import pytesseract
+except Exception:  # pragma: no cover - optional dependency in some deployments
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+
+def _tile_bounds(height: int, tile_height: int, overlap: int) -> list:
+    """Split an image height into overlapping (top, bottom) strips."""
+    if height <= tile_height:
+        return [(0, height)]
+
+    overlap = min(overlap, tile_height // 2)
+    step = tile_height - overlap
+    bounds = []
+    top = 0
+    while True:
+        bottom = min(top + tile_height, height)
+        bounds.append((top, bottom))
+        if bottom >= height:
+            return bounds
+        top += step
+
+
+def _owned_range(bounds: list, index: int, height: int) -> tuple:
+    """Vertical range a strip is responsible for.
+
+    Neighbouring strips split their shared overlap in half, so a text line that
+    was recognized twice is only kept by the strip that owns its center.
+    """
+    def _own_top(i: int) -> int:
+        if i == 0:
+            return 0
+        top = bounds[i][0]
+        return top + (bounds[i - 1][1] - top) // 2
+
+    own_bottom = height if index == len(bounds) - 1 else _own_top(index + 1)
+    return _own_top(index), own_bottom
+
+
+class TesseractWorkerPool:
+    """Persistent pool of local Tesseract workers.
+
+    Work is queued onto a fixed set of long-lived worker threads (one per CPU core
+    by default), so concurrent OCR requests and the strips of one large image
+    share the machine instead of each request running its own blocking call.
+
+    NOTE:
+    - ``recognize`` blocks until every strip is done; call it from a request
+      thread (e.g. ``run_in_threadpool``), never from inside a pool worker.
+    """
+
+    _executor: ThreadPoolExecutor = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return pytesseract is not None
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            with cls._lock:
+                if cls._executor is None:
+                    # Each worker already owns a core; stop tesseract from
+                    # spawning its own OpenMP threads on top of that.
+                    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+                    cls._executor = ThreadPoolExecutor(
+                        max_workers=OCR_WORKER_COUNT,
+                        thread_name_prefix="tesseract",
+                    )
+                    logger.info(f"Tesseract worker pool started with {OCR_WORKER_COUNT} workers")
+        return cls._executor
+
+    @classmethod
+    def shutdown(cls):
+        """Stop the worker threads, dropping any queued strips."""
+        with cls._lock:
+            if cls._executor is not None:
+                cls._executor.shutdown(wait=False, cancel_futures=True)
+                cls._executor = None
+
+    @classmethod
+    def recognize(cls, image: Image.Image, cancel_event: threading.Event = None) -> tuple:
+        """
+        Recognize text in an image, tiling tall images into parallel strips.
+
+        Args:
+            image: Decoded PIL image
+            cancel_event: Optional event; once set, queued strips are dropped
+
+        Returns:
+            Tuple of (extracted_text, confidence_score) where the confidence is the
+            mean Tesseract word confidence scaled to 0..1
+        """
+        if pytesseract is None:
+            return "", 0.0
+
+        # Improve OCR stability
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+
+        width, height = image.size
+        bounds = _tile_bounds(height, OCR_TILE_HEIGHT, OCR_TILE_OVERLAP)
+        executor = cls._get_executor()
+
+        futures = [
+            executor.submit(cls._recognize_strip, image.crop((0, top, width, bottom)), top, cancel_event)
+            for top, bottom in bounds
+        ]
+
+        lines = []
+        try:
+            for index, future in enumerate(futures):
+                own_top, own_bottom = _owned_range(bounds, index, height)
+                for line in future.result():
+                    if own_top <= line['center'] < own_bottom:
+                        lines.append((index, line))
+        finally:
+            for future in futures:
+                future.cancel()
+
+        if cancel_event is not None and cancel_event.is_set():
+            return "", 0.0
+
+        confidences = [conf for _, line in lines for conf in line['confidences']]
+        confidence = sum(confidences) / len(confidences) / 100 if confidences else 0.0
+        return cls._stitch(lines), round(confidence, 4)
+
+    @staticmethod
+    def _recognize_strip(strip: Image.Image, offset: int, cancel_event: threading.Event = None) -> list:
+        """Run Tesseract on one strip and group its words into positioned lines."""
+        if cancel_event is not None and cancel_event.is_set():
+            return []
+
+        data = pytesseract.image_to_data(
+            strip,
+            lang=TESSERACT_LANG or "eng",
+            output_type=pytesseract.Output.DICT,
+        )
+
+        lines = {}
+        for i, word in enumerate(data.get('text', [])):
+            word = (word or "").strip()
+            if not word:
+                continue
+
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            top = data['top'][i] + offset
+            bottom = top + data['height'][i]
+            line = lines.setdefault(key, {'key': key, 'words': [], 'confidences': [], 'top': top, 'bottom': bottom})
+            line['words'].append(word)
+            line['top'] = min(line['top'], top)
+            line['bottom'] = max(line['bottom'], bottom)
+
+            # Tesseract reports -1 for entries without a recognition score.
+            try:
+                conf = float(data['conf'][i])
+            except (KeyError, TypeError, ValueError):
+                conf = -1
+            if conf >= 0:
+                line['confidences'].append(conf)
+
+        result = []
+        for key in sorted(lines):
+            line = lines[key]
+            line['center'] = (line['top'] + line['bottom']) / 2
+            result.append(line)
+        return result
+
+    @staticmethod
+    def _stitch(lines: list) -> str:
+        """Join owned lines back into text, keeping paragraph breaks."""
+        parts = []
+        previous_paragraph = None
+        for index, line in lines:
+            paragraph = (index, line['key'][0], line['key'][1])
+            # A paragraph cut by a strip boundary continues on the next strip.
+            if previous_paragraph is not None and previous_paragraph[0] == index and paragraph != previous_paragraph:
+                parts.append("")
+            parts.append(" ".join(line['words']))
+            previous_paragraph = paragraph
+        return "\n".join(parts).strip()
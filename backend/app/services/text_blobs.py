@@ -0,0 +1,215 @@
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.database import Database
+from app.config import HISTORY_BLOB_MIN_BYTES, TEXT_BLOB_GC_GRACE_SECONDS
+from app.services.history_codec import HistoryCodec, TEXT_FIELDS
+from app.services.history_partitions import HistoryPartitions
+
+logger = logging.getLogger(__name__)
+
+# expires_at of blobs referenced by at least one non-expiring history item;
+# the TTL monitor never reaches it.
+_NEVER = datetime(9999, 12, 31)
+
+
+class TextBlobStore:
+    """Content-addressed storage for large history texts (``text_blobs``).
+
+    A text of at least HISTORY_BLOB_MIN_BYTES is stored once under its SHA-256
+    (``_id``) and history documents keep ``<field>_ref`` instead of the text.
+    Every reference adds one to the blob's ``refcount``; deleting history
+    releases its references and blobs at zero are removed.
+
+    History removed by the TTL monitor cannot release anything, so each blob
+    also carries the latest expiry among its references (``expires_at``) and
+    has its own TTL index. ``collect_garbage`` repairs counts that drifted
+    (e.g. a crash between the two writes); it leaves blobs touched within
+    TEXT_BLOB_GC_GRACE_SECONDS alone, and counts the references held by this
+    instance's unwritten history (``held``), so buffered history writes are
+    never collected. The retention sweeper does not collect at all while the
+    local spool holds documents; other instances' spools are only covered by
+    the grace period.
+    """
+
+    # ---- write path ----
+
+    @staticmethod
+    def externalize(db: Database, documents: list):
+        """Move large texts of ``documents`` into blobs, in place.
+
+        Idempotent: fields already replaced by a reference are skipped, so a
+        batch that is retried is not counted twice.
+        """
+        if HISTORY_BLOB_MIN_BYTES <= 0:
+            return
+
+        refs = Counter()
+        texts = {}
+        expiry = {}
+        moves = []
+        for document in documents:
+            expires_at = document.get('ocr_expires_at') or _NEVER
+            for field in TEXT_FIELDS:
+                text = document.get(field)
+                if not isinstance(text, str) or len(text.encode('utf-8')) < HISTORY_BLOB_MIN_BYTES:
+                    continue
+                digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+                refs[digest] += 1
+                texts[digest] = text
+                expiry[digest] = max(expiry.get(digest, expires_at), expires_at)
+                moves.append((document, field, digest))
+
+        if not refs:
+            return
+        TextBlobStore._acquire(db, refs, texts, expiry)
+        # Only after the blobs exist: a failed acquire leaves the texts in place.
+        for document, field, digest in moves:
+            document[f'{field}_ref'] = digest
+            del document[field]
+
+    @staticmethod
+    def _acquire(db: Database, refs: Counter, texts: dict, expiry: dict):
+        now = datetime.utcnow()
+
+        def bump(digest):
+            return {
+                '$inc': {'refcount': refs[digest]},
+                '$max': {'expires_at': expiry[digest]},
+                '$set': {'updated_at': now},
+            }
+
+        def payload(digest):
+            text = texts[digest]
+            compressed = HistoryCodec.compress(text)
+            fields = {'data': compressed, 'codec': 'zlib'} if compressed is not None else {'text': text}
+            return {**fields, 'size': len(text.encode('utf-8')), 'created_at': now}
+
+        # Known blobs only get their counter bumped; the text is sent for new ones.
+        existing = {blob['_id'] for blob in db.text_blobs.find({'_id': {'$in': list(refs)}}, {'_id': 1})}
+        digests = list(refs)
+        operations = []
+        for digest in digests:
+            update = bump(digest)
+            if digest not in existing:
+                update['$setOnInsert'] = payload(digest)
+            operations.append(UpdateOne({'_id': digest}, update, upsert=True))
+        result = db.text_blobs.bulk_write(operations, ordered=False)
+
+        # A blob released and removed since the check above was just recreated
+        # without its text; fill it in.
+        for index in result.upserted_ids:
+            digest = digests[index]
+            if digest in existing:
+                db.text_blobs.update_one({'_id': digest}, {'$set': payload(digest)})
+
+    # ---- release ----
+
+    @staticmethod
+    def references(documents: list) -> Counter:
+        refs = Counter()
+        for document in documents:
+            for field in TEXT_FIELDS:
+                digest = document.get(f'{field}_ref')
+                if digest:
+                    refs[digest] += 1
+        return refs
+
+    @staticmethod
+    def release(db: Database, refs: Counter):
+        """Drop references (e.g. of deleted history); never raises."""
+        if not refs:
+            return
+        try:
+            now = datetime.utcnow()
+            db.text_blobs.bulk_write([
+                UpdateOne({'_id': digest}, {'$inc': {'refcount': -count}, '$set': {'updated_at': now}})
+                for digest, count in refs.items()
+            ], ordered=False)
+            db.text_blobs.delete_many({'_id': {'$in': list(refs)}, 'refcount': {'$lte': 0}})
+        except Exception as e:
+            # Leaked references are repaired by collect_garbage.
+            logger.warning(f"Could not release {len(refs)} text blobs: {e}")
+
+    @staticmethod
+    def user_references(db: Database, user_id) -> Counter:
+        """Blob references held by all of a user's history (before deleting it)."""
+        refs = Counter()
+        for name in HistoryPartitions.sources(db):
+            for field in TEXT_FIELDS:
+                ref_field = f'{field}_ref'
+                for group in db[name].aggregate([
+                    {'$match': {'user_id': user_id, ref_field: {'$exists': True}}},
+                    {'$group': {'_id': f'${ref_field}', 'count': {'$sum': 1}}},
+                ]):
+                    refs[group['_id']] += group['count']
+        return refs
+
+    # ---- read path ----
+
+    @staticmethod
+    def resolve(db: Database, document: dict) -> dict:
+        """Put referenced texts back into ``document``, in place."""
+        TextBlobStore.resolve_many(db, [document])
+        return document
+
+    @staticmethod
+    def resolve_many(db: Database, documents: list):
+        """``resolve`` for several documents with one blob query."""
+        fields = [
+            (document, {field: document.pop(f'{field}_ref') for field in TEXT_FIELDS if document.get(f'{field}_ref')})
+            for document in documents
+        ]
+        digests = {digest for _, refs in fields for digest in refs.values()}
+        if not digests:
+            return
+
+        blobs = {blob['_id']: blob for blob in db.text_blobs.find({'_id': {'$in': list(digests)}})}
+        for document, refs in fields:
+            for field, digest in refs.items():
+                blob = blobs.get(digest)
+                if blob is None:
+                    logger.error(f"Missing text blob {digest} for history item {document.get('_id')}")
+                    document[field] = document.get(f'{field}_preview', '')
+                elif blob.get('codec') == 'zlib':
+                    document[field] = HistoryCodec.decompress(blob['data'])
+                else:
+                    document[field] = blob.get('text', '')
+
+    # ---- maintenance ----
+
+    @staticmethod
+    def collect_garbage(db: Database, after_id: str | None, limit: int, held: Counter | None = None) -> tuple:
+        """Recount up to ``limit`` blobs after ``after_id``.
+
+        ``held`` counts references of history documents not written yet.
+
+        Returns (last blob id or None when the scan wrapped, repaired, deleted).
+        """
+        query = {'updated_at': {'$lt': datetime.utcnow() - timedelta(seconds=TEXT_BLOB_GC_GRACE_SECONDS)}}
+        if after_id is not None:
+            query['_id'] = {'$gt': after_id}
+        blobs = list(db.text_blobs.find(query, {'_id': 1, 'refcount': 1, 'updated_at': 1}).sort('_id', 1).limit(limit))
+
+        repaired = 0
+        deleted = 0
+        sources = HistoryPartitions.sources(db)
+        for blob in blobs:
+            actual = (held or {}).get(blob['_id'], 0) + sum(
+                db[name].count_documents({f'{field}_ref': blob['_id']})
+                for name in sources
+                for field in TEXT_FIELDS
+            )
+            if actual == blob.get('refcount'):
+                continue
+            # Only apply if nobody touched the blob since it was read.
+            unchanged = {'_id': blob['_id'], 'refcount': blob.get('refcount'), 'updated_at': blob['updated_at']}
+            if actual <= 0:
+                deleted += db.text_blobs.delete_one(unchanged).deleted_count
+            else:
+                repaired += db.text_blobs.update_one(unchanged, {'$set': {'refcount': actual}}).modified_count
+
+        last_id = blobs[-1]['_id'] if len(blobs) == limit else None
+        return last_id, repaired, deleted
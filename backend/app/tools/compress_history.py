@@ -0,0 +1,114 @@
+"""Compress the large text fields of existing history documents (all partitions).
+
+New history items are compressed when they are written; this tool brings
+older documents to the same format in small batches. It is safe to stop and
+re-run at any time.
+
+Usage (from the backend directory):
+    python -m app.tools.compress_history [--batch-size 200] [--pause-ms 100] [--dry-run]
+"""
+import argparse
+import logging
+import time
+from pymongo import UpdateOne
+from app.database import MongoDB
+from app.services.history_codec import HistoryCodec, TEXT_FIELDS
+from app.services.history_partitions import HistoryPartitions
+from app.services.history_writer import add_previews
+
+logger = logging.getLogger(__name__)
+
+_PROJECTION = {field: 1 for field in TEXT_FIELDS}
+_PROJECTION.update({
+    'text_codec': 1,
+    'input_preview': 1, 'output_preview': 1,
+    'input_length': 1, 'output_length': 1,
+})
+
+
+def _plan_update(document: dict):
+    """Return the (filter, update) for one document, or None if nothing to do."""
+    if not HistoryCodec.needs_encoding(document):
+        return None
+
+    original = dict(document)
+    # Previews must come from the plain text before it is compressed.
+    add_previews(document)
+    HistoryCodec.encode(document)
+
+    changed = {key: value for key, value in document.items() if key != '_id' and original.get(key) is not value}
+    removed = [field for field in TEXT_FIELDS if field in original and field not in document]
+    if not removed:
+        return None
+    return (
+        {'_id': document['_id'], 'text_codec': {'$exists': False}},
+        {'$set': changed, '$unset': {field: '' for field in removed}},
+    )
+
+
+def compress_history(batch_size: int = 200, pause_ms: int = 100, dry_run: bool = False) -> dict:
+    db = MongoDB.get_db()
+    totals = {'scanned': 0, 'compressed': 0, 'bytes_before': 0, 'bytes_after': 0}
+    for name in HistoryPartitions.sources(db):
+        _compress_collection(db[name], totals, batch_size, pause_ms, dry_run)
+    return totals
+
+
+def _compress_collection(collection, totals: dict, batch_size: int, pause_ms: int, dry_run: bool):
+    last_id = None
+
+    while True:
+        query = {'text_codec': {'$exists': False}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(collection.find(query, _PROJECTION).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        totals['scanned'] += len(batch)
+
+        operations = []
+        for document in batch:
+            before = sum(len((document.get(field) or '').encode('utf-8')) for field in TEXT_FIELDS)
+            plan = _plan_update(document)
+            if plan is None:
+                continue
+            after = sum(
+                len(document[f'{field}_z']) if f'{field}_z' in document
+                else len((document.get(field) or '').encode('utf-8'))
+                for field in TEXT_FIELDS
+            )
+            totals['bytes_before'] += before
+            totals['bytes_after'] += after
+            operations.append(UpdateOne(*plan))
+
+        if operations and not dry_run:
+            collection.bulk_write(operations, ordered=False)
+        totals['compressed'] += len(operations)
+        logger.info(
+            f"{collection.name}: scanned {totals['scanned']} documents, compressed {totals['compressed']} "
+            f"({totals['bytes_before']} -> {totals['bytes_after']} bytes)"
+        )
+
+        if pause_ms:
+            time.sleep(pause_ms / 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--pause-ms', type=int, default=100, help='sleep between batches to limit load')
+    parser.add_argument('--dry-run', action='store_true', help='report savings without writing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    MongoDB.connect_db()
+    try:
+        totals = compress_history(max(1, args.batch_size), max(0, args.pause_ms), args.dry_run)
+    finally:
+        MongoDB.close_db()
+    print(totals)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Manage the monthly history partitions.
+
+    list     partitions with their document counts, and archived months
+    migrate  move documents of the unpartitioned processing_history collection
+             into their monthly partitions (safe to stop and re-run)
+    archive  compress months before --before into the archive and drop them
+    restore  write an archived month back into its partition
+
+Months are given as YYYY-MM. Archives go to the history_archive collection, or
+to gzipped BSON files with --dir (defaults to HISTORY_ARCHIVE_DIR).
+
+Usage (from the backend directory):
+    python -m app.tools.history_partitions list
+    python -m app.tools.history_partitions migrate [--batch-size 500] [--pause-ms 100]
+    python -m app.tools.history_partitions archive --before 2025-01 [--dir PATH]
+    python -m app.tools.history_partitions restore --month 2024-06 [--dir PATH]
+"""
+import argparse
+import logging
+import time
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+from app.config import HISTORY_ARCHIVE_DIR
+from app.database import MongoDB
+from app.services.history_archive import HistoryArchive
+from app.services.history_partitions import HistoryPartitions, LEGACY
+
+logger = logging.getLogger(__name__)
+
+_DUPLICATE_KEY = 11000
+
+
+def _month(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, '%Y-%m')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+
+
+def list_partitions() -> dict:
+    db = MongoDB.get_db()
+    HistoryPartitions.refresh(db)
+    return {
+        'partitions': {name: db[name].estimated_document_count() for name in HistoryPartitions.sources(db)},
+        'archived': {
+            run['_id']: {key: run.get(key) for key in ('status', 'documents', 'stored_bytes', 'target')}
+            for run in db.history_archive_runs.find().sort('_id', 1)
+        },
+    }
+
+
+def migrate(batch_size: int = 500, pause_ms: int = 100) -> dict:
+    db = MongoDB.get_db()
+    legacy = db[LEGACY]
+    totals = {'moved': 0}
+
+    while True:
+        batch = list(legacy.find().sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        try:
+            HistoryPartitions.insert_many(db, batch)
+        except BulkWriteError as e:
+            # Copied by an interrupted run that did not get to delete them.
+            if any(err.get('code') != _DUPLICATE_KEY for err in e.details.get('writeErrors', [])):
+                raise
+        # Moved as is: blob references and stats counters stay valid.
+        legacy.delete_many({'_id': {'$in': [document['_id'] for document in batch]}})
+        totals['moved'] += len(batch)
+        logger.info(f"Moved {totals['moved']} history documents into monthly partitions")
+
+        if pause_ms:
+            time.sleep(pause_ms / 1000)
+
+    return totals
+
+
+def archive(before: datetime, directory: str) -> dict:
+    db = MongoDB.get_db()
+    HistoryPartitions.refresh(db)
+    month = HistoryPartitions.month_start(min(before, datetime.utcnow()))
+    archived = {}
+    for name in HistoryPartitions.months_before(month):
+        totals = HistoryArchive.archive_partition(db, name, directory)
+        archived[name] = totals if totals is not None else 'in progress elsewhere'
+    return archived
+
+
+def restore(month: datetime, directory: str) -> dict:
+    db = MongoDB.get_db()
+    name = HistoryPartitions.name_for(month)
+    return {name: HistoryArchive.restore_partition(db, name, directory)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    migrate_parser = commands.add_parser('migrate')
+    migrate_parser.add_argument('--batch-size', type=int, default=500)
+    migrate_parser.add_argument('--pause-ms', type=int, default=100, help='sleep between batches to limit load')
+    archive_parser = commands.add_parser('archive')
+    archive_parser.add_argument('--before', type=_month, required=True, help='archive months before this one')
+    archive_parser.add_argument('--dir', default=HISTORY_ARCHIVE_DIR, help='write .bson.gz files here')
+    restore_parser = commands.add_parser('restore')
+    restore_parser.add_argument('--month', type=_month, required=True)
+    restore_parser.add_argument('--dir', default=HISTORY_ARCHIVE_DIR, help='read .bson.gz files from here')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    MongoDB.connect_db()
+    try:
+        if args.command == 'list':
+            result = list_partitions()
+        elif args.command == 'migrate':
+            result = migrate(max(1, args.batch_size), max(0, args.pause_ms))
+        elif args.command == 'archive':
+            result = archive(args.before, args.dir)
+        else:
+            result = restore(args.month, args.dir)
+    finally:
+        MongoDB.close_db()
+    print(result)
+
+
+if __name__ == '__main__':
+    main()
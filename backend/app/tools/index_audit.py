@@ -0,0 +1,436 @@
+"""Check that every query shape the API issues is served by an index.
+
+Seeds a scratch database (never the application database) with realistic
+volumes through the same write paths as the API, builds the indexes of
+MongoDB._create_indexes on it, then runs ``explain`` (executionStats) on each
+query shape used by the routes and background workers. A shape fails on a
+COLLSCAN or when it examines more than --max-ratio documents per document
+returned; blocking in-memory sorts are reported as warnings. For every finding
+an index following the equality-sort-range rule is proposed.
+
+Exits with status 1 when a shape fails (or warns, with --strict), so it can run
+in CI against a disposable mongod.
+
+Usage (from the backend directory):
+    python -m app.tools.index_audit --seed [--users 200] [--items 100000]
+    python -m app.tools.index_audit [--database NAME] [--max-ratio 10] [--strict] [--json]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from bson.objectid import ObjectId
+from pymongo.database import Database
+from app.config import DATABASE_NAME, HISTORY_PREVIEW_CHARS
+from app.database import MongoDB
+from app.routes.history import _LIST_PROJECTION
+from app.services.history_partitions import HistoryPartitions
+from app.services.job_queue import JOB_QUEUED, JOB_PROCESSING, JOB_COMPLETED, JOB_FAILED
+
+logger = logging.getLogger(__name__)
+
+_TYPES = [('grammar', 40), ('paraphrase', 20), ('translate', 25), ('ocr', 15)]
+_WORDS = (
+    "invoice meeting schedule report draft contract summary travel receipt "
+    "lecture notes recipe letter proposal review agenda budget manual poem"
+).split()
+_SAMPLES = '_audit_samples'
+
+
+# ---- seeding ----
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _object_id(rng: random.Random, moment: datetime) -> ObjectId:
+    # from_datetime alone zeroes the tail, so ids of the same second would collide.
+    return ObjectId(int(moment.replace(tzinfo=timezone.utc).timestamp()).to_bytes(4, 'big') + rng.randbytes(8))
+
+
+def seed(db: Database, users: int, items: int, seed_value: int = 42) -> dict:
+    """Fill ``db`` with users, history spread over the last 90 days, jobs and blobs."""
+    rng = random.Random(seed_value)
+    for name in db.list_collection_names():
+        db.drop_collection(name)
+    MongoDB._create_indexes(db)
+
+    now = datetime.utcnow()
+    user_ids = [ObjectId() for _ in range(max(1, users))]
+    db.users.insert_many([
+        {'_id': user_id, 'username': f'audit{n}', 'email': f'audit{n}@example.com', 'created_at': now}
+        for n, user_id in enumerate(user_ids)
+    ])
+
+    # Few heavy users and a long tail, like real accounts.
+    weights = [1 / (n + 1) for n in range(len(user_ids))]
+    types = [name for name, _ in _TYPES]
+    type_weights = [weight for _, weight in _TYPES]
+    digests = [hashlib.sha256(str(n).encode()).hexdigest() for n in range(max(1, items // 50))]
+    batch_ids = []
+    documents = []
+    for n in range(items):
+        created_at = now - timedelta(seconds=rng.randint(0, 90 * 86400))
+        kind = rng.choices(types, type_weights)[0]
+        text = _sentence(rng, rng.randint(5, 60))
+        document = {
+            '_id': _object_id(rng, created_at),
+            'user_id': rng.choices(user_ids, weights)[0],
+            'type': kind,
+            'created_at': created_at,
+            'input_text': text,
+            'output_text': text,
+            'input_preview': text[:HISTORY_PREVIEW_CHARS],
+            'output_preview': text[:HISTORY_PREVIEW_CHARS],
+            'input_length': len(text),
+            'output_length': len(text),
+            'processing_time_ms': rng.uniform(5, 900),
+            'is_exported': rng.random() < 0.05,
+        }
+        if rng.random() < 0.1:
+            del document['input_text']
+            document['input_text_ref'] = rng.choice(digests)
+        if kind == 'ocr' and rng.random() < 0.9:
+            document['ocr_expires_at'] = created_at + timedelta(days=365)
+        if rng.random() < 0.05:
+            if not batch_ids or rng.random() < 0.05:
+                batch_ids.append(str(_object_id(rng, created_at)))
+            document['batch_id'] = batch_ids[-1]
+        documents.append(document)
+        if len(documents) >= 1000:
+            HistoryPartitions.insert_many(db, documents)
+            documents = []
+    if documents:
+        HistoryPartitions.insert_many(db, documents)
+
+    db.text_blobs.insert_many([
+        {'_id': digest, 'refcount': 1, 'text': _sentence(rng, 400), 'updated_at': now - timedelta(days=rng.randint(0, 90))}
+        for digest in digests
+    ])
+
+    statuses = [JOB_QUEUED, JOB_PROCESSING, JOB_COMPLETED, JOB_FAILED]
+    db.ocr_jobs.insert_many([
+        {
+            'user_id': rng.choice(user_ids),
+            'status': rng.choices(statuses, [5, 2, 90, 3])[0],
+            'available_at': now - timedelta(minutes=rng.randint(0, 600)),
+            'lease_expires_at': now + timedelta(minutes=rng.randint(-5, 5)),
+            'created_at': now,
+        }
+        for _ in range(max(1, items // 50))
+    ])
+    batch_jobs = [
+        {'_id': ObjectId(), 'user_id': rng.choice(user_ids), 'total_items': 20, 'created_at': now}
+        for _ in range(max(1, items // 500))
+    ]
+    db.batch_jobs.insert_many(batch_jobs)
+    db.batch_items.insert_many([
+        {
+            'batch_id': batch['_id'],
+            'index': index,
+            'status': rng.choices(statuses, [10, 2, 85, 3])[0],
+            'available_at': now - timedelta(minutes=rng.randint(0, 600)),
+            'lease_expires_at': now + timedelta(minutes=rng.randint(-5, 5)),
+        }
+        for batch in batch_jobs
+        for index in range(batch['total_items'])
+    ])
+
+    heaviest = user_ids[0]
+    HistoryPartitions.refresh(db)
+    partition = max(
+        HistoryPartitions.sources(db),
+        key=lambda name: db[name].count_documents({'user_id': heaviest})
+    )
+    sample = db[partition].find_one({'user_id': heaviest}, sort=[('created_at', -1)], skip=20)
+    samples = {
+        '_id': _SAMPLES,
+        'partition': partition,
+        'user_id': heaviest,
+        'username': 'audit0',
+        'item_id': sample['_id'],
+        'created_at': sample['created_at'],
+        'batch_id': batch_ids[0] if batch_ids else None,
+        'batch_job_id': batch_jobs[0]['_id'],
+        'ocr_job_id': (db.ocr_jobs.find_one({'user_id': heaviest}, {'_id': 1}) or {'_id': ObjectId()})['_id'],
+        'digest': digests[0],
+        'word': _WORDS[0],
+    }
+    db.audit_meta.replace_one({'_id': _SAMPLES}, samples, upsert=True)
+    return {'users': len(user_ids), 'history': items, 'partitions': HistoryPartitions.sources(db)}
+
+
+# ---- query shapes ----
+
+def _shapes(s: dict) -> list:
+    """(name, kind, command) for every query the API issues, with sample values."""
+    now = datetime.utcnow()
+    history = s['partition']
+    user = s['user_id']
+    keyset = {'$and': [{'user_id': user}, {'$or': [
+        {'created_at': {'$lt': s['created_at']}},
+        {'created_at': s['created_at'], '_id': {'$lt': s['item_id']}},
+    ]}]}
+    recent = {'created_at': -1, '_id': -1}
+    month_start = HistoryPartitions.month_of(history) or HistoryPartitions.month_start(now)
+    claim = {'$or': [
+        {'status': JOB_QUEUED, 'available_at': {'$lte': now}},
+        {'status': JOB_PROCESSING, 'lease_expires_at': {'$lt': now}},
+    ]}
+
+    def find(collection, query, sort=None, limit=0, projection=None):
+        command = {'find': collection, 'filter': query}
+        if sort:
+            command['sort'] = sort
+        if limit:
+            command['limit'] = limit
+        if projection:
+            command['projection'] = projection
+        return command
+
+    return [
+        # routes/history.py
+        ('history list', 'find', find(history, {'user_id': user}, recent, 21, _LIST_PROJECTION)),
+        ('history list by type', 'find', find(history, {'user_id': user, 'type': 'translate'}, recent, 21, _LIST_PROJECTION)),
+        ('history list after cursor', 'find', find(history, keyset, recent, 21, _LIST_PROJECTION)),
+        ('history list in time range', 'find', find(
+            history, {'user_id': user, 'created_at': {'$gte': month_start, '$lt': month_start + timedelta(days=7)}},
+            recent, 21, _LIST_PROJECTION
+        )),
+        ('history search', 'find', find(
+            history, {'user_id': user, '$text': {'$search': s['word']}},
+            {'score': {'$meta': 'textScore'}, 'created_at': -1, '_id': -1}, 21,
+            {**_LIST_PROJECTION, 'score': {'$meta': 'textScore'}}
+        )),
+        ('history total', 'count', {'count': history, 'query': {'user_id': user}}),
+        ('history item', 'find', find(history, {'_id': s['item_id'], 'user_id': user}, limit=1)),
+        ('history clear', 'delete', {'delete': history, 'deletes': [{'q': {'user_id': user}, 'limit': 0}]}),
+        ('history partition pointer', 'find', find('history_partition_index', {'_id': s['item_id']}, limit=1)),
+        # routes/batch.py (synchronous batches)
+        ('batch history items', 'find', find(
+            history, {'batch_id': s['batch_id'], 'user_id': user}, projection={'processing_time_ms': 1}
+        )),
+        # services: stats, blobs, retention
+        ('stats reconcile', 'aggregate', {'aggregate': history, 'cursor': {}, 'pipeline': [
+            {'$match': {'user_id': user, '$or': [
+                {'ocr_expires_at': {'$exists': False}}, {'ocr_expires_at': {'$gt': now}},
+            ]}},
+            {'$group': {'_id': '$type', 'count': {'$sum': 1}}},
+        ]}),
+        ('user blob references', 'aggregate', {'aggregate': history, 'cursor': {}, 'pipeline': [
+            {'$match': {'user_id': user, 'input_text_ref': {'$exists': True}}},
+            {'$group': {'_id': '$input_text_ref', 'count': {'$sum': 1}}},
+        ]}),
+        ('blob reference count', 'count', {'count': history, 'query': {'input_text_ref': s['digest']}}),
+        ('blob garbage scan', 'find', find(
+            'text_blobs', {'updated_at': {'$lt': now - timedelta(hours=1)}, '_id': {'$gt': ''}}, {'_id': 1}, 200
+        )),
+        ('stats due for recount', 'find', find(
+            'history_stats', {'next_expiry': {'$lte': now}}, {'next_expiry': 1}, 500, {'_id': 1}
+        )),
+        ('retention stamp', 'find', find(history, {'type': 'ocr', 'ocr_expires_at': {'$exists': False}}, limit=500)),
+        # routes/ocr.py and the job workers
+        ('ocr job', 'find', find('ocr_jobs', {'_id': s['ocr_job_id'], 'user_id': user}, limit=1)),
+        ('ocr job claim', 'findAndModify', {
+            'findAndModify': 'ocr_jobs', 'query': claim, 'sort': {'available_at': 1},
+            'update': {'$inc': {'attempts': 1}},
+        }),
+        ('batch job', 'find', find('batch_jobs', {'_id': s['batch_job_id'], 'user_id': user}, limit=1)),
+        ('batch item claim', 'findAndModify', {
+            'findAndModify': 'batch_items', 'query': claim, 'sort': {'available_at': 1},
+            'update': {'$inc': {'attempts': 1}},
+        }),
+        ('batch progress', 'aggregate', {'aggregate': 'batch_items', 'cursor': {}, 'pipeline': [
+            {'$match': {'batch_id': s['batch_job_id']}},
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}}},
+        ]}),
+        ('batch items page', 'find', find(
+            'batch_items', {'batch_id': s['batch_job_id'], 'index': {'$gt': -1}}, {'index': 1}, 100
+        )),
+        # routes/auth.py
+        ('user by name', 'find', find('users', {'username': s['username']}, limit=1)),
+        ('user by id', 'find', find('users', {'_id': user}, limit=1)),
+        ('user stats', 'find', find('history_stats', {'_id': user}, limit=1)),
+    ]
+
+
+# ---- analysis ----
+
+def _find(document, key: str):
+    """First value of ``key`` anywhere in a nested explain document."""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        values = document.values()
+    elif isinstance(document, list):
+        values = document
+    else:
+        return None
+    for value in values:
+        found = _find(value, key)
+        if found is not None:
+            return found
+    return None
+
+
+def _stages(plan: dict):
+    if not isinstance(plan, dict):
+        return
+    yield plan.get('stage'), plan.get('indexName')
+    for key in ('inputStage', 'innerStage', 'outerStage', 'thenStage', 'elseStage'):
+        yield from _stages(plan.get(key))
+    for child in plan.get('inputStages', []):
+        yield from _stages(child)
+
+
+def _branches(query: dict) -> list:
+    """A filter as a list of conjunctions; each ``$or`` branch is planned on its own."""
+    branches = [{}]
+    for field, condition in query.items():
+        if field == '$and':
+            parts = [_branches(part) for part in condition]
+        elif field == '$or':
+            parts = [[branch for part in condition for branch in _branches(part)]]
+        else:
+            parts = [[{field: condition}]]
+        for options in parts:
+            branches = [{**branch, **option} for branch in branches for option in options]
+    return branches
+
+
+def _filter_fields(query: dict) -> tuple:
+    """(equality, range, partial filter) fields of one conjunction, for an ESR index."""
+    equality, ranges, partial = [], [], {}
+    for field, condition in query.items():
+        if field.startswith('$'):
+            continue
+        if not isinstance(condition, dict) or not any(key.startswith('$') for key in condition):
+            equality.append(field)
+        elif '$in' in condition or '$eq' in condition:
+            equality.append(field)
+        elif condition.get('$exists') is True:
+            partial[field] = {'$exists': True}
+            ranges.append(field)
+        elif condition.get('$exists') is not False:
+            ranges.append(field)
+    return equality, ranges, partial
+
+
+def propose(command: dict) -> str | None:
+    """Equality-sort-range indexes for a shape's filter and sort."""
+    collection = next(iter(command.values()))
+    if 'pipeline' in command:
+        query = next((stage['$match'] for stage in command['pipeline'] if '$match' in stage), {})
+    else:
+        query = command.get('filter', command.get('query')) or (command.get('deletes') or [{}])[0].get('q', {})
+
+    proposals = []
+    for branch in _branches(query):
+        equality, ranges, partial = _filter_fields(branch)
+        sort = {field: direction for field, direction in (command.get('sort') or {}).items() if isinstance(direction, int)}
+        # Equality fields take the sort's direction so both orders share one index.
+        keys = [(field, sort.get(field, 1)) for field in dict.fromkeys(equality)]
+        for field, direction in sort.items():
+            if field not in dict(keys):
+                keys.append((field, direction))
+        keys += [(field, 1) for field in dict.fromkeys(ranges) if field not in dict(keys)]
+        options = f", partialFilterExpression={partial}" if partial else ''
+        proposal = f"create_index({keys}{options})"
+        if keys and proposal not in proposals:
+            proposals.append(proposal)
+    if not proposals:
+        return None
+    if HistoryPartitions.month_of(collection):
+        collection = '<each history partition> (HistoryPartitions.ensure_indexes)'
+    return f"{collection}: {'; '.join(proposals)}"
+
+
+def audit(db: Database, max_ratio: float) -> list:
+    samples = db.audit_meta.find_one({'_id': _SAMPLES})
+    if samples is None:
+        raise SystemExit(f"{db.name} has not been seeded; run with --seed first")
+
+    results = []
+    for name, kind, command in _shapes(samples):
+        explain = db.command({'explain': command, 'verbosity': 'executionStats'})
+        planner = _find(explain, 'queryPlanner') or {}
+        stats = _find(explain, 'executionStats') or {}
+        winning = planner.get('winningPlan', {})
+        stages = list(_stages(winning.get('queryPlan', winning)))
+        returned = stats.get('nReturned', 0)
+        examined = stats.get('totalDocsExamined', 0)
+
+        failures, warnings = [], []
+        if any(stage == 'COLLSCAN' for stage, _ in stages):
+            failures.append('COLLSCAN')
+        # Counts and deletes return nothing; only their scans are judged.
+        if kind in ('find', 'aggregate') and examined > max_ratio * max(1, returned):
+            failures.append(f'examined {examined} documents for {returned} returned')
+        if any(stage == 'SORT' for stage, _ in stages):
+            warnings.append('blocking in-memory SORT')
+
+        results.append({
+            'shape': name,
+            'collection': next(iter(command.values())),
+            'indexes': sorted({index for _, index in stages if index}),
+            'returned': returned,
+            'docs_examined': examined,
+            'keys_examined': stats.get('totalKeysExamined', 0),
+            'ms': stats.get('executionTimeMillis'),
+            'failures': failures,
+            'warnings': warnings,
+            'proposal': propose(command) if failures or warnings else None,
+        })
+    return results
+
+
+def _report(results: list):
+    for result in results:
+        verdict = 'FAIL' if result['failures'] else 'WARN' if result['warnings'] else 'ok'
+        print(
+            f"{verdict:4}  {result['shape']:28} {','.join(result['indexes']) or '-':48} "
+            f"returned={result['returned']} docs={result['docs_examined']} keys={result['keys_examined']}"
+        )
+        for problem in result['failures'] + result['warnings']:
+            print(f"      {problem}")
+        if result['proposal']:
+            print(f"      proposed: {result['proposal']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=f"{DATABASE_NAME}_index_audit", help='scratch database to use')
+    parser.add_argument('--seed', action='store_true', help='drop and re-seed the scratch database first')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=100000, help='history documents to seed')
+    parser.add_argument('--max-ratio', type=float, default=10.0, help='documents examined per document returned')
+    parser.add_argument('--strict', action='store_true', help='also fail on warnings')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    if args.database == DATABASE_NAME:
+        parser.error("refusing to use the application database; pick a scratch --database")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    MongoDB.connect_db()
+    try:
+        db = MongoDB.client[args.database]
+        if args.seed:
+            logger.info(f"Seeded {seed(db, args.users, max(1, args.items))}")
+        results = audit(db, args.max_ratio)
+    finally:
+        MongoDB.close_db()
+
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+    else:
+        _report(results)
+    failed = any(result['failures'] or (args.strict and result['warnings']) for result in results)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -272,8 +272,8 @@ function Dashboard() {
                   </div>
                   <div className="recent-content">
                     <p className="recent-text">
-                      {item.input_text?.substring(0, 80)}
-                      {item.input_text?.length > 80 ? '...' : ''}
+                      {item.input_preview?.substring(0, 80)}
+                      {item.input_length > 80 ? '...' : ''}
                     </p>
                     <span className="recent-date">
                       {new Date(item.created_at).toLocaleDateString('en-US', {
@@ -12,11 +12,13 @@ function HistoryPage() {
     history,
     currentPage,
     pageSize,
+    nextCursor,
     setCurrentPage,
     removeFromHistory,
     clearHistory,
     getPaginatedHistory,
-    fetchHistory
+    fetchHistory,
+    fetchMoreHistory
   } = useHistoryStore()
 
   // Redirect if not authenticated
@@ -34,6 +36,20 @@ function HistoryPage() {
   const { items, total, hasMore } = getPaginatedHistory()
   const totalPages = Math.ceil(total / pageSize)
 
+  const handleNextPage = async () => {
+    const nextPage = currentPage + 1
+    // Load the following server page before showing a page it would fill
+    if ((nextPage + 1) * pageSize > history.length && nextCursor) {
+      try {
+        await fetchMoreHistory()
+      } catch (error) {
+        toast.error(error?.response?.data?.detail || 'Failed to load history')
+        return
+      }
+    }
+    setCurrentPage(nextPage)
+  }
+
   const handleDelete = async (id) => {
     if (window.confirm('Are you sure you want to delete this item?')) {
       try {
@@ -113,13 +129,13 @@ function HistoryPage() {
             <div className="item-body">
               <div className="text-preview">
                 <p className="label">Input:</p>
-                <p className="text">{item.input_text.substring(0, 100)}...</p>
+                <p className="text">{(item.input_preview || '').substring(0, 100)}...</p>
               </div>
 
-              {item.output_text && (
+              {item.output_preview && (
                 <div className="text-preview">
                   <p className="label">Output:</p>
-                  <p className="text">{item.output_text.substring(0, 100)}...</p>
+                  <p className="text">{item.output_preview.substring(0, 100)}...</p>
                 </div>
               )}
 
@@ -165,7 +181,7 @@ function HistoryPage() {
           <button
             className="btn btn-sm"
             disabled={!hasMore}
-            onClick={() => setCurrentPage(currentPage + 1)}
+            onClick={handleNextPage}
           >
             Next →
           </button>
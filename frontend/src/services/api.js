@@ -132,11 +132,15 @@ export const batchAPI = {
 
 // History API calls
 export const historyAPI = {
-  getHistory: (limit = 20, offset = 0, type = null, search = null) => {
-    const params = new URLSearchParams({
-      limit,
-      offset
-    })
+  // Pass the previous page's next_cursor to continue; only the first page
+  // asks the server to count the total.
+  getHistory: (limit = 20, cursor = null, type = null, search = null) => {
+    const params = new URLSearchParams({ limit })
+    if (cursor) {
+      params.append('cursor', cursor)
+    } else {
+      params.append('include_total', true)
+    }
     if (type) params.append('type', type)
     if (search) params.append('search', search)
 
@@ -1,10 +1,17 @@
 import { create } from 'zustand'
 import { historyAPI } from '../services/api'
 
+const normalizeItems = (items) => (items || []).map(item => ({
+  ...item,
+  id: item.id || item._id
+}))
+
 const useHistoryStore = create((set, get) => ({
   // State
   history: [],
   totalCount: 0,
+  nextCursor: null,
+  query: { type: null, search: null },
   currentPage: 0,
   pageSize: 20,
   filterType: null,
@@ -15,17 +22,16 @@ const useHistoryStore = create((set, get) => ({
   // Actions
   setHistory: (history) => set({ history }),
 
-  fetchHistory: async (limit = 100, offset = 0, type = null, search = null) => {
+  fetchHistory: async (limit = 100, type = null, search = null) => {
     set({ loading: true, error: null })
     try {
-      const response = await historyAPI.getHistory(limit, offset, type, search)
-      const normalized = (response.items || []).map(item => ({
-        ...item,
-        id: item.id || item._id
-      }))
+      const response = await historyAPI.getHistory(limit, null, type, search)
+      const normalized = normalizeItems(response.items)
       set({
         history: normalized,
-        totalCount: response.total || normalized.length,
+        totalCount: response.total ?? normalized.length,
+        nextCursor: response.next_cursor || null,
+        query: { type, search },
         loading: false,
         error: null
       })
@@ -36,6 +42,29 @@ const useHistoryStore = create((set, get) => ({
     }
   },
 
+  // Append the page after the loaded items (no-op once the last page is loaded)
+  fetchMoreHistory: async (limit = 100) => {
+    const { nextCursor, query } = get()
+    if (!nextCursor) return null
+
+    set({ loading: true, error: null })
+    try {
+      const response = await historyAPI.getHistory(limit, nextCursor, query.type, query.search)
+      const normalized = normalizeItems(response.items)
+      set(state => ({
+        history: [...state.history, ...normalized],
+        totalCount: Math.max(state.totalCount, state.history.length + normalized.length),
+        nextCursor: response.next_cursor || null,
+        loading: false,
+        error: null
+      }))
+      return response
+    } catch (error) {
+      set({ loading: false, error: error.message || 'Failed to load history' })
+      throw error
+    }
+  },
+
   addToHistory: (item) => {
     set(state => ({
       history: [item, ...state.history],
@@ -84,6 +113,7 @@ const useHistoryStore = create((set, get) => ({
     set({
       history: [],
       totalCount: 0,
+      nextCursor: null,
       currentPage: 0,
       filterType: null,
       searchText: ''
@@ -101,8 +131,8 @@ const useHistoryStore = create((set, get) => ({
     if (state.searchText) {
       const search = state.searchText.toLowerCase()
       filtered = filtered.filter(item =>
-        item.input_text?.toLowerCase().includes(search) ||
-        item.output_text?.toLowerCase().includes(search)
+        item.input_preview?.toLowerCase().includes(search) ||
+        item.output_preview?.toLowerCase().includes(search)
       )
     }
 
@@ -111,13 +141,15 @@ const useHistoryStore = create((set, get) => ({
 
   getPaginatedHistory: () => {
     const filtered = get().getFilteredHistory()
-    const { currentPage, pageSize } = get()
+    const { currentPage, pageSize, totalCount, nextCursor, filterType, searchText } = get()
     const start = currentPage * pageSize
     const end = start + pageSize
+    // Without local filters the server total also counts pages not loaded yet
+    const total = filterType || searchText ? filtered.length : Math.max(totalCount, filtered.length)
     return {
       items: filtered.slice(start, end),
-      total: filtered.length,
-      hasMore: end < filtered.length
+      total,
+      hasMore: end < filtered.length || Boolean(nextCursor)
     }
   }
 }))